@@ -0,0 +1,290 @@
+"""
+AI assistant for ELFT Invoice Platform
+Turns a finance question into SQL, runs it and asks the model to analyse the
+results. chat_events() yields each step as an event so the API can stream
+tokens, the SQL, the results and the analysis as they happen.
+
+Model calls stream with the Anthropic client on the request's own
+greenlet: gunicorn's gevent workers (gunicorn.conf.py) patch its socket
+waits to yield, so one worker relays many conversations at once.
+"""
+import hashlib
+import json
+import re
+import time
+from types import SimpleNamespace
+
+from cache import LRUCache, data_version
+from catalog import get_catalog_prompt
+from metrics import ai_sql_duration, model_call_duration, model_errors, model_first_token, model_tokens
+from config import (ANTHROPIC_API_KEY, ANTHROPIC_MODEL, AI_CLIENT, AI_CACHE_MAX_ENTRIES,
+                    AI_QUESTION_CACHE_TTL, AI_RESULT_CACHE_TTL)
+
+MAX_TOKENS = 4096
+# Result rows shown to the model and returned to the browser
+RESULT_ROWS = 50
+
+PROMPT_INTRO = "You are a finance analyst for ELFT NHS Trust with access to PostgreSQL database.\n\n"
+
+# Fallback schema description, used until catalog.py has built one from the data
+STATIC_SCHEMA = """DATABASE SCHEMA:
+- ap_transactions: payment data with columns:
+  * party (supplier name)
+  * amount_gbp (transaction amount)
+  * month (format: 'APR-24', 'MAY-24', etc.)
+  * source ('PO', 'No PO', 'Interface Invoice', 'Payment Requested')
+  * final_category (spending category - see examples below)
+  * directorate (organizational unit - see examples below)
+  * transaction_date, description, etc.
+
+- contracts: contract register (supplier, contract_name, estimated_total_contract_value, start_date, end_date)
+
+IMPORTANT - ACTUAL DATA VALUES:
+Top spending categories in final_category:
+- 'Estates and Facilities', 'NHS Providers', 'Private Providers', 'Voluntary Sector', 'Digital and IT', 'Agency', 'Data', 'Training', 'Supplies', 'Local Authority'
+
+Directorates:
+- 'CORPORATE', 'BEDFORDSHIRE CHS', 'Bedford Directorate', 'TOWER HAMLETS', 'ESTATES & FACILITIES', 'PRIMARY CARE', 'SPECIALIST SERVICES', 'CITY & HACKNEY', 'NEWHAM', 'Luton Directorate', etc.
+
+Date range: APR-24 to SEP-24 (financial year 24/25)
+"""
+
+SQL_INSTRUCTIONS = """
+CRITICAL INSTRUCTIONS FOR SQL QUERIES:
+1. Generate ONE SQL query to get data
+2. Mark SQL with "SQL_QUERY:" on its own line
+3. Put ONLY the SQL code after "SQL_QUERY:" - NO explanatory text within the SQL block
+4. End the SQL with a semicolon
+5. Put explanations BEFORE the SQL block, never inside it
+6. I will execute it and send you the results - DO NOT generate multiple queries
+
+CORRECT Example:
+To answer this, I'll query the database for agency spending.
+
+SQL_QUERY:
+SELECT SUM(amount_gbp) as total_spend, COUNT(*) as transaction_count
+FROM ap_transactions
+WHERE final_category = 'Agency';
+
+WRONG Example (DO NOT DO THIS):
+SQL_QUERY:
+SELECT SUM(amount_gbp) as total_spend
+FROM ap_transactions
+WHERE final_category = 'Agency';
+
+Let me also check the breakdown by month:
+SQL_QUERY:
+SELECT month, SUM(amount_gbp) as spend FROM ap_transactions WHERE final_category = 'Agency' GROUP BY month;
+"""
+
+def system_prompt():
+    """System prompt built around the latest schema catalog (or STATIC_SCHEMA)"""
+    return PROMPT_INTRO + (get_catalog_prompt() or STATIC_SCHEMA) + SQL_INSTRUCTIONS
+
+def extract_sql(response_text):
+    """Pull the query following SQL_QUERY: out of a model reply (None if there isn't one)"""
+    sql_query = None
+    if "SQL_QUERY:" in response_text:
+        parts = response_text.split("SQL_QUERY:", 1)
+        if len(parts) > 1:
+            sql_section = parts[1]
+
+            # Handle code blocks
+            if "```" in sql_section:
+                # Extract from code block
+                code_blocks = sql_section.split("```")
+                for block in code_blocks:
+                    if block.strip() and not block.strip().startswith('sql'):
+                        # Remove 'sql' language identifier if present
+                        sql_query = block.replace('sql\n', '').replace('sql ', '').strip()
+                        break
+            else:
+                # No code blocks - extract until next paragraph or end
+                # Split by double newline or look for explanation text
+                lines = sql_section.split('\n')
+                sql_lines = []
+                for line in lines:
+                    stripped = line.strip()
+                    # Stop at empty line followed by explanatory text
+                    if not stripped and sql_lines:
+                        break
+                    # Skip lines that look like explanations (start with "This", "The", etc.)
+                    if stripped and not any(stripped.startswith(word) for word in ['This ', 'The ', 'Here ', 'It ', 'Note:']):
+                        sql_lines.append(line)
+                    elif sql_lines:  # Already collecting SQL, hit explanation
+                        break
+                sql_query = '\n'.join(sql_lines).strip()
+
+            # Clean up the SQL
+            if sql_query:
+                # Remove any trailing explanation text that might have slipped through
+                sql_query = sql_query.split('\n\nThis')[0].split('\n\nThe')[0].strip()
+                # Ensure it ends with semicolon
+                if not sql_query.endswith(';'):
+                    sql_query += ';'
+    return sql_query
+
+# Normalized question -> first model reply (with its SQL), scoped to the
+# current data version: each import rebuilds the catalog in the system prompt,
+# so SQL written against the old categories and date ranges is dropped
+question_cache = LRUCache(AI_CACHE_MAX_ENTRIES, AI_QUESTION_CACHE_TTL)
+# SQL fingerprint -> result rows, scoped to the current data version
+result_cache = LRUCache(AI_CACHE_MAX_ENTRIES, AI_RESULT_CACHE_TTL)
+
+def normalize_question(question):
+    """Case, spacing and trailing punctuation don't change what is being asked"""
+    return re.sub(r'\s+', ' ', question.strip().lower()).rstrip('?!. ')
+
+def sql_fingerprint(sql):
+    """Whitespace-insensitive hash of a query (literals keep their case)"""
+    return hashlib.md5(re.sub(r'\s+', ' ', sql.strip().rstrip(';')).encode()).hexdigest()
+
+class StubClient:
+    """Offline stand-in for Anthropic (AI_CLIENT=stub)
+
+    Answers every question with `sql` and every follow-up with a short
+    analysis, streamed word by word like the real client.
+    """
+
+    DEFAULT_SQL = (
+        "SELECT final_category, SUM(amount_gbp) as total_spend\n"
+        "FROM ap_transactions\n"
+        "GROUP BY final_category\n"
+        "ORDER BY total_spend DESC\n"
+        "LIMIT 5;"
+    )
+
+    def __init__(self, sql=DEFAULT_SQL, delay=0.0):
+        self.sql = sql
+        self.delay = delay
+        self.calls = []
+        self.messages = SimpleNamespace(stream=self._stream)
+
+    def _reply(self, messages):
+        if len(messages) == 1:
+            return f"I'll query the database to answer this.\n\nSQL_QUERY:\n{self.sql}"
+        return "Stub analysis: the query returned the results shown above."
+
+    def _stream(self, **kwargs):
+        self.calls.append(kwargs)
+        return _StubStream(self._reply(kwargs['messages']), self.delay)
+
+class _StubStream:
+    """Context manager mimicking anthropic's MessageStream"""
+
+    def __init__(self, text, delay):
+        self.text = text
+        self.delay = delay
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        for i, word in enumerate(self.text.split(' ')):
+            time.sleep(self.delay)
+            yield word if i == 0 else ' ' + word
+
+    def get_final_message(self):
+        return SimpleNamespace(
+            content=[SimpleNamespace(type='text', text=self.text)],
+            usage=SimpleNamespace(input_tokens=0, output_tokens=len(self.text.split(' '))),
+        )
+
+def create_client():
+    """The configured model client, or None when no API key is set"""
+    if AI_CLIENT == 'stub':
+        return StubClient()
+    if not ANTHROPIC_API_KEY:
+        return None
+    from anthropic import Anthropic
+    return Anthropic(api_key=ANTHROPIC_API_KEY)
+
+def _stream_reply(client, stage, messages):
+    """Relay one model reply as token events; the full text is the generator's return value"""
+    text = ''
+    started = time.perf_counter()
+    try:
+        # Leaving the block early (the browser went away) closes the model call
+        with client.messages.stream(model=ANTHROPIC_MODEL, max_tokens=MAX_TOKENS,
+                                    system=system_prompt(), messages=messages) as stream:
+            for chunk in stream.text_stream:
+                if not text:
+                    model_first_token.observe(time.perf_counter() - started, stage=stage)
+                text += chunk
+                yield 'token', {'stage': stage, 'text': chunk}
+            message = stream.get_final_message()
+        if getattr(message, 'usage', None) is not None:
+            model_tokens.inc(message.usage.input_tokens, stage=stage, direction='input')
+            model_tokens.inc(message.usage.output_tokens, stage=stage, direction='output')
+    except Exception:
+        model_errors.inc(stage=stage)
+        raise
+    finally:
+        model_call_duration.observe(time.perf_counter() - started, stage=stage)
+    return text
+
+def chat_events(client, question, execute_sql):
+    """Answer `question`, yielding (event, data) pairs as each step completes
+
+    Events: token (stage 'answer' then 'analysis'), sql, results (the
+    only event carrying rows), and finally done or error.
+    `execute_sql(sql)` returns (columns, rows, truncated), at most
+    RESULT_ROWS rows. Repeat questions reuse the cached first reply, and
+    repeat SQL reuses cached results, until the next import.
+    """
+    question_key = normalize_question(question)
+    messages = [{"role": "user", "content": question}]
+    version = data_version.current()[0]
+
+    cached = question_cache.get(question_key, version)
+    if cached:
+        response_text = cached['response_text']
+        yield 'token', {'stage': 'answer', 'text': response_text, 'cached': True}
+    else:
+        response_text = yield from _stream_reply(client, 'answer', messages)
+        question_cache.set(question_key, version, {'response_text': response_text})
+
+    sql_query = extract_sql(response_text)
+    data_results = None
+    if sql_query:
+        yield 'sql', {'sql': sql_query}
+
+        fingerprint = sql_fingerprint(sql_query)
+        cached = result_cache.get(fingerprint, version)
+        if cached:
+            data_results, row_count, truncated = cached['data'], cached['row_count'], cached['truncated']
+        else:
+            started = time.perf_counter()
+            try:
+                columns, results, truncated = execute_sql(sql_query)
+            except Exception as e:
+                # Don't keep serving SQL that doesn't run
+                question_cache.discard(question_key)
+                yield 'error', {'error': f'SQL execution failed: {str(e)}', 'sql': sql_query}
+                return
+            finally:
+                ai_sql_duration.observe(time.perf_counter() - started)
+
+            data_results = {
+                'columns': columns,
+                'rows': [list(row) for row in results[:RESULT_ROWS]]
+            }
+            row_count = len(results)
+            result_cache.set(fingerprint, version,
+                             {'data': data_results, 'row_count': row_count, 'truncated': truncated})
+        yield 'results', dict(data_results, row_count=row_count, truncated=truncated,
+                              cached=cached is not None)
+
+        # Send results back to the model for analysis
+        messages += [
+            {"role": "assistant", "content": response_text},
+            {"role": "user", "content": f"Query executed. Results ({row_count} rows{', more not shown' if truncated else ''}):\n{json.dumps(data_results, indent=2, default=str)[:2000]}\n\nAnalyze these results."}
+        ]
+        response_text = yield from _stream_reply(client, 'analysis', messages)
+
+    # The rows went out with the results event
+    yield 'done', {'response': response_text, 'sql': sql_query}
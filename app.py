@@ -1,30 +1,85 @@
-from flask import Flask, render_template, jsonify, request
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from anthropic import Anthropic
+from flask import Flask, Response, render_template, jsonify, request, g, stream_with_context, copy_current_request_context
+from flask.json.provider import DefaultJSONProvider
 from decimal import Decimal
 from datetime import date, datetime
 import json
-from config import DB_CONFIG, ANTHROPIC_API_KEY
+import base64
+import time
+import psycopg2.errors
+from concurrent.futures import ThreadPoolExecutor
+from ai_assistant import chat_events, create_client, question_cache, result_cache
+from catalog import get_catalog_prompt
+from config import FLASK_DEBUG, FLASK_HOST, FLASK_PORT, CHART_QUERY_WORKERS, CHART_QUERY_TIMEOUT_MS
+from sql_sandbox import run_readonly_query
+from db import get_db_connection, get_pool
+from cache import cached_response, response_cache, data_version
+from cube import DIMENSIONS, get_cube
+from export import EXPORT_FORMATS, stream_export
+import metrics
+
+class AppJSONProvider(DefaultJSONProvider):
+    """Encode database values (Decimal, date, datetime) during the single json.dumps pass"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Decimal):
+            return float(o)
+        if isinstance(o, (date, datetime)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__)
+app.json = AppJSONProvider(app)
 
-# Initialize Anthropic client
+# Initialize the model client (None without an API key)
 try:
-    anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY)
+    ai_client = create_client()
 except:
-    anthropic_client = None
-
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
-
-def serialize_value(val):
-    """Convert database values to JSON-serializable format"""
-    if isinstance(val, Decimal):
-        return float(val)
-    if isinstance(val, (date, datetime)):
-        return val.isoformat()
-    return val
+    ai_client = None
+
+def fetch_rows(cursor):
+    """Column names and plain tuple rows of the last executed query"""
+    columns = [desc[0] for desc in cursor.description]
+    return columns, cursor.fetchall()
+
+def shape_rows(columns, rows, shape='records'):
+    """Rows as a list of dicts, or {'columns', 'rows'} arrays when shape='columns'
+
+    The columnar shape skips building a dict per row and keeps large
+    payloads small (each key is sent once).
+    """
+    if shape == 'columns':
+        return {'columns': columns, 'rows': rows}
+    return [dict(zip(columns, row)) for row in rows]
+
+# REQUEST INSTRUMENTATION
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Per-route latency and database time; Server-Timing shows the split in browser devtools
+
+    Streamed responses are timed up to their first byte.
+    """
+    started = g.get('started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = metrics.current_route()
+    queries = metrics.request_queries()
+    db_seconds = sum(seconds for _, seconds, _ in queries)
+
+    metrics.http_request_duration.observe(elapsed, method=request.method, route=route,
+                                          status=response.status_code)
+    metrics.http_request_db_time.observe(db_seconds, route=route)
+    response.headers['Server-Timing'] = (
+        f'db;dur={db_seconds * 1000:.1f};desc="{len(queries)} queries", '
+        f'total;dur={elapsed * 1000:.1f}'
+    )
+    return response
 
 # ROUTES
 @app.route('/')
@@ -41,103 +96,125 @@ def ai_page():
 
 # API ENDPOINTS
 
-@app.route('/api/dashboard/kpis')
-def get_kpis():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Exclude August 2024 and November 2024 (extreme values)
-    exclude_filter = "WHERE month NOT IN ('2024-08', '2024-11', 'Aug-24', 'Nov-24', 'August 2024', 'November 2024')"
-
-    # Total spend
-    cursor.execute(f"SELECT COALESCE(SUM(amount_gbp), 0) FROM ap_transactions {exclude_filter}")
-    result = cursor.fetchone()
-    total_spend = float(result['coalesce']) if result else 0
+# Exclude the months listed in EXCLUDED_MONTHS (extreme values); the importer
+# flags them as is_excluded and partial indexes cover the remaining rows
+EXCLUDE_FILTER = "WHERE NOT is_excluded"
 
-    # Active contracts
-    cursor.execute("SELECT COUNT(*) FROM contracts WHERE end_date > CURRENT_DATE")
-    active_contracts = cursor.fetchone()['count']
-
-    # Non-PO percentage (hardcoded as requested)
-    non_po_pct = 56.37
-    
-    # Expiring contracts (next 90 days)
-    cursor.execute("""
-        SELECT COUNT(*) 
-        FROM contracts 
-        WHERE end_date BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '90 days'
-    """)
-    expiring = cursor.fetchone()['count']
-    
-    # Unique suppliers
-    cursor.execute(f"SELECT COUNT(DISTINCT party) FROM ap_transactions {exclude_filter}")
-    suppliers = cursor.fetchone()['count']
-
-    # Average transaction
-    cursor.execute(f"SELECT COALESCE(AVG(amount_gbp), 0) FROM ap_transactions {exclude_filter}")
-    result = cursor.fetchone()
-    avg_transaction = float(result['coalesce']) if result else 0
-
-    # Suppliers without contracts
-    cursor.execute("SELECT COUNT(*) FROM vw_suppliers_without_contracts")
-    no_contract_suppliers = cursor.fetchone()['count']
-
-    # Top 20 concentration
-    cursor.execute(f"""
-        WITH supplier_totals AS (
-            SELECT party, SUM(amount_gbp) as spend
-            FROM ap_transactions
-            {exclude_filter}
-            GROUP BY party
-            ORDER BY spend DESC
-            LIMIT 20
-        )
+# Every spend KPI comes from a single grouped pass over ap_transactions;
+# contract counts and the no-contract supplier count ride along in the
+# same statement so the dashboard needs one round-trip.
+KPI_QUERY = f"""
+    WITH supplier_totals AS (
+        SELECT
+            party,
+            SUM(amount_gbp) as spend,
+            COUNT(amount_gbp) as txn_count
+        FROM ap_transactions
+        {EXCLUDE_FILTER}
+        GROUP BY party
+    ),
+    ranked AS (
         SELECT
+            party,
+            spend,
+            txn_count,
+            ROW_NUMBER() OVER (ORDER BY spend DESC) as spend_rank
+        FROM supplier_totals
+    ),
+    spend_kpis AS (
+        SELECT
+            COALESCE(SUM(spend), 0) as total_spend,
+            COUNT(party) as unique_suppliers,
+            COALESCE(SUM(spend) / NULLIF(SUM(txn_count), 0), 0) as avg_transaction,
             COALESCE(
-                ROUND(SUM(spend) / (SELECT SUM(amount_gbp) FROM ap_transactions {exclude_filter}) * 100, 1),
+                ROUND(SUM(spend) FILTER (WHERE spend_rank <= 20) / NULLIF(SUM(spend), 0) * 100, 1),
                 0
-            ) as pct
-        FROM supplier_totals
-    """)
-    result = cursor.fetchone()
-    concentration = float(result['pct'] or 0)
-    
-    cursor.close()
-    conn.close()
-    
-    return jsonify({
-        'total_spend': total_spend,
-        'active_contracts': active_contracts,
-        'non_po_percentage': non_po_pct,
-        'expiring_contracts': expiring,
-        'unique_suppliers': suppliers,
-        'avg_transaction': avg_transaction,
-        'no_contract_suppliers': no_contract_suppliers,
-        'top_20_concentration': concentration
-    })
+            ) as top_20_concentration
+        FROM ranked
+    ),
+    contract_kpis AS (
+        SELECT
+            COUNT(*) FILTER (WHERE end_date > CURRENT_DATE) as active_contracts,
+            COUNT(*) FILTER (
+                WHERE end_date BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '90 days'
+            ) as expiring_contracts
+        FROM contracts
+    )
+    SELECT
+        spend_kpis.*,
+        contract_kpis.*,
+        (SELECT COUNT(*) FROM mv_suppliers_without_contracts) as no_contract_suppliers
+    FROM spend_kpis, contract_kpis
+"""
 
-@app.route('/api/dashboard/charts')
-def get_chart_data():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def compute_kpis(cursor):
+    """Run the combined KPI query and return the dashboard payload"""
+    cursor.execute(KPI_QUERY)
+    columns, rows = fetch_rows(cursor)
+    return kpi_payload(dict(zip(columns, rows[0])))
+
+def kpi_payload(row):
+    """Dashboard KPIs from a KPI_QUERY row (or the same row computed by the cube)"""
+    return {
+        'total_spend': float(row['total_spend']),
+        'active_contracts': row['active_contracts'],
+        # Non-PO percentage (hardcoded as requested)
+        'non_po_percentage': 56.37,
+        'expiring_contracts': row['expiring_contracts'],
+        'unique_suppliers': row['unique_suppliers'],
+        'avg_transaction': float(row['avg_transaction']),
+        'no_contract_suppliers': row['no_contract_suppliers'],
+        'top_20_concentration': float(row['top_20_concentration'])
+    }
+
+# Likely duplicate invoices found by duplicates.py; the value counts each
+# later invoice of a pair once
+DUPLICATE_KPI_QUERY = """
+    SELECT
+        COUNT(*) as possible_duplicates,
+        COUNT(*) FILTER (WHERE match_type = 'exact') as exact_duplicates,
+        (
+            SELECT COALESCE(SUM(amount_gbp), 0)
+            FROM (SELECT DISTINCT transaction_id, amount_gbp FROM duplicate_invoices) d
+        ) as duplicate_value
+    FROM duplicate_invoices
+"""
 
-    # Exclude August 2024 and November 2024 (extreme values)
-    exclude_filter = "WHERE month NOT IN ('2024-08', '2024-11', 'Aug-24', 'Nov-24', 'August 2024', 'November 2024')"
+def duplicate_kpis(cursor):
+    """Duplicate invoice counts and value (zeros until database/upgrade.sql is applied)"""
+    try:
+        cursor.execute(DUPLICATE_KPI_QUERY)
+    except psycopg2.errors.UndefinedTable:
+        cursor.connection.rollback()
+        return {'possible_duplicates': 0, 'exact_duplicates': 0, 'duplicate_value': 0.0}
+    columns, rows = fetch_rows(cursor)
+    row = dict(zip(columns, rows[0]))
+    return {**row, 'duplicate_value': float(row['duplicate_value'])}
 
+@app.route('/api/dashboard/kpis')
+@cached_response
+def get_kpis():
+    cube = get_cube()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        kpis = kpi_payload(cube.kpi_row()) if cube is not None else compute_kpis(cursor)
+        kpis.update(duplicate_kpis(cursor))
+        cursor.close()
+
+    return jsonify(kpis)
+
+# Dashboard chart queries, keyed by their field in the /api/dashboard/charts payload
+CHART_QUERIES = {
     # Monthly trend
-    cursor.execute(f"""
+    'monthly_trend': f"""
         SELECT month, total_spend, non_po_spend, po_spend, non_po_percentage
-        FROM vw_monthly_dashboard
-        {exclude_filter}
-        ORDER BY month
-    """)
-    monthly = [dict(row) for row in cursor.fetchall()]
-    for row in monthly:
-        for key, val in row.items():
-            row[key] = serialize_value(val)
-    
+        FROM mv_monthly_dashboard
+        {EXCLUDE_FILTER}
+        ORDER BY period_month
+    """,
+
     # Category spend (Top 10) - exclude extreme months from the view calculation
-    cursor.execute(f"""
+    'category_spend': f"""
         SELECT
             final_category,
             SUM(amount_gbp) as total_spend,
@@ -147,19 +224,15 @@ def get_chart_data():
                 2
             ) as non_po_percentage
         FROM ap_transactions
-        {exclude_filter}
+        {EXCLUDE_FILTER}
         GROUP BY final_category
         HAVING SUM(amount_gbp) > 0
         ORDER BY total_spend DESC
         LIMIT 10
-    """)
-    categories = [dict(row) for row in cursor.fetchall()]
-    for row in categories:
-        for key, val in row.items():
-            row[key] = serialize_value(val)
-    
+    """,
+
     # Non-PO by directorate - calculate directly from ap_transactions (based on source)
-    cursor.execute(f"""
+    'directorate_spend': f"""
         SELECT
             directorate,
             SUM(amount_gbp) as spend,
@@ -169,271 +242,468 @@ def get_chart_data():
                 2
             ) as non_po_pct
         FROM ap_transactions
-        {exclude_filter}
+        {EXCLUDE_FILTER}
         AND directorate IS NOT NULL
         AND directorate != ''
         GROUP BY directorate
         HAVING SUM(amount_gbp) > 1000
         ORDER BY spend DESC
         LIMIT 10
-    """)
-    directorates = [dict(row) for row in cursor.fetchall()]
-    for row in directorates:
-        for key, val in row.items():
-            row[key] = serialize_value(val)
-    
-    cursor.close()
-    conn.close()
-    
+    """,
+}
+
+# The chart queries are independent scans, so each runs on its own pooled
+# connection; the endpoint takes as long as the slowest chart, not the sum.
+chart_executor = ThreadPoolExecutor(max_workers=CHART_QUERY_WORKERS, thread_name_prefix='chart-query')
+
+def submit_with_request_context(func, *args):
+    """Run func on chart_executor; the future's result is (func's result, queries it ran)
+
+    The task sees a copy of the request context, so its queries are
+    attributed to the calling route in /metrics.
+    """
+    @copy_current_request_context
+    def task():
+        return func(*args), metrics.request_queries()
+    return chart_executor.submit(task)
+
+def run_chart_query(query):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET LOCAL statement_timeout = %s", (CHART_QUERY_TIMEOUT_MS,))
+        cursor.execute(query)
+        rows = shape_rows(*fetch_rows(cursor))
+        cursor.close()
+        conn.rollback()
+    return rows
+
+@app.route('/api/dashboard/charts')
+@cached_response
+def get_chart_data():
+    """All dashboard charts; a chart whose query fails comes back empty and is listed in `errors`"""
+    cube = get_cube()
+    if cube is not None:
+        return jsonify(cube.chart_data())
+
+    futures = {name: submit_with_request_context(run_chart_query, query)
+               for name, query in CHART_QUERIES.items()}
+
+    charts = {}
+    errors = {}
+    for name, future in futures.items():
+        try:
+            charts[name], queries = future.result()
+            g.setdefault('queries', []).extend(queries)
+        except Exception as e:
+            print(f"Chart {name} failed: {e}")
+            charts[name] = []
+            errors[name] = (str(e).strip().splitlines() or [type(e).__name__])[0]
+
+    if len(errors) == len(CHART_QUERIES):
+        return jsonify({**charts, 'errors': errors}), 500
+    response = jsonify({**charts, 'errors': errors} if errors else charts)
+    if errors:
+        # Don't serve a partly broken dashboard from the cache until the next import
+        response.cache_control.no_store = True
+    return response
+
+def parse_month(value):
+    """'YYYY-MM' (or a full date) as the first of that month; None when blank"""
+    if not value:
+        return None
+    parsed = datetime.strptime(value[:7], '%Y-%m')
+    return date(parsed.year, parsed.month, 1)
+
+@app.route('/api/dashboard/drilldown')
+@cached_response
+def dashboard_drilldown():
+    """Spend grouped by month, category, directorate or source, answered from the cube
+
+    Filters: `directorate`, `category` and `source` (repeat a parameter to
+    keep several values) and a `from` / `to` month range (YYYY-MM,
+    inclusive). Excluded months are left out, as on the dashboard.
+    """
+    group_by = request.args.get('group_by', 'category')
+    if group_by not in DIMENSIONS:
+        return jsonify({'success': False, 'error': f"group_by must be one of {', '.join(DIMENSIONS)}"}), 400
+    try:
+        month_from = parse_month(request.args.get('from'))
+        month_to = parse_month(request.args.get('to'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'from / to must be months as YYYY-MM'}), 400
+
+    cube = get_cube()
+    if cube is None:
+        return jsonify({'success': False, 'error': 'Drill-down is unavailable without the dashboard cube'}), 503
+
+    members = {dim: request.args.getlist(dim) for dim in ('category', 'directorate', 'source')}
+    rows, totals = cube.drilldown(group_by, month_from, month_to, **members)
     return jsonify({
-        'monthly_trend': monthly,
-        'category_spend': categories,
-        'directorate_spend': directorates
+        'success': True,
+        'group_by': group_by,
+        'filters': {**{dim: values for dim, values in members.items() if values},
+                    'from': month_from, 'to': month_to},
+        'rows': rows,
+        'totals': totals,
     })
 
+# Valid sort columns whitelist
+CONTRACT_SORT_COLUMNS = {
+    'supplier': 'supplier',
+    'contract_name': 'contract_name',
+    'category': 'category',
+    'status': 'status',
+    'budget': 'annual_value_current',
+    'invoiced': 'invoiced_ytd',
+    'variance': 'variance_percentage',
+    'start_date': 'start_date',
+    'end_date': 'end_date'
+}
+
+CONTRACTS_PAGE_SIZE = 100
+CONTRACTS_MAX_PAGE_SIZE = 500
+
+def like_pattern(text):
+    """ILIKE pattern matching `text` anywhere, with its wildcards escaped"""
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def contract_filters(args):
+    """WHERE clause and params for the status / search filters of the contracts APIs"""
+    status_filter = args.get('status', 'all')
+    search = args.get('search', '').strip()
+
+    query = "WHERE 1=1"
+    params = []
+
+    if status_filter != 'all':
+        query += " AND status = %s"
+        params.append(status_filter)
+
+    if search:
+        # ILIKE substring match is served by the trigram indexes on the view
+        pattern = like_pattern(search)
+        query += " AND (supplier ILIKE %s OR contract_name ILIKE %s)"
+        params.extend([pattern, pattern])
+
+    return query, params
+
+def contract_sort_terms(args):
+    """Ordered (column, descending) terms; the last term makes the order unique"""
+    db_sort = CONTRACT_SORT_COLUMNS.get(args.get('sort', 'status'), 'status')
+    descending = args.get('order', 'asc').lower() != 'asc'
+
+    if db_sort == 'status':
+        # Custom ordering (status_rank) to prioritize critical statuses
+        return [('status_rank', descending), ('invoiced_ytd', True), ('row_key', False)]
+    return [(db_sort, descending), ('row_key', descending)]
+
+def contract_order_by(terms):
+    return "ORDER BY " + ", ".join(f"{col} {'DESC' if desc else 'ASC'}" for col, desc in terms)
+
+def keyset_condition(terms, values):
+    """Rows strictly after `values` in the order given by `terms`
+
+    Postgres sorts NULLs last ascending and first descending, so NULL is
+    treated as the largest value of a column.
+    """
+    clauses = []
+    params = []
+    for i, (col, desc) in enumerate(terms):
+        parts = []
+        part_params = []
+        # Every earlier term equal...
+        for prev_col, _ in terms[:i]:
+            if values[prev_col] is None:
+                parts.append(f"{prev_col} IS NULL")
+            else:
+                parts.append(f"{prev_col} = %s")
+                part_params.append(values[prev_col])
+        # ...and this one past the cursor
+        value = values[col]
+        if value is None:
+            if not desc:
+                continue
+            parts.append(f"{col} IS NOT NULL")
+        elif desc:
+            parts.append(f"{col} < %s")
+            part_params.append(value)
+        else:
+            parts.append(f"({col} > %s OR {col} IS NULL)")
+            part_params.append(value)
+        clauses.append("(" + " AND ".join(parts) + ")")
+        params.extend(part_params)
+
+    if not clauses:
+        return "FALSE", []
+    return "(" + " OR ".join(clauses) + ")", params
+
+def encode_cursor(columns, row, terms):
+    """Opaque page token holding the sort values of the last row returned"""
+    values = [row[columns.index(col)] for col, _ in terms]
+    values = [None if val is None else str(val) for val in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(token, terms):
+    values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    if not isinstance(values, list) or len(values) != len(terms):
+        raise ValueError("Invalid cursor for this sort order")
+    return {col: value for (col, _), value in zip(terms, values)}
+
 @app.route('/api/contracts')
+@cached_response
 def get_contracts():
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get status filter
-        status_filter = request.args.get('status', 'all')
-        search = request.args.get('search', '')
-        
-        # Base query
-        query = "SELECT * FROM vw_contract_vs_invoiced WHERE 1=1"
-        params = []
-        
-        # Apply filters
-        if status_filter != 'all':
-            query += " AND status = %s"
-            params.append(status_filter)
-        
-        if search:
-            query += " AND (LOWER(supplier) LIKE %s OR LOWER(contract_name) LIKE %s)"
-            params.extend([f'%{search.lower()}%', f'%{search.lower()}%'])
+    """One page of contracts, paged by keyset cursor
 
-        sort_col = request.args.get('sort', 'status')
-        sort_order = request.args.get('order', 'asc')
-        
-        # Valid sort columns whitelist
-        valid_cols = {
-            'supplier': 'supplier',
-            'contract_name': 'contract_name',
-            'category': 'category',
-            'status': 'status',
-            'budget': 'annual_value_current',
-            'invoiced': 'invoiced_ytd',
-            'variance': 'variance_percentage',
-            'start_date': 'start_date',
-            'end_date': 'end_date'
-        }
-        
-        db_sort = valid_cols.get(sort_col, 'status')
-        db_order = 'ASC' if sort_order.lower() == 'asc' else 'DESC'
-
-        # Custom ordering for status to prioritize critical statuses
-        if db_sort == 'status':
-            query += f""" ORDER BY
-                CASE status
-                    WHEN 'NO_CONTRACT' THEN 1
-                    WHEN 'EXPIRED' THEN 2
-                    WHEN 'OVERSPEND' THEN 3
-                    WHEN 'UNDERUTILIZED' THEN 4
-                    WHEN 'NO_ACTIVITY' THEN 5
-                    WHEN 'ON_TRACK' THEN 6
-                    ELSE 7
-                END {db_order},
-                invoiced_ytd DESC
-                LIMIT 100"""
-        else:
-            query += f" ORDER BY {db_sort} {db_order}, status ASC LIMIT 100"
-        
-        cursor.execute(query, params)
-        contracts = [dict(row) for row in cursor.fetchall()]
-        
-        # Serialize values
-        for contract in contracts:
-            for key, val in contract.items():
-                contract[key] = serialize_value(val)
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
+    Pass `cursor` from the previous page's `next_cursor` to continue;
+    `include_total=true` adds the total match count (an extra query) and
+    `shape=columns` returns the page as column names plus row arrays.
+    """
+    try:
+        where, params = contract_filters(request.args)
+        terms = contract_sort_terms(request.args)
+        limit = min(max(request.args.get('limit', CONTRACTS_PAGE_SIZE, type=int), 1), CONTRACTS_MAX_PAGE_SIZE)
+
+        page_where = where
+        page_params = list(params)
+        cursor_token = request.args.get('cursor')
+        if cursor_token:
+            try:
+                after, after_params = keyset_condition(terms, decode_cursor(cursor_token, terms))
+            except (ValueError, TypeError):
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+            page_where += f" AND {after}"
+            page_params += after_params
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            # Fetch one extra row to know whether another page exists
+            cursor.execute(f"""
+                SELECT * FROM mv_contract_vs_invoiced
+                {page_where}
+                {contract_order_by(terms)}
+                LIMIT %s
+            """, page_params + [limit + 1])
+            columns, rows = fetch_rows(cursor)
+
+            total = None
+            if request.args.get('include_total', 'false').lower() == 'true':
+                cursor.execute(f"SELECT COUNT(*) FROM mv_contract_vs_invoiced {where}", params)
+                total = cursor.fetchone()[0]
+
+            cursor.close()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(columns, rows[-1], terms) if has_more else None
+
+        result = {
             'success': True,
-            'contracts': contracts,
-            'count': len(contracts)
-        })
+            'contracts': shape_rows(columns, rows, request.args.get('shape', 'records')),
+            'count': len(rows),
+            'has_more': has_more,
+            'next_cursor': next_cursor
+        }
+        if total is not None:
+            result['total'] = total
+        return jsonify(result)
         
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# EXPORTS
+
+# mv_contract_vs_invoiced without its internal row_key / status_rank
+CONTRACT_EXPORT_COLUMNS = [
+    'contract_id', 'supplier', 'contract_reference', 'contract_name', 'contract_value',
+    'annual_value_current', 'start_date', 'end_date', 'service_rag', 'category', 'invoiced_ytd',
+    'invoice_count', 'non_po_spend_ytd', 'last_invoice_date', 'variance_percentage', 'status',
+    'days_to_expiry', 'high_non_po_risk',
+]
+
+TRANSACTION_EXPORT_COLUMNS = [
+    'transaction_id', 'transaction_date', 'period_month', 'party', 'description', 'amount_gbp',
+    'source', 'final_category', 'sub_category', 'directorate', 'department', 'service',
+    'cost_centre_description', 'subjective_name', 'source_transaction', 'financial_year',
+    'is_excluded',
+]
+
+def transaction_filters(args):
+    """WHERE clause and params for the transaction export filters
+
+    `from` / `to` bound transaction_date (inclusive, so only the matching
+    partitions are read); `directorate`, `category` and `source` can be
+    repeated; `supplier` is a substring of the party name. Excluded months
+    are left out unless include_excluded=true. Raises ValueError on a bad date.
+    """
+    query = "WHERE 1=1"
+    params = []
+
+    if args.get('include_excluded', 'false').lower() != 'true':
+        query += " AND NOT is_excluded"
+    for arg, op in (('from', '>='), ('to', '<=')):
+        if args.get(arg):
+            query += f" AND transaction_date {op} %s"
+            params.append(date.fromisoformat(args[arg]))
+    for arg, column in (('directorate', 'directorate'), ('category', 'final_category'), ('source', 'source')):
+        values = args.getlist(arg)
+        if values:
+            query += f" AND {column} = ANY(%s)"
+            params.append(values)
+
+    supplier = args.get('supplier', '').strip()
+    if supplier:
+        query += " AND party ILIKE %s"
+        params.append(like_pattern(supplier))
+
+    return query, params
+
+def export_response(name, query, params):
+    """Stream `query` as a CSV (default) or XLSX download, ?format=xlsx"""
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    def generate():
+        # The connection is held until the last row is sent (or the client goes away)
+        with get_db_connection() as conn:
+            yield from stream_export(conn, query, params, fmt, sheet_name=name)
+
+    filename = f"{name}-{date.today():%Y-%m-%d}.{fmt}"
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/export/contracts')
+def export_contracts():
+    """Every contract matching the /api/contracts filters, in the same order"""
+    where, params = contract_filters(request.args)
+    return export_response('contracts', f"""
+        SELECT {', '.join(CONTRACT_EXPORT_COLUMNS)} FROM mv_contract_vs_invoiced
+        {where}
+        {contract_order_by(contract_sort_terms(request.args))}
+    """, params)
+
+@app.route('/api/export/suppliers-without-contracts')
+def export_suppliers_without_contracts():
+    return export_response('suppliers-without-contracts', """
+        SELECT * FROM mv_suppliers_without_contracts
+        ORDER BY total_spend DESC NULLS LAST, supplier_name, final_category, directorate
+    """, [])
+
+@app.route('/api/export/transactions')
+def export_transactions():
+    """AP transactions matching the filters of transaction_filters, oldest first"""
+    try:
+        where, params = transaction_filters(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'from / to must be dates as YYYY-MM-DD'}), 400
+    return export_response('transactions', f"""
+        SELECT {', '.join(TRANSACTION_EXPORT_COLUMNS)} FROM ap_transactions
+        {where}
+        ORDER BY transaction_date, transaction_id
+    """, params)
+
+# DUPLICATE INVOICES
+
+DUPLICATES_PAGE_SIZE = 100
+DUPLICATES_MAX_PAGE_SIZE = 1000
+DUPLICATE_MATCH_TYPES = ('exact', 'near')
+
+@app.route('/api/duplicates')
+@cached_response
+def get_duplicates():
+    """Likely duplicate invoices found by duplicates.py, highest score first
+
+    Each pair shows the later transaction next to the earlier one it
+    duplicates. Filters: `min_score` (0-1), `match_type` ('exact' or
+    'near') and `supplier` (part of the supplier name); paged with
+    `limit` / `offset`. Archived years drop out of the list.
+    """
+    match_type = request.args.get('match_type')
+    if match_type and match_type not in DUPLICATE_MATCH_TYPES:
+        return jsonify({'success': False, 'error': "match_type must be 'exact' or 'near'"}), 400
+    limit = min(max(request.args.get('limit', DUPLICATES_PAGE_SIZE, type=int), 1), DUPLICATES_MAX_PAGE_SIZE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    where = "WHERE d.score >= %s"
+    params = [request.args.get('min_score', 0, type=float)]
+    if match_type:
+        where += " AND d.match_type = %s"
+        params.append(match_type)
+    supplier = request.args.get('supplier', '').strip()
+    if supplier:
+        where += " AND s.supplier_name ILIKE %s"
+        params.append(like_pattern(supplier))
+
+    pairs = f"""
+        FROM duplicate_invoices d
+        JOIN ap_transactions t
+            ON t.transaction_id = d.transaction_id AND t.transaction_date = d.transaction_date
+        JOIN ap_transactions o
+            ON o.transaction_id = d.duplicate_of AND o.transaction_date = d.duplicate_of_date
+        LEFT JOIN suppliers s ON s.supplier_id = d.supplier_id
+        {where}
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT
+                    d.transaction_id, d.transaction_date, d.duplicate_of, d.duplicate_of_date,
+                    s.supplier_name, t.party, o.party as duplicate_of_party,
+                    d.amount_gbp, d.duplicate_of_amount, d.days_apart, d.score, d.match_type,
+                    t.description, o.description as duplicate_of_description,
+                    t.source_transaction, o.source_transaction as duplicate_of_source_transaction,
+                    d.detected_at
+                {pairs}
+                ORDER BY d.score DESC, d.amount_gbp DESC, d.transaction_id, d.duplicate_of
+                LIMIT %s OFFSET %s
+            """, params + [limit, offset])
+        except psycopg2.errors.UndefinedTable:
+            return jsonify({'success': False, 'error': 'Apply database/upgrade.sql to enable duplicate detection'}), 503
+        columns, rows = fetch_rows(cursor)
+        cursor.execute(f"SELECT COUNT(*) {pairs}", params)
+        total = cursor.fetchone()[0]
+        cursor.execute("SELECT scanned_at, rows_scanned, duration_ms FROM duplicate_scan")
+        scan = shape_rows(*fetch_rows(cursor))
+        summary = duplicate_kpis(cursor)
+        cursor.close()
+
+    return jsonify({
+        'success': True,
+        'duplicates': shape_rows(columns, rows),
+        'count': len(rows),
+        'total': total,
+        'summary': summary,
+        'last_scan': scan[0] if scan else None
+    })
+
+AI_NOT_CONFIGURED = 'Anthropic API key not configured. Set ANTHROPIC_API_KEY environment variable.'
+
 @app.route('/api/ai/chat', methods=['POST'])
 def ai_chat():
     data = request.json
     question = data.get('question', '')
     
-    if not anthropic_client:
+    if not ai_client:
         return jsonify({
             'success': False,
-            'error': 'Anthropic API key not configured. Set ANTHROPIC_API_KEY environment variable.'
+            'error': AI_NOT_CONFIGURED
         })
     
     try:
-        # System prompt with database schema
-        system_prompt = """You are a finance analyst for ELFT NHS Trust with access to PostgreSQL database.
-
-DATABASE SCHEMA:
-- ap_transactions: payment data with columns:
-  * party (supplier name)
-  * amount_gbp (transaction amount)
-  * month (format: 'APR-24', 'MAY-24', etc.)
-  * source ('PO', 'No PO', 'Interface Invoice', 'Payment Requested')
-  * final_category (spending category - see examples below)
-  * directorate (organizational unit - see examples below)
-  * transaction_date, description, etc.
-
-- contracts: contract register (supplier, contract_name, estimated_total_contract_value, start_date, end_date)
-
-IMPORTANT - ACTUAL DATA VALUES:
-Top spending categories in final_category:
-- 'Estates and Facilities', 'NHS Providers', 'Private Providers', 'Voluntary Sector', 'Digital and IT', 'Agency', 'Data', 'Training', 'Supplies', 'Local Authority'
-
-Directorates:
-- 'CORPORATE', 'BEDFORDSHIRE CHS', 'Bedford Directorate', 'TOWER HAMLETS', 'ESTATES & FACILITIES', 'PRIMARY CARE', 'SPECIALIST SERVICES', 'CITY & HACKNEY', 'NEWHAM', 'Luton Directorate', etc.
-
-Date range: APR-24 to SEP-24 (financial year 24/25)
-
-CRITICAL INSTRUCTIONS FOR SQL QUERIES:
-1. Generate ONE SQL query to get data
-2. Mark SQL with "SQL_QUERY:" on its own line
-3. Put ONLY the SQL code after "SQL_QUERY:" - NO explanatory text within the SQL block
-4. End the SQL with a semicolon
-5. Put explanations BEFORE the SQL block, never inside it
-6. I will execute it and send you the results - DO NOT generate multiple queries
-
-CORRECT Example:
-To answer this, I'll query the database for agency spending.
-
-SQL_QUERY:
-SELECT SUM(amount_gbp) as total_spend, COUNT(*) as transaction_count
-FROM ap_transactions
-WHERE final_category = 'Agency';
-
-WRONG Example (DO NOT DO THIS):
-SQL_QUERY:
-SELECT SUM(amount_gbp) as total_spend
-FROM ap_transactions
-WHERE final_category = 'Agency';
-
-Let me also check the breakdown by month:
-SQL_QUERY:
-SELECT month, SUM(amount_gbp) as spend FROM ap_transactions WHERE final_category = 'Agency' GROUP BY month;
-"""
-        
-        # Call Claude
-        response = anthropic_client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            system=system_prompt,
-            messages=[{
-                "role": "user",
-                "content": question
-            }]
-        )
-        
-        response_text = response.content[0].text
-
-        # Extract SQL if present - improved parsing
-        sql_query = None
-        if "SQL_QUERY:" in response_text:
-            parts = response_text.split("SQL_QUERY:", 1)
-            if len(parts) > 1:
-                sql_section = parts[1]
-
-                # Handle code blocks
-                if "```" in sql_section:
-                    # Extract from code block
-                    code_blocks = sql_section.split("```")
-                    for block in code_blocks:
-                        if block.strip() and not block.strip().startswith('sql'):
-                            # Remove 'sql' language identifier if present
-                            sql_query = block.replace('sql\n', '').replace('sql ', '').strip()
-                            break
-                else:
-                    # No code blocks - extract until next paragraph or end
-                    # Split by double newline or look for explanation text
-                    lines = sql_section.split('\n')
-                    sql_lines = []
-                    for line in lines:
-                        stripped = line.strip()
-                        # Stop at empty line followed by explanatory text
-                        if not stripped and sql_lines:
-                            break
-                        # Skip lines that look like explanations (start with "This", "The", etc.)
-                        if stripped and not any(stripped.startswith(word) for word in ['This ', 'The ', 'Here ', 'It ', 'Note:']):
-                            sql_lines.append(line)
-                        elif sql_lines:  # Already collecting SQL, hit explanation
-                            break
-                    sql_query = '\n'.join(sql_lines).strip()
-
-                # Clean up the SQL
-                if sql_query:
-                    # Remove any trailing explanation text that might have slipped through
-                    sql_query = sql_query.split('\n\nThis')[0].split('\n\nThe')[0].strip()
-                    # Ensure it ends with semicolon
-                    if not sql_query.endswith(';'):
-                        sql_query += ';'
-        
-        # Execute SQL if found
         data_results = None
-        if sql_query:
-            try:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute(sql_query)
-                
-                results = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                
-                data_results = {
-                    'columns': columns,
-                    'rows': [[serialize_value(val) for val in row.values()] for row in results[:50]]
-                }
-                
-                cursor.close()
-                conn.close()
-                
-                # Send results back to Claude for analysis
-                follow_up = anthropic_client.messages.create(
-                    model="claude-sonnet-4-20250514",
-                    max_tokens=4096,
-                    system=system_prompt,
-                    messages=[
-                        {"role": "user", "content": question},
-                        {"role": "assistant", "content": response_text},
-                        {"role": "user", "content": f"Query executed. Results ({len(results)} rows):\n{json.dumps(data_results, indent=2)[:2000]}\n\nAnalyze these results."}
-                    ]
-                )
-                
-                response_text = follow_up.content[0].text
-                
-            except Exception as e:
-                return jsonify({
-                    'success': False,
-                    'error': f'SQL execution failed: {str(e)}',
-                    'sql': sql_query
-                })
-        
-        return jsonify({
-            'success': True,
-            'response': response_text,
-            'sql': sql_query,
-            'data': data_results
-        })
+        for event, payload in chat_events(ai_client, question, run_readonly_query):
+            if event == 'results':
+                data_results = {'columns': payload['columns'], 'rows': payload['rows']}
+            if event == 'error':
+                return jsonify({'success': False, **payload})
+            if event == 'done':
+                return jsonify({'success': True, **payload, 'data': data_results})
         
     except Exception as e:
         return jsonify({
@@ -441,5 +711,163 @@ SELECT month, SUM(amount_gbp) as spend FROM ap_transactions WHERE final_category
             'error': str(e)
         })
 
+def sse_event(event, payload):
+    """One server-sent event frame"""
+    return f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+
+@app.route('/api/ai/chat/stream', methods=['POST'])
+def ai_chat_stream():
+    """Streaming /api/ai/chat: tokens, SQL, results and analysis as server-sent events"""
+    data = request.json
+    question = data.get('question', '')
+
+    def generate():
+        if not ai_client:
+            yield sse_event('error', {'error': AI_NOT_CONFIGURED})
+            return
+        try:
+            for event, payload in chat_events(ai_client, question, run_readonly_query):
+                yield sse_event(event, payload)
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+
+    # Keep the request context so the stream's queries are attributed to this route
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/data/freshness')
+def data_freshness():
+    """When each materialized analytics view was last refreshed"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT view_name, refreshed_at, duration_ms
+            FROM analytics_refresh_log
+            ORDER BY view_name
+        """)
+        views = shape_rows(*fetch_rows(cursor))
+        cursor.close()
+
+    return jsonify({
+        'views': views,
+        'refreshed_at': min((v['refreshed_at'] for v in views), default=None)
+    })
+
+@app.route('/api/system/pool')
+def pool_stats():
+    """Connection pool size and saturation counters for this worker process"""
+    return jsonify(get_pool().stats())
+
+@app.route('/api/system/cache')
+def cache_stats():
+    """Response and AI cache hit/miss counters (and the dashboard cube) for this worker process"""
+    cube = get_cube()
+    return jsonify({
+        'responses': response_cache.stats(),
+        'ai_questions': question_cache.stats(),
+        'ai_results': result_cache.stats(),
+        'dashboard_cube': cube.stats() if cube is not None else None
+    })
+
+# HEALTH AND WARM-UP
+
+# Responses computed into the cache before a worker takes traffic
+WARM_UP_URLS = ['/api/dashboard/kpis', '/api/dashboard/charts', '/api/contracts']
+
+warm_state = {'done': False, 'seconds': None, 'error': None}
+
+def warm_up():
+    """Open the pool's connections and fill the caches (gunicorn runs this per worker)"""
+    started = time.perf_counter()
+    try:
+        get_pool()
+        data_version.current()
+        get_catalog_prompt()
+        get_cube()
+        with app.test_client() as client:
+            for url in WARM_UP_URLS:
+                client.get(url)
+        warm_state['error'] = None
+    except Exception as e:
+        # Readiness keeps checking the database; requests fill the caches later
+        warm_state['error'] = str(e)
+        print(f"Warm-up failed: {e}")
+    warm_state['seconds'] = round(time.perf_counter() - started, 3)
+    warm_state['done'] = True
+    return warm_state['error'] is None
+
+@app.route('/healthz')
+def liveness():
+    """Liveness: the process is up and answering (no dependencies checked)"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readiness():
+    """Readiness: warm-up finished and the database answers through the pool"""
+    checks = {'warm_up': warm_state}
+    ready = warm_state['done']
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM data_version")
+            checks['database'] = {'ok': True, 'data_version': cursor.fetchone()[0]}
+            cursor.close()
+    except Exception as e:
+        checks['database'] = {'ok': False, 'error': str(e)}
+        ready = False
+
+    return jsonify({'status': 'ready' if ready else 'not ready', 'checks': checks}), 200 if ready else 503
+
+pool_gauge = metrics.registry.gauge(
+    'elft_db_pool', 'Connection pool size and saturation counters of this process', ('stat',))
+cache_gauge = metrics.registry.gauge(
+    'elft_cache', 'Response and AI cache counters of this process', ('cache', 'stat'))
+data_version_gauge = metrics.registry.gauge(
+    'elft_data_version', 'Current data_version stamp (moves once per import that changed data)')
+data_changed_gauge = metrics.registry.gauge(
+    'elft_data_changed_timestamp_seconds', 'When the data last changed (Unix time)')
+view_refreshed_gauge = metrics.registry.gauge(
+    'elft_view_refreshed_timestamp_seconds', 'When each materialized view was last refreshed (Unix time)',
+    ('view',))
+view_refresh_duration_gauge = metrics.registry.gauge(
+    'elft_view_refresh_duration_seconds', 'How long the last refresh of each materialized view took',
+    ('view',))
+
+@metrics.registry.collector
+def collect_process_stats():
+    for stat, value in get_pool().stats().items():
+        pool_gauge.set(value, stat=stat)
+    caches = {'responses': response_cache, 'ai_questions': question_cache, 'ai_results': result_cache}
+    for name, cache in caches.items():
+        stats = cache.stats()
+        for stat in ('entries', 'hits', 'misses', 'expired', 'evictions', 'invalidations'):
+            cache_gauge.set(stats[stat], cache=name, stat=stat)
+
+@metrics.registry.collector
+def collect_import_stats():
+    """Imports run in their own process; their traces are data_version and analytics_refresh_log"""
+    version, changed_at = data_version.current()
+    data_version_gauge.set(version)
+    data_changed_gauge.set(changed_at.timestamp())
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT view_name, refreshed_at, duration_ms FROM analytics_refresh_log")
+        for view, refreshed_at, duration_ms in cursor.fetchall():
+            view_refreshed_gauge.set(refreshed_at.timestamp(), view=view)
+            # Rows seeded by materialized_views.sql have no duration until the first import
+            if duration_ms is not None:
+                view_refresh_duration_gauge.set(duration_ms / 1000, view=view)
+        cursor.close()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics of this worker process in the Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000, host='0.0.0.0')
+    # Development server; production runs gunicorn -c gunicorn.conf.py
+    warm_up()
+    app.run(debug=FLASK_DEBUG, port=FLASK_PORT, host=FLASK_HOST)
@@ -0,0 +1,193 @@
+"""
+Batch AP import for ELFT Invoice Platform
+
+    python batch_import.py extracts/                      # every .xlsx in a directory
+    python batch_import.py "extracts/AP 2024-*.xlsx" --workers 4
+
+Finance sends one AP extract per month and directorate. Parsing a workbook
+is CPU-bound, so a process pool parses the files side by side (IMPORT_WORKERS,
+default one per CPU). Each worker streams its file into its own unlogged
+staging table (a "slot"). Once every file is done, the slots of the files
+that parsed are merged into ap_transactions together, followed by the usual
+view refresh, and a report lists what happened to each file.
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+
+from config import IMPORT_WORKERS
+from import_data import (AP_COLUMNS, IMPORT_MODES, StageTimer, create_staging_table,
+                         get_db_connection, merge_ap_stage, stage_ap_workbook)
+
+SLOT_PREFIX = 'ap_import_slot_'
+
+def find_workbooks(patterns):
+    """.xlsx files named by directories and glob patterns, in order, without duplicates"""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '*.xlsx'))
+        else:
+            matches = glob.glob(pattern)
+        for path in sorted(matches):
+            # Skip Excel's lock files for open workbooks
+            if os.path.basename(path).startswith('~$'):
+                continue
+            path = os.path.abspath(path)
+            if path not in files:
+                files.append(path)
+    return files
+
+def _first_line(error):
+    return (str(error).strip().splitlines() or [type(error).__name__])[0]
+
+def stage_file(path, slot):
+    """Pool worker: stream one workbook into its own slot table and commit it"""
+    started = time.perf_counter()
+    timer = StageTimer()
+    result = {'file': path, 'slot': slot, 'rows': 0, 'error': None}
+    conn = None
+    try:
+        # The worker's progress lines would interleave with the others'
+        with redirect_stdout(io.StringIO()):
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(f"DROP TABLE IF EXISTS {slot}")
+            cursor.execute(f"CREATE UNLOGGED TABLE {slot} AS "
+                           f"SELECT {', '.join(AP_COLUMNS)} FROM ap_transactions WITH NO DATA")
+            result['rows'] = stage_ap_workbook(cursor, path, slot, timer)
+            conn.commit()
+        result['status'] = 'staged' if result['rows'] else 'empty'
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = _first_line(e)
+    finally:
+        if conn is not None:
+            conn.close()
+    result['seconds'] = time.perf_counter() - started
+    result['stages'] = timer.seconds
+    return result
+
+def drop_slots(slots):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for slot in slots:
+        cursor.execute(f"DROP TABLE IF EXISTS {slot}")
+    conn.commit()
+    conn.close()
+
+def merge_slots(results, mode):
+    """Copy the staged slots into one session stage and merge it in a single pass"""
+    timer = StageTimer()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        stage = create_staging_table(cursor, 'ap_transactions', AP_COLUMNS)
+        columns = ', '.join(AP_COLUMNS)
+        with timer.stage('gather'):
+            for result in results:
+                cursor.execute(f"INSERT INTO {stage} SELECT {columns} FROM {result['slot']}")
+        cursor.close()
+        merge_ap_stage(conn, stage, mode, timer)
+    finally:
+        conn.close()
+    timer.report()
+
+def print_report(results, started, workers):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    summary = ', '.join(f"{count} {status}" for status, count in counts.items())
+    print(f"\nBatch report ({len(results)} files: {summary}):")
+    for result in results:
+        line = (f"  {result['status']:<8} {result['rows']:>10,} rows {result['seconds']:>7.1f}s  "
+                f"{os.path.relpath(result['file'])}")
+        if result['error']:
+            line += f": {result['error']}"
+        print(line)
+
+    stage_seconds = {}
+    for result in results:
+        for name, seconds in result['stages'].items():
+            stage_seconds[name] = stage_seconds.get(name, 0.0) + seconds
+    work = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in stage_seconds.items())
+    print(f"\n  Worker time: {work or 'none'} across {workers} workers; "
+          f"{time.perf_counter() - started:.1f}s overall")
+
+def batch_import(patterns, mode='incremental', workers=IMPORT_WORKERS, strict=False):
+    """Import every matching AP workbook; returns the per-file results
+
+    Files that fail to parse are reported and left out of the merge, unless
+    `strict` is set or mode is 'reload' (which would otherwise drop their
+    rows), in which case nothing is merged.
+    """
+    print("\n" + "="*60)
+    print("BATCH IMPORTING AP TRANSACTIONS")
+    print("="*60)
+
+    files = find_workbooks(patterns)
+    if not files:
+        print(f"No .xlsx files match: {' '.join(patterns)}")
+        return []
+
+    started = time.perf_counter()
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    slots = {path: f"{SLOT_PREFIX}{os.getpid()}_{i}" for i, path in enumerate(files)}
+    print(f"Parsing {len(files)} workbooks with {workers} workers")
+
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(stage_file, path, slot): path for path, slot in slots.items()}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process itself died (e.g. out of memory)
+                    result = {'file': path, 'slot': slots[path], 'status': 'failed', 'rows': 0,
+                              'seconds': 0.0, 'stages': {}, 'error': _first_line(e)}
+                results.append(result)
+                mark = '✗' if result['status'] == 'failed' else '✓'
+                print(f"  {mark} {os.path.basename(path)}: {result['rows']:,} rows "
+                      f"in {result['seconds']:.1f}s" + (f" ({result['error']})" if result['error'] else ''))
+        results.sort(key=lambda result: files.index(result['file']))
+
+        staged = [result for result in results if result['status'] == 'staged']
+        failed = [result for result in results if result['status'] == 'failed']
+        if failed and (strict or mode == 'reload'):
+            print(f"\n✗ {len(failed)} files failed; nothing merged "
+                  f"({'--strict' if strict else 'reload mode'})")
+            for result in staged:
+                result['status'] = 'skipped'
+        elif staged:
+            print(f"\nMerging {sum(r['rows'] for r in staged):,} rows from {len(staged)} files...")
+            merge_slots(staged, mode)
+            for result in staged:
+                result['status'] = 'merged'
+    finally:
+        drop_slots(slots.values())
+
+    print_report(results, started, workers)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import many AP extract workbooks in parallel")
+    parser.add_argument('paths', nargs='+', help="Directories (every .xlsx inside) or glob patterns")
+    parser.add_argument('--mode', choices=IMPORT_MODES, default='incremental',
+                        help="incremental: insert new / update changed rows (default); "
+                             "reload: truncate and load only these files")
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS,
+                        help="Parser processes (default: IMPORT_WORKERS, 0 = one per CPU)")
+    parser.add_argument('--strict', action='store_true',
+                        help="Merge nothing if any file fails")
+    args = parser.parse_args()
+
+    results = batch_import(args.paths, args.mode, args.workers, args.strict)
+    if not results or any(result['status'] == 'failed' for result in results):
+        sys.exit(1)
@@ -0,0 +1,326 @@
+"""
+Query benchmarks for ELFT Invoice Platform
+Times the dashboard queries and endpoints, every analytics view, each
+/api/contracts sort and filter combination and (optionally) the importer
+against the configured database, and writes the timings as JSON so runs
+can be compared. Load data at a known scale first (synthetic_data.py).
+
+Usage:
+    python benchmark.py                               # dashboard, views, contracts
+    python benchmark.py --groups refresh,import --import-dir bench_data
+    python benchmark.py --compare benchmark-20250101-120000.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import psycopg2
+
+from config import DB_CONFIG
+
+DEFAULT_GROUPS = ['dashboard', 'views', 'contracts']
+ALL_GROUPS = DEFAULT_GROUPS + ['refresh', 'import']
+
+VIEWS = [
+    'vw_contract_vs_invoiced', 'vw_monthly_dashboard', 'vw_non_po_analysis',
+    'vw_suppliers_without_contracts', 'vw_category_spend', 'vw_expiring_contracts',
+    'mv_contract_vs_invoiced', 'mv_monthly_dashboard', 'mv_suppliers_without_contracts',
+    'mv_category_spend',
+]
+
+def summarize(group, name, timings, rows=None):
+    """One result record; timings are in seconds"""
+    ms = sorted(t * 1000 for t in timings)
+    return {
+        'group': group,
+        'name': name,
+        'runs': len(ms),
+        'rows': rows,
+        'min_ms': round(ms[0], 3),
+        'median_ms': round(statistics.median(ms), 3),
+        'p95_ms': round(statistics.quantiles(ms, n=20)[-1], 3) if len(ms) > 1 else round(ms[0], 3),
+        'mean_ms': round(statistics.fmean(ms), 3),
+        'max_ms': round(ms[-1], 3),
+    }
+
+class Bench:
+    """Runs each case `warmup` + `repeat` times and collects result records"""
+
+    def __init__(self, repeat, warmup):
+        self.repeat = repeat
+        self.warmup = warmup
+        self.results = []
+
+    def run(self, group, name, func, repeat=None, warmup=None):
+        """Time func(); it returns the number of rows it produced"""
+        for _ in range(self.warmup if warmup is None else warmup):
+            func()
+        timings = []
+        rows = None
+        for _ in range(self.repeat if repeat is None else repeat):
+            started = time.perf_counter()
+            rows = func()
+            timings.append(time.perf_counter() - started)
+        result = summarize(group, name, timings, rows)
+        self.results.append(result)
+        print(f"  {group:<10} {name:<52} median {result['median_ms']:>10,.1f} ms  "
+              f"p95 {result['p95_ms']:>10,.1f} ms  rows {rows if rows is not None else '-'}")
+        return result
+
+def sql_case(conn, query, params=None):
+    def run():
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = len(cursor.fetchall())
+        cursor.close()
+        conn.rollback()
+        return rows
+    return run
+
+def endpoint_case(client, url, cached=False):
+    """GET `url` through Flask; the response cache is emptied first unless `cached`"""
+    from cache import response_cache
+
+    def run():
+        if not cached:
+            response_cache.clear()
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        body = response.get_json()
+        if isinstance(body, dict) and 'contracts' in body:
+            return body['count']
+        return len(response.get_data())
+    return run
+
+def bench_dashboard(bench, conn, client):
+    from app import KPI_QUERY, CHART_QUERIES
+    from config import DASHBOARD_CUBE
+    from cube import CUBE_QUERY
+
+    bench.run('dashboard', 'kpi_query', sql_case(conn, KPI_QUERY))
+    for name, query in CHART_QUERIES.items():
+        bench.run('dashboard', f"chart:{name}", sql_case(conn, query))
+    bench.run('dashboard', 'cube_query', sql_case(conn, CUBE_QUERY))
+    bench.run('dashboard', 'GET /api/dashboard/kpis', endpoint_case(client, '/api/dashboard/kpis'))
+    bench.run('dashboard', 'GET /api/dashboard/charts', endpoint_case(client, '/api/dashboard/charts'))
+    if DASHBOARD_CUBE:
+        bench.run('dashboard', 'GET /api/dashboard/drilldown',
+                  endpoint_case(client, '/api/dashboard/drilldown?group_by=directorate&from=2024-04&to=2025-03'))
+    bench.run('dashboard', 'GET /api/duplicates', endpoint_case(client, '/api/duplicates'))
+    bench.run('dashboard', 'GET /api/dashboard/kpis (cached)',
+              endpoint_case(client, '/api/dashboard/kpis', cached=True))
+
+def bench_views(bench, conn):
+    for view in VIEWS:
+        bench.run('views', view, sql_case(conn, f"SELECT * FROM {view}"))
+
+def contract_cases(conn):
+    """(name, query string) for every sort/order plus the filters, on realistic values"""
+    from app import CONTRACT_SORT_COLUMNS
+
+    cases = []
+    for sort in CONTRACT_SORT_COLUMNS:
+        for order in ('asc', 'desc'):
+            cases.append((f"sort={sort}&order={order}", f"sort={sort}&order={order}"))
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM mv_contract_vs_invoiced GROUP BY status ORDER BY 2 DESC")
+    for status, _ in cursor.fetchall():
+        cases.append((f"status={status}", f"status={status}"))
+    # Search for the first word of the most common supplier, and for a miss
+    cursor.execute("""
+        SELECT split_part(supplier, ' ', 1) FROM mv_contract_vs_invoiced
+        GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1
+    """)
+    row = cursor.fetchone()
+    cursor.close()
+    conn.rollback()
+    if row and row[0]:
+        cases.append(("search=<common supplier>", f"search={row[0]}"))
+    cases.append(("search=<no match>", "search=zzqx"))
+    cases.append(("include_total=true", "include_total=true"))
+    cases.append(("limit=500", "limit=500"))
+    return cases
+
+def bench_contracts(bench, conn, client):
+    for name, query in contract_cases(conn):
+        url = f"/api/contracts?{query}"
+        bench.run('contracts', name, endpoint_case(client, url))
+
+        # Second page through the keyset cursor
+        first_page = client.get(url).get_json()
+        if first_page.get('next_cursor'):
+            next_url = f"{url}&cursor={first_page['next_cursor']}"
+            bench.run('contracts', f"{name} (page 2)", endpoint_case(client, next_url))
+
+def bench_refresh(bench, conn):
+    from import_data import AP_DEPENDENT_VIEWS
+
+    conn.autocommit = True
+    for view in AP_DEPENDENT_VIEWS:
+        def refresh(view=view):
+            cursor = conn.cursor()
+            cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+            cursor.close()
+        bench.run('refresh', view, refresh, warmup=0)
+    conn.autocommit = False
+
+def bench_import(bench, import_dir):
+    """Importer paths on the workbooks in `import_dir` (replaces the loaded data)"""
+    import import_data
+    from import_data import (iter_sheet_batches, prepare_ap_batch, map_contract_batch,
+                             match_contract_headers, _is_contract_header)
+    from synthetic_data import AP_FILE, CONTRACTS_FILE
+
+    ap_path = os.path.join(import_dir, AP_FILE)
+    contracts_path = os.path.join(import_dir, CONTRACTS_FILE)
+
+    # The importer reports progress with print(); keep the benchmark output readable
+    def quiet(func):
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                return func()
+        return run
+
+    @quiet
+    def read_ap():
+        return sum(len(prepare_ap_batch(batch)) for batch in iter_sheet_batches(ap_path))
+
+    @quiet
+    def read_contracts():
+        rows = 0
+        column_map = None
+        for batch in iter_sheet_batches(contracts_path, sheet_name='Sheet1', is_header=_is_contract_header):
+            if column_map is None:
+                column_map = match_contract_headers(batch.columns)
+            rows += len(map_contract_batch(batch, column_map))
+        return rows
+
+    def importer(func, mode):
+        @quiet
+        def run():
+            cwd = os.getcwd()
+            os.chdir(import_dir)
+            try:
+                func(mode)
+            finally:
+                os.chdir(cwd)
+        return run
+
+    # Slow and destructive: single runs, no warm-up
+    once = {'repeat': 1, 'warmup': 0}
+    bench.run('import', 'read+prepare AP workbook', read_ap, **once)
+    bench.run('import', 'read+map contracts workbook', read_contracts, **once)
+    bench.run('import', 'import_ap_transactions reload', importer(import_data.import_ap_transactions, 'reload'), **once)
+    bench.run('import', 'import_ap_transactions incremental (no changes)',
+              importer(import_data.import_ap_transactions, 'incremental'), **once)
+    bench.run('import', 'import_contracts reload', importer(import_data.import_contracts, 'reload'), **once)
+    bench.run('import', 'import_contracts incremental (no changes)',
+              importer(import_data.import_contracts, 'incremental'), **once)
+
+def environment(conn):
+    """Data volume and versions the timings were taken with"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM ap_transactions),
+            (SELECT COUNT(*) FROM contracts),
+            (SELECT COUNT(*) FROM suppliers),
+            current_setting('server_version')
+    """)
+    ap_rows, contract_rows, supplier_rows, server_version = cursor.fetchone()
+    cursor.close()
+    conn.rollback()
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'postgres': server_version,
+        'database': DB_CONFIG['database'],
+        'ap_transactions': ap_rows,
+        'contracts': contract_rows,
+        'suppliers': supplier_rows,
+    }
+
+def compare(results, baseline_path):
+    """Print the median change of every case also present in the baseline run"""
+    with open(baseline_path) as f:
+        baseline = {(r['group'], r['name']): r for r in json.load(f)['results']}
+    print(f"\nCompared with {baseline_path} (median):")
+    for result in results:
+        before = baseline.get((result['group'], result['name']))
+        if before is None or not before['median_ms']:
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+        print(f"  {result['group']:<10} {result['name']:<52} {before['median_ms']:>10,.1f} -> "
+              f"{result['median_ms']:>10,.1f} ms ({change:+.1f}%)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dashboard, view, contracts and import paths")
+    parser.add_argument('--groups', default=','.join(DEFAULT_GROUPS),
+                        help=f"Comma-separated groups to run: {', '.join(ALL_GROUPS)} "
+                             f"(default: {','.join(DEFAULT_GROUPS)})")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case (default: 5)")
+    parser.add_argument('--warmup', type=int, default=1, help="Untimed runs per case (default: 1)")
+    parser.add_argument('--import-dir', help="Directory with the workbooks for the import group "
+                                             "(python synthetic_data.py xlsx)")
+    parser.add_argument('--output', help="JSON results file (default: benchmark-<timestamp>.json)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    groups = [g.strip() for g in args.groups.split(',') if g.strip()]
+    unknown = set(groups) - set(ALL_GROUPS)
+    if unknown:
+        parser.error(f"Unknown groups: {', '.join(sorted(unknown))}")
+    if 'import' in groups and not args.import_dir:
+        parser.error("The import group needs --import-dir")
+
+    started_at = datetime.now()
+    conn = psycopg2.connect(**DB_CONFIG)
+    env = environment(conn)
+    print(f"Benchmarking {env['database']}: {env['ap_transactions']:,} AP rows, "
+          f"{env['contracts']:,} contracts (commit {env['git_commit']})\n")
+
+    bench = Bench(args.repeat, args.warmup)
+    client = None
+    if {'dashboard', 'contracts'} & set(groups):
+        from app import app
+        client = app.test_client()
+
+    if 'dashboard' in groups:
+        bench_dashboard(bench, conn, client)
+    if 'views' in groups:
+        bench_views(bench, conn)
+    if 'contracts' in groups:
+        bench_contracts(bench, conn, client)
+    if 'refresh' in groups:
+        bench_refresh(bench, conn)
+    if 'import' in groups:
+        bench_import(bench, args.import_dir)
+    conn.close()
+
+    output = args.output or f"benchmark-{started_at:%Y%m%d-%H%M%S}.json"
+    with open(output, 'w') as f:
+        json.dump({
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'settings': {'groups': groups, 'repeat': args.repeat, 'warmup': args.warmup},
+            'environment': env,
+            'results': bench.results,
+        }, f, indent=2)
+    print(f"\n✓ {len(bench.results)} results written to {output}")
+
+    if args.compare:
+        compare(bench.results, args.compare)
@@ -0,0 +1,165 @@
+"""
+In-memory caches for ELFT Invoice Platform API
+Dashboard answers only change when import_data.py loads new data, so JSON
+responses (and AI query results, see ai_assistant.py) are kept in memory
+(TTL + LRU) and dropped whenever the database's data_version stamp moves.
+Each process keeps its own caches.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+from config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES, DATA_VERSION_CHECK_INTERVAL
+from db import get_db_connection
+
+class DataVersion:
+    """Polls the data_version row at most once every `check_interval` seconds"""
+
+    def __init__(self, check_interval=DATA_VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.version = None
+        self.changed_at = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Return (version, changed_at), reading the database when the last check is stale"""
+        with self._lock:
+            if self.version is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self.version, self.changed_at
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version, changed_at FROM data_version")
+            version, changed_at = cursor.fetchone()
+            cursor.close()
+
+        with self._lock:
+            self.version, self.changed_at = version, changed_at
+            self._checked_at = time.monotonic()
+        return version, changed_at
+
+class LRUCache:
+    """Thread-safe LRU of dict entries with a per-entry TTL
+
+    Entries remember the data version they were built from; a lookup under
+    a newer version empties the cache. Caches that don't depend on the data
+    pass a constant version.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._version = version
+
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry['stored_at'] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, version, entry):
+        with self._lock:
+            if version != self._version:
+                return
+            entry['stored_at'] = time.monotonic()
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'data_version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+response_cache = LRUCache()
+data_version = DataVersion()
+
+def request_cache_key():
+    """Endpoint path plus its query arguments in a stable order"""
+    args = sorted((k, v) for k, values in request.args.lists() for v in values)
+    return request.path + '?' + '&'.join(f"{k}={v}" for k, v in args)
+
+def cached_response(view):
+    """Serve a JSON view from the response cache, with ETag/Last-Modified revalidation
+
+    Only 200 responses are cached, and not those the view marked no-store.
+    Browsers are told to revalidate every time (no-cache), so an unchanged
+    answer costs them a 304.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version, changed_at = data_version.current()
+        key = request_cache_key()
+
+        entry = response_cache.get(key, version)
+        if entry is None:
+            response = view(*args, **kwargs)
+            if (not isinstance(response, Response) or response.status_code != 200
+                    or response.cache_control.no_store):
+                return response
+            body = response.get_data()
+            entry = {
+                'body': body,
+                'mimetype': response.mimetype,
+                'etag': f"{version}-{hashlib.md5(body).hexdigest()}",
+            }
+            response_cache.set(key, version, entry)
+            cache_status = 'MISS'
+        else:
+            cache_status = 'HIT'
+
+        response = Response(entry['body'], mimetype=entry['mimetype'])
+        response.set_etag(entry['etag'])
+        response.last_modified = changed_at
+        response.cache_control.no_cache = True
+        response.headers['X-Cache'] = cache_status
+        return response.make_conditional(request)
+    return wrapper
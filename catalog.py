@@ -0,0 +1,207 @@
+"""
+Schema and value catalog for the AI assistant's system prompt
+After each import the catalog is rebuilt from the live database: the columns
+of the fact tables and analytics views, row counts, date ranges, the values
+of low-cardinality columns (from the planner's statistics, no table scans)
+and which columns are indexed. It is stored in the ai_catalog table as JSON
+plus the rendered prompt text, so the API only reads it once per data version.
+
+Usage:
+    python catalog.py          # rebuild and print the prompt section
+"""
+import json
+import re
+import threading
+
+import psycopg2
+import psycopg2.errors
+
+from config import DB_CONFIG
+
+# Relations described to the model, with a one-line purpose
+CATALOG_RELATIONS = {
+    'ap_transactions': 'accounts payable lines (one row per invoice line)',
+    'contracts': 'contract register',
+    'suppliers': 'supplier master; ap_transactions.supplier_id and contracts.supplier_id point here',
+    'duplicate_invoices': 'likely duplicate invoice pairs; transaction_id (the later one) and '
+                          'duplicate_of point to ap_transactions.transaction_id',
+    'mv_contract_vs_invoiced': 'contracts joined to the last 12 months of spend, with status',
+    'mv_monthly_dashboard': 'spend per month',
+    'mv_suppliers_without_contracts': 'suppliers with spend but no contract',
+    'mv_category_spend': 'spend per final_category',
+}
+
+# Bookkeeping columns the model never needs
+HIDDEN_COLUMNS = {'row_key', 'row_hash', 'created_at', 'updated_at'}
+
+# Columns with at most this many distinct values get their full value list
+VALUE_LIST_LIMIT = 30
+# Higher-cardinality text columns get this many of their most common values
+EXAMPLE_VALUES = 5
+
+def _relation_columns(cursor, relation):
+    cursor.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace
+          AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """, (relation,))
+    return [(name, col_type) for name, col_type in cursor.fetchall() if name not in HIDDEN_COLUMNS]
+
+def _column_values(cursor, relation, columns, row_count):
+    """Most common values per text column from pg_stats (needs a recent ANALYZE)"""
+    text_columns = {name for name, col_type in columns if col_type == 'text' or col_type.startswith('character')}
+    cursor.execute("""
+        SELECT DISTINCT ON (attname) attname, n_distinct, most_common_vals::text
+        FROM pg_stats
+        WHERE schemaname = 'public' AND tablename = %s
+        ORDER BY attname, inherited DESC
+    """, (relation,))
+    values = {}
+    for column, n_distinct, common in cursor.fetchall():
+        if column not in text_columns or common is None:
+            continue
+        # Negative n_distinct is a fraction of the row count
+        distinct = n_distinct if n_distinct >= 0 else -n_distinct * row_count
+        common_values = _parse_pg_array(common)
+        if distinct <= VALUE_LIST_LIMIT:
+            values[column] = {'all': True, 'values': common_values[:VALUE_LIST_LIMIT]}
+        elif distinct <= row_count * 0.5:
+            values[column] = {'all': False, 'values': common_values[:EXAMPLE_VALUES]}
+    return values
+
+def _parse_pg_array(text):
+    """Elements of a one-dimensional Postgres array literal, as strings"""
+    items = re.findall(r'"((?:[^"\\]|\\.)*)"|([^,{}]+)', text)
+    return [quoted.replace('\\"', '"').replace('\\\\', '\\') if quoted else bare for quoted, bare in items]
+
+def _indexed_columns(cursor, relation):
+    """Leading column and access method of each index on `relation`"""
+    cursor.execute("""
+        SELECT DISTINCT a.attname, am.amname
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = ic.relam
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+        WHERE t.relname = %s AND t.relnamespace = 'public'::regnamespace
+        ORDER BY a.attname
+    """, (relation,))
+    return [f"{name} ({method})" if method != 'btree' else name
+            for name, method in cursor.fetchall() if name not in HIDDEN_COLUMNS]
+
+def _date_ranges(cursor, relation, columns):
+    date_columns = [name for name, col_type in columns if col_type == 'date']
+    if not date_columns:
+        return {}
+    cursor.execute("SELECT " + ", ".join(f"MIN({col}), MAX({col})" for col in date_columns) + f" FROM {relation}")
+    row = cursor.fetchone()
+    return {
+        col: [row[i * 2].isoformat(), row[i * 2 + 1].isoformat()]
+        for i, col in enumerate(date_columns)
+        if row[i * 2] is not None
+    }
+
+def build_catalog(cursor):
+    """Introspect the catalog relations; returns a JSON-serialisable dict"""
+    cursor.execute("ANALYZE ap_transactions")
+    cursor.execute("ANALYZE contracts")
+
+    relations = {}
+    for relation, purpose in CATALOG_RELATIONS.items():
+        columns = _relation_columns(cursor, relation)
+        if not columns:
+            continue
+        cursor.execute(f"SELECT COUNT(*) FROM {relation}")
+        row_count = cursor.fetchone()[0]
+        relations[relation] = {
+            'purpose': purpose,
+            'rows': row_count,
+            'columns': columns,
+            'values': _column_values(cursor, relation, columns, row_count),
+            'dates': _date_ranges(cursor, relation, columns),
+            'indexed': _indexed_columns(cursor, relation),
+        }
+    return {'relations': relations}
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''").replace('\n', ' ') + "'"
+
+def render_prompt(catalog):
+    """Compact schema section of the system prompt"""
+    lines = ["DATABASE SCHEMA (generated from the live data):"]
+    for relation, info in catalog['relations'].items():
+        lines.append(f"\n- {relation}: {info['purpose']} ({info['rows']:,} rows)")
+        lines.append("  Columns: " + ", ".join(f"{name} {col_type}" for name, col_type in info['columns']))
+        for column, values in info['values'].items():
+            label = "values" if values['all'] else "e.g."
+            lines.append(f"  {column} {label}: " + ", ".join(_quote(v) for v in values['values']))
+        for column, (first, last) in info['dates'].items():
+            lines.append(f"  {column} range: {first} to {last}")
+        if info['indexed']:
+            lines.append("  Indexed: " + ", ".join(info['indexed']))
+
+    lines.append("""
+NOTES:
+- Use period_month (DATE, first day of the month) to filter or group by month;
+  month is a free-text label in mixed formats ('2024-08', 'Aug-24', 'August 2024').
+- is_excluded marks months left out of the dashboard totals.
+- ap_transactions is partitioned by financial year on transaction_date: bound
+  queries by transaction_date where possible.
+- Match supplier names with ILIKE, or join through supplier_id.
+""")
+    return "\n".join(lines)
+
+def store_catalog(conn):
+    """Rebuild the catalog and save it for the API"""
+    cursor = conn.cursor()
+    catalog = build_catalog(cursor)
+    prompt = render_prompt(catalog)
+    cursor.execute("""
+        INSERT INTO ai_catalog (id, built_at, catalog, prompt)
+        VALUES (TRUE, CURRENT_TIMESTAMP, %s, %s)
+        ON CONFLICT (id) DO UPDATE SET
+            built_at = EXCLUDED.built_at,
+            catalog = EXCLUDED.catalog,
+            prompt = EXCLUDED.prompt
+    """, (json.dumps(catalog), prompt))
+    conn.commit()
+    cursor.close()
+    print(f"  ✓ AI catalog rebuilt ({len(prompt):,} characters)")
+    return prompt
+
+_prompt_cache = {'version': None, 'prompt': None}
+_prompt_lock = threading.Lock()
+
+def get_catalog_prompt():
+    """Stored prompt section, re-read only when the data version moves (None if never built)"""
+    # Imported here so the importer can use this module without Flask
+    from cache import data_version
+    from db import get_db_connection
+
+    version = data_version.current()[0]
+    with _prompt_lock:
+        if _prompt_cache['version'] == version:
+            return _prompt_cache['prompt']
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT prompt FROM ai_catalog")
+            row = cursor.fetchone()
+        except psycopg2.errors.UndefinedTable:
+            # database/upgrade.sql not applied yet
+            conn.rollback()
+            row = None
+        cursor.close()
+
+    with _prompt_lock:
+        _prompt_cache.update(version=version, prompt=row[0] if row else None)
+    return _prompt_cache['prompt']
+
+if __name__ == "__main__":
+    conn = psycopg2.connect(**DB_CONFIG)
+    print(store_catalog(conn))
+    conn.close()
@@ -34,14 +34,98 @@ else:
         'password': os.getenv('DB_PASSWORD', '')
     }
 
+# Connection pool sizing (per process). A request holds one connection and the
+# chart queries take up to CHART_QUERY_WORKERS more, so under gthread keep
+# DB_POOL_MAX >= WEB_THREADS + CHART_QUERY_WORKERS; under gevent it caps the
+# worker's concurrent queries and further requests wait up to DB_POOL_TIMEOUT.
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 12))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+# Seconds before a connection is closed and replaced
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 1800))
+# Connections idle longer than this (seconds) are pinged before reuse
+DB_POOL_VALIDATE_AFTER = float(os.getenv('DB_POOL_VALIDATE_AFTER', 5))
+
+# API response cache (per process)
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 256))
+# Seconds between checks of the data_version stamp bumped by imports
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv('DATA_VERSION_CHECK_INTERVAL', 5))
+
+# Dashboard chart queries run concurrently, each on its own pooled connection:
+# at most this many at once per process, each cut off after the timeout
+CHART_QUERY_WORKERS = int(os.getenv('CHART_QUERY_WORKERS', 3))
+CHART_QUERY_TIMEOUT_MS = int(os.getenv('CHART_QUERY_TIMEOUT_MS', 15000))
+
+# Dashboard KPIs, charts and drill-down are answered from an in-memory cube
+# of spend per month/category/directorate/source (per process, rebuilt after
+# each import); above CUBE_MAX_CELLS cells, or with the cube off, they use SQL
+DASHBOARD_CUBE = os.getenv('DASHBOARD_CUBE', 'True').lower() == 'true'
+CUBE_MAX_CELLS = int(os.getenv('CUBE_MAX_CELLS', 2000000))
+
+# Rows fetched per round-trip by the streaming CSV/XLSX exports
+EXPORT_FETCH_ROWS = int(os.getenv('EXPORT_FETCH_ROWS', 5000))
+
+# AI assistant caches, both per data version: question -> generated SQL, and SQL results
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', 256))
+AI_QUESTION_CACHE_TTL = float(os.getenv('AI_QUESTION_CACHE_TTL', 86400))
+AI_RESULT_CACHE_TTL = float(os.getenv('AI_RESULT_CACHE_TTL', 3600))
+
+# Sandbox for AI-generated SQL: read-only, time and planner-cost limits,
+# and a cap on the rows / bytes read back
+AI_SQL_TIMEOUT_MS = int(os.getenv('AI_SQL_TIMEOUT_MS', 5000))
+AI_SQL_MAX_COST = float(os.getenv('AI_SQL_MAX_COST', 500000))
+AI_SQL_MAX_ROWS = int(os.getenv('AI_SQL_MAX_ROWS', 50))
+AI_SQL_MAX_RESULT_BYTES = int(os.getenv('AI_SQL_MAX_RESULT_BYTES', 262144))
+
+# Queries slower than this (milliseconds) are logged and counted on /metrics
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+
 # API Keys
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
+ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-sonnet-4-20250514')
+# 'anthropic', or 'stub' for the offline client in ai_assistant.py (local testing)
+AI_CLIENT = os.getenv('AI_CLIENT', 'anthropic')
 
 # Flask Configuration
 FLASK_ENV = os.getenv('FLASK_ENV', 'development')
 FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
 FLASK_HOST = os.getenv('FLASK_HOST', '0.0.0.0')
-FLASK_PORT = int(os.getenv('FLASK_PORT', 5000))
+# Railway and similar platforms pass the port to listen on as PORT
+FLASK_PORT = int(os.getenv('FLASK_PORT', os.getenv('PORT', 5000)))
+
+# Production server (gunicorn.conf.py): worker processes, worker class
+# ('gevent' serves each request on a greenlet, 'gthread' on a thread),
+# concurrent requests per gevent worker, threads per gthread worker,
+# and seconds in-flight requests (AI chat streams) get to finish on shutdown.
+# Each worker has its own connection pool, so keep
+# DB_POOL_MAX >= WEB_THREADS + CHART_QUERY_WORKERS.
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 2))
+WEB_WORKER_CLASS = os.getenv('WEB_WORKER_CLASS', 'gevent')
+WEB_WORKER_CONNECTIONS = int(os.getenv('WEB_WORKER_CONNECTIONS', 200))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 120))
+
+# Rows per COPY chunk when importing (bounds importer memory)
+IMPORT_CHUNK_ROWS = int(os.getenv('IMPORT_CHUNK_ROWS', 50000))
+
+# Processes parsing workbooks in parallel in batch_import.py (0 = one per CPU)
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', 0))
+
+# Schema that archived ap_transactions financial-year partitions are moved to
+AP_ARCHIVE_SCHEMA = os.getenv('AP_ARCHIVE_SCHEMA', 'archive')
+
+# Minimum similarity (0-1) for fuzzy supplier alias matching; 1 disables it
+SUPPLIER_MATCH_THRESHOLD = float(os.getenv('SUPPLIER_MATCH_THRESHOLD', 0.92))
+
+# Duplicate invoice detection (duplicates.py): rows of the same supplier at most
+# DUPLICATE_WINDOW_DAYS apart whose amounts differ by at most
+# DUPLICATE_AMOUNT_TOLERANCE (a fraction) are scored; pairs scoring at least
+# DUPLICATE_MIN_SCORE (0-1) are recorded
+DUPLICATE_WINDOW_DAYS = int(os.getenv('DUPLICATE_WINDOW_DAYS', 60))
+DUPLICATE_AMOUNT_TOLERANCE = float(os.getenv('DUPLICATE_AMOUNT_TOLERANCE', 0.01))
+DUPLICATE_MIN_SCORE = float(os.getenv('DUPLICATE_MIN_SCORE', 0.8))
 
 # Excluded months for analysis (comma-separated)
 EXCLUDED_MONTHS = os.getenv('EXCLUDED_MONTHS', '2024-08,2024-11,Aug-24,Nov-24,August 2024,November 2024').split(',')
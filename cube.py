@@ -0,0 +1,329 @@
+"""
+In-memory spend cube for ELFT Invoice Platform dashboard
+Every dashboard view is a SUM/COUNT over ap_transactions grouped by some mix
+of month, final_category, directorate and source. One aggregate query loads
+those groups into dense NumPy arrays (one axis per dimension, measures in
+pence), and the KPIs, charts and drill-down are answered by slicing and
+summing the arrays instead of scanning the table. The cube is rebuilt when
+data_version moves (after each import). Each process keeps its own cube.
+"""
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+from cache import data_version
+from config import DASHBOARD_CUBE, CUBE_MAX_CELLS
+from db import get_db_connection
+
+DIMENSIONS = ('month', 'category', 'directorate', 'source')
+# Database column behind each dimension
+DIMENSION_COLUMNS = {
+    'month': 'period_month',
+    'category': 'final_category',
+    'directorate': 'directorate',
+    'source': 'source',
+}
+
+# Cells are (period_month, final_category, directorate, source, is_excluded);
+# supplier rows carry the per-party totals the concentration KPI needs.
+# Amounts come back in pence so sums stay exact. PO / non-PO split on source,
+# as in vw_monthly_dashboard (update_views_for_source.sql) and the chart SQL.
+CUBE_QUERY = """
+    SELECT
+        GROUPING(party) = 0 as is_supplier_row,
+        period_month,
+        final_category,
+        directorate,
+        source,
+        party,
+        is_excluded,
+        (SUM(amount_gbp) * 100)::bigint as spend,
+        COUNT(amount_gbp) as txn_count,
+        (SUM(amount_gbp) FILTER (WHERE source = 'No PO') * 100)::bigint as non_po_spend,
+        (SUM(amount_gbp) FILTER (WHERE source <> 'No PO' OR source IS NULL) * 100)::bigint as po_spend
+    FROM ap_transactions
+    GROUP BY GROUPING SETS (
+        (period_month, final_category, directorate, source, is_excluded),
+        (party, is_excluded)
+    )
+"""
+
+CONTRACT_DATES_QUERY = "SELECT end_date FROM contracts WHERE end_date IS NOT NULL"
+NO_CONTRACT_QUERY = "SELECT COUNT(*) FROM mv_suppliers_without_contracts"
+
+def _pounds(pence):
+    return Decimal(int(pence)) / 100
+
+def _percentage(part, whole, places):
+    """ROUND(part / whole * 100, places) as Postgres computes it; None when whole is 0"""
+    if not whole:
+        return None
+    exponent = Decimal(1).scaleb(-places)
+    return (Decimal(int(part)) * 100 / Decimal(int(whole))).quantize(exponent, ROUND_HALF_UP)
+
+def _encode(values):
+    """Dense codes for a column: (labels sorted with None last, code per value)"""
+    labels = sorted({v for v in values if v is not None})
+    if any(v is None for v in values):
+        labels.append(None)
+    index = {label: i for i, label in enumerate(labels)}
+    codes = np.fromiter((index[v] for v in values), dtype=np.intp, count=len(values))
+    return labels, codes
+
+def month_label(month):
+    """TO_CHAR(period_month, 'Mon-YY'), as in mv_monthly_dashboard"""
+    return month.strftime('%b-%y') if month is not None else None
+
+class CubeTooLarge(Exception):
+    pass
+
+class SpendCube:
+    """Spend, transaction count, non-PO and PO spend per (month, category, directorate, source, excluded)"""
+
+    def __init__(self, version, cells, suppliers, contract_end_dates, no_contract_suppliers):
+        self.version = version
+        self.built_at = datetime.now()
+
+        columns = [DIMENSION_COLUMNS[d] for d in DIMENSIONS]
+        self.labels = {}
+        codes = []
+        for dim, column in zip(DIMENSIONS, columns):
+            self.labels[dim], dim_codes = _encode([row[column] for row in cells])
+            codes.append(dim_codes)
+        self.index = {dim: {label: i for i, label in enumerate(self.labels[dim])}
+                      for dim in DIMENSIONS}
+        # Last axis: is_excluded (False, True)
+        codes.append(np.fromiter((row['is_excluded'] for row in cells), dtype=np.intp, count=len(cells)))
+        shape = tuple(len(self.labels[d]) for d in DIMENSIONS) + (2,)
+
+        size = int(np.prod(shape))
+        if size > CUBE_MAX_CELLS:
+            raise CubeTooLarge(f"{size:,} cells exceeds CUBE_MAX_CELLS ({CUBE_MAX_CELLS:,})")
+
+        cell = tuple(codes)
+        self.spend = np.zeros(shape, dtype=np.int64)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.non_po_spend = np.zeros(shape, dtype=np.int64)
+        self.po_spend = np.zeros(shape, dtype=np.int64)
+        self.spend[cell] = [row['spend'] or 0 for row in cells]
+        self.count[cell] = [row['txn_count'] for row in cells]
+        self.non_po_spend[cell] = [row['non_po_spend'] or 0 for row in cells]
+        self.po_spend[cell] = [row['po_spend'] or 0 for row in cells]
+
+        # Included periods only; a party whose amounts are all NULL has a NULL total
+        included = [row for row in suppliers if not row['is_excluded']]
+        self.supplier_spend = np.array([row['spend'] or 0 for row in included], dtype=np.int64)
+        self.supplier_count = np.array([row['txn_count'] for row in included], dtype=np.int64)
+        self.named_suppliers = sum(1 for row in included if row['party'] is not None)
+
+        self.contract_end_dates = np.array(contract_end_dates, dtype='datetime64[D]')
+        self.no_contract_suppliers = no_contract_suppliers
+
+    @property
+    def measures(self):
+        return (self.spend, self.count, self.non_po_spend, self.po_spend)
+
+    @property
+    def cells(self):
+        return self.spend.size
+
+    def stats(self):
+        return {
+            'data_version': self.version,
+            'built_at': self.built_at,
+            'shape': dict(zip(DIMENSIONS + ('excluded',), self.spend.shape)),
+            'cells': self.cells,
+            'bytes': sum(measure.nbytes for measure in self.measures),
+            'suppliers': len(self.supplier_spend),
+        }
+
+    # SLICING
+
+    def masks(self, month_from=None, month_to=None, **members):
+        """Boolean selection per axis; members maps a dimension to the labels to keep"""
+        masks = []
+        for dim in DIMENSIONS:
+            labels = self.labels[dim]
+            mask = np.ones(len(labels), dtype=bool)
+            if dim == 'month' and (month_from or month_to):
+                mask = np.array([m is not None and (month_from is None or m >= month_from)
+                                 and (month_to is None or m <= month_to) for m in labels], dtype=bool)
+            wanted = members.get(dim)
+            if wanted:
+                keep = np.zeros(len(labels), dtype=bool)
+                keep[[self.index[dim][v] for v in wanted if v in self.index[dim]]] = True
+                mask &= keep
+            masks.append(mask)
+        # Excluded months never count towards the dashboard
+        masks.append(np.array([True, False]))
+        return masks
+
+    def totals_by(self, dim, masks):
+        """(spend, count, non_po_spend, po_spend) per label of `dim` within the selection"""
+        axis = DIMENSIONS.index(dim)
+        selection = np.ix_(*masks)
+        other_axes = tuple(a for a in range(self.spend.ndim) if a != axis)
+        sums = [measure[selection].sum(axis=other_axes)
+                for measure in self.measures]
+        labels = [label for label, keep in zip(self.labels[dim], masks[axis]) if keep]
+        return labels, sums
+
+    def total(self, masks):
+        selection = np.ix_(*masks)
+        return tuple(int(measure[selection].sum()) for measure in self.measures)
+
+    # DASHBOARD
+
+    def kpi_row(self, today=None):
+        """The KPI_QUERY row (app.compute_kpis), computed from the arrays"""
+        today = np.datetime64(today or date.today(), 'D')
+        spend, count, _, _ = self.total(self.masks())
+
+        # ROW_NUMBER() OVER (ORDER BY spend DESC) puts NULL totals first
+        null_totals = self.supplier_count == 0
+        ranked = np.concatenate([np.zeros(int(null_totals.sum()), dtype=np.int64),
+                                 np.sort(self.supplier_spend[~null_totals])[::-1]])
+        top_20 = int(ranked[:20].sum())
+
+        end_dates = self.contract_end_dates
+        return {
+            'total_spend': _pounds(spend),
+            'unique_suppliers': self.named_suppliers,
+            'avg_transaction': _pounds(spend) / count if count else Decimal(0),
+            'top_20_concentration': _percentage(top_20, spend, 1) or Decimal(0),
+            'active_contracts': int((end_dates > today).sum()),
+            'expiring_contracts': int(((end_dates >= today) & (end_dates <= today + 90)).sum()),
+            'no_contract_suppliers': self.no_contract_suppliers,
+        }
+
+    def monthly_trend(self):
+        months, (spend, count, non_po, po) = self.totals_by('month', self.masks())
+        # Excluded months have nothing left in the selection and drop out
+        return [{
+            'month': month_label(month),
+            'total_spend': _pounds(s),
+            'non_po_spend': _pounds(n),
+            'po_spend': _pounds(p),
+            'non_po_percentage': _percentage(n, s, 2),
+        } for month, s, c, n, p in zip(months, spend, count, non_po, po) if c]
+
+    def top_by(self, dim, min_spend, limit=10, masks=None):
+        """Labels of `dim` by spend (largest first) above min_spend pence, with non-PO share"""
+        labels, (spend, count, non_po, _) = self.totals_by(dim, masks or self.masks())
+        keep = (count > 0) & (spend > min_spend)
+        order = [i for i in np.argsort(-spend, kind='stable') if keep[i]][:limit]
+        return [(labels[i], _pounds(spend[i]), _percentage(non_po[i], spend[i], 2)) for i in order]
+
+    def chart_data(self):
+        """The /api/dashboard/charts payload (same shape as app.CHART_QUERIES)"""
+        directorate_masks = self.masks()
+        for i, label in enumerate(self.labels['directorate']):
+            if label is None or label == '':
+                directorate_masks[DIMENSIONS.index('directorate')][i] = False
+
+        return {
+            'monthly_trend': self.monthly_trend(),
+            'category_spend': [
+                {'final_category': label, 'total_spend': spend, 'non_po_percentage': pct}
+                for label, spend, pct in self.top_by('category', 0)
+            ],
+            'directorate_spend': [
+                {'directorate': label, 'spend': spend, 'non_po_pct': pct}
+                for label, spend, pct in self.top_by('directorate', 1000 * 100, masks=directorate_masks)
+            ],
+        }
+
+    def drilldown(self, group_by, month_from=None, month_to=None, **members):
+        """Spend per `group_by` label within the filters; months come in date order, others by spend"""
+        masks = self.masks(month_from, month_to, **members)
+        labels, (spend, count, non_po, _) = self.totals_by(group_by, masks)
+        order = range(len(labels)) if group_by == 'month' else np.argsort(-spend, kind='stable')
+
+        rows = []
+        for i in order:
+            if not count[i]:
+                continue
+            row = {group_by: labels[i]}
+            if group_by == 'month':
+                row = {'month': month_label(labels[i]), 'period_month': labels[i]}
+            row.update({
+                'total_spend': _pounds(spend[i]),
+                'transactions': int(count[i]),
+                'non_po_spend': _pounds(non_po[i]),
+                'non_po_percentage': _percentage(non_po[i], spend[i], 2),
+            })
+            rows.append(row)
+
+        spend, count, non_po, _ = self.total(masks)
+        totals = {
+            'total_spend': _pounds(spend),
+            'transactions': count,
+            'non_po_spend': _pounds(non_po),
+            'non_po_percentage': _percentage(non_po, spend, 2),
+        }
+        return rows, totals
+
+def load_cube(cursor, version):
+    """Run the aggregate query (plus contract end dates) on `cursor` and load the arrays"""
+    cursor.execute(CUBE_QUERY)
+    columns = [desc[0] for desc in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    cursor.execute(CONTRACT_DATES_QUERY)
+    end_dates = [row[0] for row in cursor.fetchall()]
+    cursor.execute(NO_CONTRACT_QUERY)
+    no_contract_suppliers = cursor.fetchone()[0]
+
+    cells = [row for row in rows if not row['is_supplier_row']]
+    suppliers = [row for row in rows if row['is_supplier_row']]
+    return SpendCube(version, cells, suppliers, end_dates, no_contract_suppliers), len(cells)
+
+def build_cube(version):
+    """Build the cube for `version` on a pooled connection"""
+    started = time.perf_counter()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cube, groups = load_cube(cursor, version)
+        cursor.close()
+        conn.rollback()
+
+    print(f"✓ Spend cube built for data version {version}: {cube.cells:,} cells "
+          f"from {groups:,} groups in {time.perf_counter() - started:.2f}s")
+    return cube
+
+# Seconds before a failed build is retried under the same data version
+RETRY_AFTER = 60
+
+_cube = None
+_failed = {'version': None, 'at': 0.0}
+_build_lock = threading.Lock()
+
+def get_cube():
+    """The cube for the current data version (built on first use), or None when unavailable
+
+    Without a cube (DASHBOARD_CUBE off, too many cells, failed build) the
+    dashboard endpoints fall back to their SQL queries.
+    """
+    global _cube
+    if not DASHBOARD_CUBE:
+        return None
+
+    version = data_version.current()[0]
+    cube = _cube
+    if cube is not None and cube.version == version:
+        return cube
+
+    with _build_lock:
+        if _cube is not None and _cube.version == version:
+            return _cube
+        if _failed['version'] == version and time.monotonic() - _failed['at'] < RETRY_AFTER:
+            return None
+        try:
+            _cube = build_cube(version)
+        except Exception as e:
+            print(f"Spend cube unavailable, using SQL: {e}")
+            _failed.update(version=version, at=time.monotonic())
+            return None
+        return _cube
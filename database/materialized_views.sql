@@ -0,0 +1,87 @@
+-- Materialized copies of the analytics views
+-- The API reads the mv_* names; import_data.py refreshes them after each load.
+-- Re-run this file whenever the underlying vw_* views are recreated:
+--   psql -U contract_admin -d contract_management -f database/materialized_views.sql
+--
+-- Every materialized view carries a plain-column UNIQUE index so it can be
+-- refreshed with REFRESH MATERIALIZED VIEW CONCURRENTLY (readers never block).
+-- Statuses that depend on CURRENT_DATE are as of the last refresh.
+
+-- Trigram indexes back substring search on the contracts view
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+DROP MATERIALIZED VIEW IF EXISTS mv_contract_vs_invoiced;
+DROP MATERIALIZED VIEW IF EXISTS mv_monthly_dashboard;
+DROP MATERIALIZED VIEW IF EXISTS mv_suppliers_without_contracts;
+DROP MATERIALIZED VIEW IF EXISTS mv_category_spend;
+
+-- REFRESH LOG (one row per materialized view, exposed as data freshness)
+CREATE TABLE IF NOT EXISTS analytics_refresh_log (
+    view_name VARCHAR(100) PRIMARY KEY,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INTEGER
+);
+
+-- 1. CONTRACT VS INVOICED
+-- status_rank is the API's custom status ordering (critical statuses first)
+CREATE MATERIALIZED VIEW mv_contract_vs_invoiced AS
+SELECT
+    v.*,
+    CASE v.status
+        WHEN 'NO_CONTRACT' THEN 1
+        WHEN 'EXPIRED' THEN 2
+        WHEN 'OVERSPEND' THEN 3
+        WHEN 'UNDERUTILIZED' THEN 4
+        WHEN 'NO_ACTIVITY' THEN 5
+        WHEN 'ON_TRACK' THEN 6
+        ELSE 7
+    END as status_rank
+FROM vw_contract_vs_invoiced v;
+
+CREATE UNIQUE INDEX idx_mv_contract_row_key ON mv_contract_vs_invoiced(row_key);
+CREATE INDEX idx_mv_contract_status ON mv_contract_vs_invoiced(status);
+
+-- One index per /api/contracts sort key, ending in row_key for keyset paging
+CREATE INDEX idx_mv_contract_sort_status ON mv_contract_vs_invoiced(status_rank, invoiced_ytd DESC, row_key);
+CREATE INDEX idx_mv_contract_sort_supplier ON mv_contract_vs_invoiced(supplier, row_key);
+CREATE INDEX idx_mv_contract_sort_name ON mv_contract_vs_invoiced(contract_name, row_key);
+CREATE INDEX idx_mv_contract_sort_category ON mv_contract_vs_invoiced(category, row_key);
+CREATE INDEX idx_mv_contract_sort_budget ON mv_contract_vs_invoiced(annual_value_current, row_key);
+CREATE INDEX idx_mv_contract_sort_invoiced ON mv_contract_vs_invoiced(invoiced_ytd, row_key);
+CREATE INDEX idx_mv_contract_sort_variance ON mv_contract_vs_invoiced(variance_percentage, row_key);
+CREATE INDEX idx_mv_contract_sort_start ON mv_contract_vs_invoiced(start_date, row_key);
+CREATE INDEX idx_mv_contract_sort_end ON mv_contract_vs_invoiced(end_date, row_key);
+
+CREATE INDEX idx_mv_contract_supplier_trgm ON mv_contract_vs_invoiced USING gin (supplier gin_trgm_ops);
+CREATE INDEX idx_mv_contract_name_trgm ON mv_contract_vs_invoiced USING gin (contract_name gin_trgm_ops);
+
+-- 2. MONTHLY DASHBOARD
+CREATE MATERIALIZED VIEW mv_monthly_dashboard AS
+SELECT * FROM vw_monthly_dashboard;
+
+CREATE UNIQUE INDEX idx_mv_monthly_period ON mv_monthly_dashboard(period_month);
+
+-- 3. SUPPLIERS WITHOUT CONTRACTS
+CREATE MATERIALIZED VIEW mv_suppliers_without_contracts AS
+SELECT * FROM vw_suppliers_without_contracts;
+
+CREATE UNIQUE INDEX idx_mv_no_contract_key
+    ON mv_suppliers_without_contracts(supplier_name, final_category, directorate);
+
+-- 4. CATEGORY SPEND
+CREATE MATERIALIZED VIEW mv_category_spend AS
+SELECT * FROM vw_category_spend;
+
+CREATE UNIQUE INDEX idx_mv_category_final ON mv_category_spend(final_category);
+
+INSERT INTO analytics_refresh_log (view_name, refreshed_at, duration_ms)
+SELECT view_name, CURRENT_TIMESTAMP, NULL
+FROM (VALUES
+    ('mv_contract_vs_invoiced'),
+    ('mv_monthly_dashboard'),
+    ('mv_suppliers_without_contracts'),
+    ('mv_category_spend')
+) v(view_name)
+ON CONFLICT (view_name) DO UPDATE SET
+    refreshed_at = EXCLUDED.refreshed_at,
+    duration_ms = EXCLUDED.duration_ms;
@@ -7,17 +7,24 @@ DROP VIEW IF EXISTS vw_category_spend CASCADE;
 DROP VIEW IF EXISTS vw_expiring_contracts CASCADE;
 DROP TABLE IF EXISTS ap_transactions CASCADE;
 DROP TABLE IF EXISTS contracts CASCADE;
+DROP TABLE IF EXISTS supplier_aliases CASCADE;
 DROP TABLE IF EXISTS suppliers CASCADE;
+DROP TABLE IF EXISTS data_version CASCADE;
+DROP TABLE IF EXISTS ai_catalog CASCADE;
+DROP TABLE IF EXISTS duplicate_invoices CASCADE;
+DROP TABLE IF EXISTS duplicate_scan CASCADE;
 
 -- AP TRANSACTIONS TABLE (matches Excel exactly)
+-- Range-partitioned by financial year on transaction_date; the importer
+-- creates partitions as needed (see partitions.py)
 CREATE TABLE ap_transactions (
-    transaction_id SERIAL PRIMARY KEY,
+    transaction_id SERIAL,
     
     -- Financial details
     subjective_name VARCHAR(255),
     amount_gbp DECIMAL(15,2),
     month VARCHAR(20),
-    transaction_date DATE,
+    transaction_date DATE NOT NULL,
     party VARCHAR(500),
     source_transaction VARCHAR(100),
     description TEXT,
@@ -58,17 +65,51 @@ CREATE TABLE ap_transactions (
     coding VARCHAR(100),
     non_po_flag VARCHAR(10),
     
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    -- Canonical first-of-month period derived from month / transaction_date,
+    -- and whether it is one of EXCLUDED_MONTHS (both set by the importer)
+    period_month DATE,
+    is_excluded BOOLEAN NOT NULL DEFAULT FALSE,
+    
+    -- Supplier master link (resolved from party by the importer)
+    supplier_id INTEGER,
+    
+    -- Incremental import fingerprints (md5 of business key / all columns)
+    row_key CHAR(32),
+    row_hash CHAR(32),
+    
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP,
+    
+    -- Unique keys on a partitioned table must include the partition key
+    PRIMARY KEY (transaction_id, transaction_date)
+) PARTITION BY RANGE (transaction_date);
 
 -- Performance indexes
 CREATE INDEX idx_ap_party ON ap_transactions(party);
-CREATE INDEX idx_ap_date ON ap_transactions(transaction_date);
+-- Rows arrive roughly in date order, so a BRIN summary is enough for range scans
+CREATE INDEX idx_ap_date_brin ON ap_transactions USING brin (transaction_date);
 CREATE INDEX idx_ap_month ON ap_transactions(month);
+CREATE INDEX idx_ap_period_month ON ap_transactions(period_month);
 CREATE INDEX idx_ap_source ON ap_transactions(source);
 CREATE INDEX idx_ap_final_category ON ap_transactions(final_category);
 CREATE INDEX idx_ap_non_po ON ap_transactions(non_po_flag);
+
+-- Dashboard aggregates read only included rows, straight from these
+-- partial covering indexes
+CREATE INDEX idx_ap_included_party ON ap_transactions(party)
+    INCLUDE (amount_gbp) WHERE NOT is_excluded;
+CREATE INDEX idx_ap_included_category ON ap_transactions(final_category)
+    INCLUDE (amount_gbp, source) WHERE NOT is_excluded;
+CREATE INDEX idx_ap_included_directorate ON ap_transactions(directorate)
+    INCLUDE (amount_gbp, source) WHERE NOT is_excluded;
 CREATE INDEX idx_ap_directorate ON ap_transactions(directorate);
+CREATE UNIQUE INDEX idx_ap_row_key ON ap_transactions(row_key, transaction_date);
+CREATE INDEX idx_ap_row_key_missing ON ap_transactions(transaction_id) WHERE row_key IS NULL;
+CREATE INDEX idx_ap_supplier_id ON ap_transactions(supplier_id);
+CREATE INDEX idx_ap_supplier_missing ON ap_transactions(transaction_id)
+    WHERE supplier_id IS NULL AND party IS NOT NULL;
+-- Last change of each row; duplicate detection scans only rows changed since its last run
+CREATE INDEX idx_ap_changed_at ON ap_transactions ((COALESCE(updated_at, created_at)));
 
 -- CONTRACTS TABLE (matches Excel exactly)
 CREATE TABLE contracts (
@@ -139,7 +180,15 @@ CREATE TABLE contracts (
     estimated_total_contract_value DECIMAL(15,2),
     notes TEXT,
     
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    -- Supplier master link (resolved from supplier by the importer)
+    supplier_id INTEGER,
+    
+    -- Incremental import fingerprints (md5 of business key / all columns)
+    row_key CHAR(32),
+    row_hash CHAR(32),
+    
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP
 );
 
 -- Contract indexes
@@ -147,11 +196,16 @@ CREATE INDEX idx_contract_supplier ON contracts(supplier);
 CREATE INDEX idx_contract_end_date ON contracts(end_date);
 CREATE INDEX idx_contract_category ON contracts(category);
 CREATE INDEX idx_contract_rag ON contracts(service_rag);
+CREATE UNIQUE INDEX idx_contract_row_key ON contracts(row_key);
+CREATE INDEX idx_contract_row_key_missing ON contracts(contract_id) WHERE row_key IS NULL;
+CREATE INDEX idx_contract_supplier_id ON contracts(supplier_id);
 
 -- SUPPLIERS MASTER TABLE
 CREATE TABLE suppliers (
     supplier_id SERIAL PRIMARY KEY,
     supplier_name VARCHAR(500) UNIQUE NOT NULL,
+    -- Lower-case, punctuation-free, legal suffix stripped (suppliers.normalize_supplier_name)
+    normalized_key VARCHAR(500) UNIQUE NOT NULL,
     total_spend DECIMAL(15,2) DEFAULT 0,
     transaction_count INTEGER DEFAULT 0,
     has_contract BOOLEAN DEFAULT FALSE,
@@ -159,24 +213,96 @@ CREATE TABLE suppliers (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Every raw spelling seen in party / supplier, mapped to its master row
+CREATE TABLE supplier_aliases (
+    alias VARCHAR(500) PRIMARY KEY,
+    supplier_id INTEGER NOT NULL REFERENCES suppliers(supplier_id),
+    match_type VARCHAR(10) NOT NULL,  -- 'new', 'exact' or 'fuzzy'
+    similarity DECIMAL(4,3),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_supplier_alias_supplier ON supplier_aliases(supplier_id);
+
+ALTER TABLE ap_transactions
+    ADD CONSTRAINT fk_ap_supplier FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id);
+ALTER TABLE contracts
+    ADD CONSTRAINT fk_contract_supplier FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id);
+
+-- DATA VERSION (single row, bumped by import_data.py after every import
+-- that changes data; the API's response cache is invalidated when it moves)
+CREATE TABLE data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1,
+    -- With a time zone, so it converts to the GMT Last-Modified header correctly
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO data_version DEFAULT VALUES;
+
+-- AI CATALOG (single row, rebuilt by import_data.py from the live data;
+-- its prompt text replaces the hand-written schema in the AI system prompt)
+CREATE TABLE ai_catalog (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    built_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    catalog JSONB NOT NULL,
+    prompt TEXT NOT NULL
+);
+
+-- DUPLICATE INVOICES (pairs of likely duplicate payments found by duplicates.py;
+-- transaction_id is the later row of the pair, duplicate_of the earlier one)
+CREATE TABLE duplicate_invoices (
+    transaction_id INTEGER NOT NULL,
+    transaction_date DATE NOT NULL,
+    duplicate_of INTEGER NOT NULL,
+    duplicate_of_date DATE NOT NULL,
+    supplier_id INTEGER REFERENCES suppliers(supplier_id),
+    amount_gbp DECIMAL(15,2),
+    duplicate_of_amount DECIMAL(15,2),
+    days_apart INTEGER NOT NULL,
+    score DECIMAL(4,3) NOT NULL,
+    match_type VARCHAR(10) NOT NULL,  -- 'exact' or 'near'
+    detected_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (transaction_id, duplicate_of)
+);
+
+CREATE INDEX idx_duplicate_of ON duplicate_invoices(duplicate_of);
+CREATE INDEX idx_duplicate_score ON duplicate_invoices(score DESC);
+
+-- DUPLICATE SCAN (single row: the last ap_transactions change already scanned)
+CREATE TABLE duplicate_scan (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    scanned_through TIMESTAMP,
+    scanned_at TIMESTAMP,
+    rows_scanned INTEGER NOT NULL DEFAULT 0,
+    duration_ms INTEGER
+);
+
+INSERT INTO duplicate_scan DEFAULT VALUES;
+
 -- ANALYSIS VIEWS
 
 -- 1. CONTRACT VS INVOICED
 CREATE VIEW vw_contract_vs_invoiced AS
 WITH current_year_spend AS (
     SELECT 
-        LOWER(TRIM(party)) as supplier_clean,
-        party as supplier_original,
+        supplier_id,
+        MIN(party) as supplier_original,
         SUM(amount_gbp) as invoiced_ytd,
         COUNT(*) as invoice_count,
         MAX(transaction_date) as last_invoice_date,
         SUM(CASE WHEN non_po_flag = 'Y' THEN amount_gbp ELSE 0 END) as non_po_spend
     FROM ap_transactions
     WHERE transaction_date >= CURRENT_DATE - INTERVAL '12 months'
-    GROUP BY party
+    GROUP BY supplier_id
 ),
 calc_view AS (
     SELECT 
+        -- Stable unique key per row
+        CASE
+            WHEN c.contract_id IS NOT NULL THEN 'C' || c.contract_id
+            ELSE 'S' || COALESCE(s.supplier_id::text, '')
+        END as row_key,
         c.contract_id,
         COALESCE(c.supplier, s.supplier_original, '[No Contract]') as supplier,
         c.subcontract_reference as contract_reference,
@@ -224,7 +350,7 @@ calc_view AS (
 
     FROM contracts c
     FULL OUTER JOIN current_year_spend s 
-        ON LOWER(TRIM(c.supplier)) = s.supplier_clean
+        ON c.supplier_id = s.supplier_id
     WHERE 
         c.contract_id IS NOT NULL 
         OR (s.invoiced_ytd > 5000)
@@ -241,8 +367,11 @@ ORDER BY
 
 -- 2. MONTHLY DASHBOARD
 CREATE VIEW vw_monthly_dashboard AS
-SELECT 
-    month,
+SELECT
+    period_month,
+    TO_CHAR(period_month, 'Mon-YY') as month,
+    -- Every row of a period shares its flag (see import_data.flag_excluded_periods)
+    BOOL_AND(is_excluded) as is_excluded,
     COUNT(*) as total_transactions,
     COUNT(DISTINCT party) as unique_suppliers,
     SUM(amount_gbp) as total_spend,
@@ -255,8 +384,8 @@ SELECT
         2
     ) as non_po_percentage
 FROM ap_transactions
-GROUP BY month
-ORDER BY month;
+GROUP BY period_month
+ORDER BY period_month;
 
 -- 3. NON-PO ANALYSIS
 CREATE VIEW vw_non_po_analysis AS
@@ -295,8 +424,9 @@ SELECT
         2
     ) as non_po_percentage
 FROM ap_transactions ap
-LEFT JOIN contracts c ON LOWER(TRIM(ap.party)) = LOWER(TRIM(c.supplier))
-WHERE c.contract_id IS NULL
+WHERE NOT EXISTS (
+    SELECT 1 FROM contracts c WHERE c.supplier_id = ap.supplier_id
+)
 GROUP BY ap.party, ap.final_category, ap.directorate
 HAVING SUM(ap.amount_gbp) > 5000
 ORDER BY total_spend DESC;
@@ -343,6 +473,9 @@ WHERE end_date IS NOT NULL
   AND end_date <= CURRENT_DATE + INTERVAL '180 days'
 ORDER BY end_date;
 
+-- Materialized copies of the analytics views (psql meta-command)
+\ir materialized_views.sql
+
 -- Grant permissions
 GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA public TO contract_admin;
 GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA public TO contract_admin;
@@ -0,0 +1,193 @@
+-- Bring an existing database up to the current schema.sql without reloading data
+-- Safe to run repeatedly:
+--   psql -U contract_admin -d contract_management -f database/upgrade.sql
+--
+-- Financial-year partitioning of ap_transactions cannot be applied in place.
+-- Databases created before it need a rebuild from the source extracts:
+--   psql -U contract_admin -d contract_management -f database/schema.sql
+--   psql -U contract_admin -d contract_management -f update_views_for_source.sql
+--   python import_data.py --mode reload
+
+-- Incremental import fingerprints
+ALTER TABLE ap_transactions ADD COLUMN IF NOT EXISTS row_key CHAR(32);
+ALTER TABLE ap_transactions ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+ALTER TABLE ap_transactions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ap_row_key ON ap_transactions(row_key);
+CREATE INDEX IF NOT EXISTS idx_ap_row_key_missing ON ap_transactions(transaction_id) WHERE row_key IS NULL;
+
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS row_key CHAR(32);
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_contract_row_key ON contracts(row_key);
+CREATE INDEX IF NOT EXISTS idx_contract_row_key_missing ON contracts(contract_id) WHERE row_key IS NULL;
+
+-- Supplier master: normalized key, aliases and integer supplier_id links
+ALTER TABLE suppliers ADD COLUMN IF NOT EXISTS normalized_key VARCHAR(500);
+UPDATE suppliers SET normalized_key = LOWER(TRIM(supplier_name)) WHERE normalized_key IS NULL;
+ALTER TABLE suppliers ALTER COLUMN normalized_key SET NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS suppliers_normalized_key_key ON suppliers(normalized_key);
+
+CREATE TABLE IF NOT EXISTS supplier_aliases (
+    alias VARCHAR(500) PRIMARY KEY,
+    supplier_id INTEGER NOT NULL REFERENCES suppliers(supplier_id),
+    match_type VARCHAR(10) NOT NULL,
+    similarity DECIMAL(4,3),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_supplier_alias_supplier ON supplier_aliases(supplier_id);
+
+ALTER TABLE ap_transactions ADD COLUMN IF NOT EXISTS supplier_id INTEGER REFERENCES suppliers(supplier_id);
+CREATE INDEX IF NOT EXISTS idx_ap_supplier_id ON ap_transactions(supplier_id);
+CREATE INDEX IF NOT EXISTS idx_ap_supplier_missing ON ap_transactions(transaction_id)
+    WHERE supplier_id IS NULL AND party IS NOT NULL;
+
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS supplier_id INTEGER REFERENCES suppliers(supplier_id);
+CREATE INDEX IF NOT EXISTS idx_contract_supplier_id ON contracts(supplier_id);
+
+-- vw_contract_vs_invoiced joins on supplier_id (same columns, so replace in place)
+CREATE OR REPLACE VIEW vw_contract_vs_invoiced AS
+WITH current_year_spend AS (
+    SELECT 
+        supplier_id,
+        MIN(party) as supplier_original,
+        SUM(amount_gbp) as invoiced_ytd,
+        COUNT(*) as invoice_count,
+        MAX(transaction_date) as last_invoice_date,
+        SUM(CASE WHEN non_po_flag = 'Y' THEN amount_gbp ELSE 0 END) as non_po_spend
+    FROM ap_transactions
+    WHERE transaction_date >= CURRENT_DATE - INTERVAL '12 months'
+    GROUP BY supplier_id
+),
+calc_view AS (
+    SELECT 
+        -- Stable unique key per row
+        CASE
+            WHEN c.contract_id IS NOT NULL THEN 'C' || c.contract_id
+            ELSE 'S' || COALESCE(s.supplier_id::text, '')
+        END as row_key,
+        c.contract_id,
+        COALESCE(c.supplier, s.supplier_original, '[No Contract]') as supplier,
+        c.subcontract_reference as contract_reference,
+        c.contract_name,
+        c.estimated_total_contract_value as contract_value,
+        c.budget_2425 as annual_value_current,
+        c.start_date,
+        c.end_date,
+        c.service_rag,
+        c.category,
+        COALESCE(s.invoiced_ytd, 0) as invoiced_ytd,
+        COALESCE(s.invoice_count, 0) as invoice_count,
+        COALESCE(s.non_po_spend, 0) as non_po_spend_ytd,
+        s.last_invoice_date,
+        
+        -- Variance calculation
+        CASE 
+            WHEN c.budget_2425 > 0 AND s.invoiced_ytd IS NOT NULL THEN
+                ROUND((s.invoiced_ytd - c.budget_2425) / c.budget_2425 * 100, 2)
+            ELSE NULL
+        END as variance_percentage,
+        
+        -- Status determination
+        CASE 
+            WHEN c.contract_id IS NULL AND s.invoiced_ytd > 10000 THEN 'NO_CONTRACT'
+            WHEN c.end_date < CURRENT_DATE THEN 'EXPIRED'
+            WHEN c.end_date IS NULL AND c.contract_id IS NOT NULL THEN 'NO_END_DATE'
+            WHEN s.invoiced_ytd > c.budget_2425 * 1.15 THEN 'OVERSPEND'
+            WHEN s.invoiced_ytd < c.budget_2425 * 0.3 AND s.invoiced_ytd > 0 THEN 'UNDERUTILIZED'
+            WHEN s.invoiced_ytd IS NULL OR s.invoiced_ytd = 0 THEN 'NO_ACTIVITY'
+            ELSE 'ON_TRACK'
+        END as status,
+        
+        -- Days to expiry
+        CASE 
+            WHEN c.end_date IS NOT NULL THEN c.end_date - CURRENT_DATE
+            ELSE NULL
+        END as days_to_expiry,
+        
+        -- Risk flags
+        CASE 
+            WHEN s.non_po_spend > s.invoiced_ytd * 0.5 THEN TRUE
+            ELSE FALSE
+        END as high_non_po_risk
+
+    FROM contracts c
+    FULL OUTER JOIN current_year_spend s 
+        ON c.supplier_id = s.supplier_id
+    WHERE 
+        c.contract_id IS NOT NULL 
+        OR (s.invoiced_ytd > 5000)
+)
+SELECT * FROM calc_view
+ORDER BY 
+    CASE 
+        WHEN status = 'NO_CONTRACT' THEN 1
+        WHEN status = 'EXPIRED' THEN 2
+        WHEN status = 'OVERSPEND' THEN 3
+        ELSE 4
+    END,
+    COALESCE(invoiced_ytd, 0) DESC;
+
+-- vw_suppliers_without_contracts changes too; re-run the view scripts after this:
+--   psql -U contract_admin -d contract_management -f update_views_for_source.sql
+-- then populate the links with: python import_data.py
+
+-- Data version stamp for API response cache invalidation
+CREATE TABLE IF NOT EXISTS data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO data_version DEFAULT VALUES ON CONFLICT (id) DO NOTHING;
+-- Earlier versions stored local time without a zone; existing stamps are read
+-- in the session time zone (a no-op once the column is TIMESTAMPTZ)
+ALTER TABLE data_version ALTER COLUMN changed_at TYPE TIMESTAMPTZ;
+
+-- Canonical period and EXCLUDED_MONTHS flag
+ALTER TABLE ap_transactions ADD COLUMN IF NOT EXISTS period_month DATE;
+ALTER TABLE ap_transactions ADD COLUMN IF NOT EXISTS is_excluded BOOLEAN NOT NULL DEFAULT FALSE;
+CREATE INDEX IF NOT EXISTS idx_ap_period_month ON ap_transactions(period_month);
+CREATE INDEX IF NOT EXISTS idx_ap_included_party ON ap_transactions(party)
+    INCLUDE (amount_gbp) WHERE NOT is_excluded;
+CREATE INDEX IF NOT EXISTS idx_ap_included_category ON ap_transactions(final_category)
+    INCLUDE (amount_gbp, source) WHERE NOT is_excluded;
+CREATE INDEX IF NOT EXISTS idx_ap_included_directorate ON ap_transactions(directorate)
+    INCLUDE (amount_gbp, source) WHERE NOT is_excluded;
+-- vw_monthly_dashboard now groups by period_month: re-run update_views_for_source.sql,
+-- then `python import_data.py ap` fills period_month / is_excluded for existing rows
+
+-- Generated schema/value catalog for the AI assistant (filled by the next import
+-- or `python catalog.py`)
+CREATE TABLE IF NOT EXISTS ai_catalog (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    built_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    catalog JSONB NOT NULL,
+    prompt TEXT NOT NULL
+);
+
+-- Duplicate invoice detection (the next import, or `python duplicates.py`,
+-- scans every existing row once)
+CREATE INDEX IF NOT EXISTS idx_ap_changed_at ON ap_transactions ((COALESCE(updated_at, created_at)));
+CREATE TABLE IF NOT EXISTS duplicate_invoices (
+    transaction_id INTEGER NOT NULL,
+    transaction_date DATE NOT NULL,
+    duplicate_of INTEGER NOT NULL,
+    duplicate_of_date DATE NOT NULL,
+    supplier_id INTEGER REFERENCES suppliers(supplier_id),
+    amount_gbp DECIMAL(15,2),
+    duplicate_of_amount DECIMAL(15,2),
+    days_apart INTEGER NOT NULL,
+    score DECIMAL(4,3) NOT NULL,
+    match_type VARCHAR(10) NOT NULL,  -- 'exact' or 'near'
+    detected_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (transaction_id, duplicate_of)
+);
+CREATE INDEX IF NOT EXISTS idx_duplicate_of ON duplicate_invoices(duplicate_of);
+CREATE INDEX IF NOT EXISTS idx_duplicate_score ON duplicate_invoices(score DESC);
+CREATE TABLE IF NOT EXISTS duplicate_scan (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    scanned_through TIMESTAMP,
+    scanned_at TIMESTAMP,
+    rows_scanned INTEGER NOT NULL DEFAULT 0,
+    duration_ms INTEGER
+);
+INSERT INTO duplicate_scan DEFAULT VALUES ON CONFLICT (id) DO NOTHING;
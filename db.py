@@ -0,0 +1,277 @@
+"""
+Database connection pool for ELFT Invoice Platform
+Keeps a bounded set of PostgreSQL connections open and hands them out per request
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from config import (
+    DB_CONFIG,
+    DB_POOL_MIN,
+    DB_POOL_MAX,
+    DB_POOL_TIMEOUT,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_VALIDATE_AFTER,
+)
+from metrics import InstrumentedCursor
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class _PooledConnection:
+    """Book-keeping wrapper around a raw psycopg2 connection"""
+
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool
+
+    - keeps at least `minconn` connections open, never more than `maxconn`
+    - blocks up to `timeout` seconds when saturated, then raises PoolTimeout
+    - pings connections idle longer than `validate_after` seconds on checkout
+    - closes and replaces connections older than `max_lifetime` seconds
+    """
+
+    def __init__(self, minconn, maxconn, timeout=30, max_lifetime=1800,
+                 validate_after=5, **connect_kwargs):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: min={minconn} max={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.validate_after = validate_after
+        self.connect_kwargs = connect_kwargs
+
+        self._lock = threading.Condition()
+        self._counter_lock = threading.Lock()
+        self._idle = []
+        self._in_use = {}
+        self._pending = 0
+        self._pid = os.getpid()
+        self._closed = False
+        self._stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_ms': 0.0,
+            'timeouts': 0,
+            'validation_failures': 0,
+            'recycled': 0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append(self._open())
+
+    # -- internals ---------------------------------------------------------
+
+    def _open(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._counter_lock:
+            self._stats['connections_opened'] += 1
+        return _PooledConnection(conn)
+
+    def _discard(self, pooled):
+        with self._counter_lock:
+            self._stats['connections_closed'] += 1
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, pooled):
+        return self.max_lifetime and time.monotonic() - pooled.created_at > self.max_lifetime
+
+    def _healthy(self, pooled):
+        conn = pooled.conn
+        if conn.closed:
+            return False
+        if time.monotonic() - pooled.last_used < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._pending
+
+    def _release_pending(self, pooled, reason):
+        if pooled is not None:
+            self._discard(pooled)
+        with self._lock:
+            self._pending -= 1
+            if reason:
+                self._stats[reason] += 1
+            self._lock.notify()
+
+    def _check_fork(self):
+        # Connections inherited from a parent process share its sockets;
+        # drop them without closing so the parent's sessions stay intact
+        if os.getpid() != self._pid:
+            self._idle = []
+            self._in_use = {}
+            self._pending = 0
+            self._pid = os.getpid()
+
+    # -- public API --------------------------------------------------------
+
+    def getconn(self):
+        """Check out a validated connection, blocking while the pool is saturated"""
+        deadline = time.monotonic() + self.timeout
+        waited_from = None
+
+        while True:
+            with self._lock:
+                self._check_fork()
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                pooled = self._idle.pop() if self._idle else None
+                if pooled is None and self._size() >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"No database connection available within {self.timeout}s "
+                            f"({len(self._in_use)}/{self.maxconn} in use)"
+                        )
+                    if waited_from is None:
+                        waited_from = time.monotonic()
+                        self._stats['waits'] += 1
+                    self._lock.wait(remaining)
+                    continue
+                self._pending += 1
+
+            # Network round-trips happen outside the lock
+            try:
+                if pooled is None:
+                    pooled = self._open()
+                elif self._expired(pooled):
+                    self._release_pending(pooled, 'recycled')
+                    continue
+                elif not self._healthy(pooled):
+                    self._release_pending(pooled, 'validation_failures')
+                    continue
+            except Exception:
+                self._release_pending(None, None)
+                raise
+
+            with self._lock:
+                self._pending -= 1
+                self._in_use[id(pooled.conn)] = pooled
+                self._stats['checkouts'] += 1
+                if waited_from is not None:
+                    self._stats['wait_time_ms'] += (time.monotonic() - waited_from) * 1000
+                return pooled.conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, resetting any open transaction"""
+        with self._lock:
+            self._check_fork()
+            pooled = self._in_use.pop(id(conn), None)
+            if pooled is None:
+                return
+            self._pending += 1
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed or self._closed or self._expired(pooled):
+            self._release_pending(pooled, 'recycled' if self._expired(pooled) else None)
+            return
+
+        with self._lock:
+            self._pending -= 1
+            pooled.last_used = time.monotonic()
+            self._idle.append(pooled)
+            self._lock.notify()
+
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            for pooled in self._idle:
+                self._discard(pooled)
+            self._idle = []
+            self._lock.notify_all()
+
+    def stats(self):
+        """Snapshot of pool size and saturation counters"""
+        with self._lock:
+            in_use = len(self._in_use)
+            stats = dict(self._stats)
+            stats.update({
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'open': in_use + len(self._idle),
+                'in_use': in_use,
+                'idle': len(self._idle),
+                'saturation': round(in_use / self.maxconn * 100, 1),
+                'wait_time_ms': round(stats['wait_time_ms'], 2),
+            })
+            return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    validate_after=DB_POOL_VALIDATE_AFTER,
+                    # Every query on pooled connections is timed for /metrics
+                    cursor_factory=InstrumentedCursor,
+                    **DB_CONFIG,
+                )
+    return _pool
+
+
+@contextmanager
+def get_db_connection():
+    """Check out a pooled connection for the duration of a `with` block
+
+    The connection always goes back to the pool, even if the block raises.
+    Connections that failed at the protocol level are discarded instead.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        pool.putconn(conn, discard=True)
+        raise
+    except BaseException:
+        pool.putconn(conn)
+        raise
+    else:
+        pool.putconn(conn)
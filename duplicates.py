@@ -0,0 +1,315 @@
+"""
+Duplicate invoice detection for ELFT Invoice Platform
+Finds pairs of ap_transactions rows that look like the same invoice paid
+twice: same supplier, amounts within DUPLICATE_AMOUNT_TOLERANCE and dates at
+most DUPLICATE_WINDOW_DAYS apart, scored on how close the amounts, dates and
+descriptions are. Pairs scoring at least DUPLICATE_MIN_SCORE are kept in the
+duplicate_invoices table.
+
+Comparing every row with every other is quadratic, so rows are blocked on
+their supplier master id and a logarithmic amount bucket and only compared
+with rows in the same or a neighbouring bucket. Each run only looks at rows
+added or changed since the last one (duplicate_scan.scanned_through), so
+the importer runs it after every AP import.
+
+Usage:
+    python duplicates.py          # scan rows changed since the last run
+    python duplicates.py --full   # forget the findings and rescan every row
+"""
+import argparse
+import difflib
+import math
+import re
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+
+from config import DB_CONFIG, DUPLICATE_WINDOW_DAYS, DUPLICATE_AMOUNT_TOLERANCE, DUPLICATE_MIN_SCORE
+
+# Share of the score from amount, date and description/reference similarity
+SCORE_WEIGHTS = {'amount': 0.35, 'date': 0.15, 'text': 0.5}
+
+# Changed rows per pass; a supplier's rows are never split across passes
+SCAN_CHUNK_ROWS = 100000
+
+# Candidate pairs materialized at once while sweeping a pass
+PAIR_BATCH = 1000000
+
+def normalize_description(text):
+    """Lower-case words and numbers only, so spacing and punctuation don't count"""
+    if text is None:
+        return ''
+    return ' '.join(re.findall(r'[a-z0-9]+', str(text).lower()))
+
+def amount_buckets(pence, tolerance):
+    """Bucket of each amount; amounts within `tolerance` of each other are at most one bucket apart"""
+    magnitude = np.abs(pence)
+    if tolerance <= 0:
+        return magnitude
+    return np.floor(np.log(magnitude) / -math.log1p(-tolerance)).astype(np.int64)
+
+def candidate_pairs(frame, window_days, tolerance):
+    """Positions (later, earlier) of row pairs worth scoring, about PAIR_BATCH pairs at a time
+
+    Rows are sorted by block (supplier, sign, amount bucket) and date, so the
+    rows of a block within window_days of a new row are one contiguous slice,
+    found by binary search in its own and the two neighbouring buckets. Only
+    pairs inside the window are ever materialized, a batch at a time; those
+    outside the amount tolerance are then dropped.
+    """
+    pence = frame['pence'].to_numpy()
+    days = frame['days'].to_numpy()
+    ids = frame['transaction_id'].to_numpy()
+    is_new = frame['is_new'].to_numpy()
+    suppliers = frame['supplier_id'].to_numpy()
+    signs = np.sign(pence)
+    buckets = amount_buckets(pence, tolerance)
+
+    order = np.lexsort((days, buckets, signs, suppliers))
+    same_block = ((suppliers[order][1:] == suppliers[order][:-1])
+                  & (signs[order][1:] == signs[order][:-1]))
+    new_block = np.concatenate([[True], ~same_block | (buckets[order][1:] != buckets[order][:-1])])
+    block = np.cumsum(new_block) - 1
+    block_bucket = buckets[order][new_block]
+    block_group = np.cumsum(np.concatenate([[True], ~same_block]))[new_block]
+
+    # One sorted key per row: block number, then day
+    day = days[order] - days.min()
+    span = int(day.max()) + 1
+    key = block * span + day
+
+    probe = np.flatnonzero(is_new[order])
+    rows, low, high = [], [], []
+    for offset in (-1, 0, 1):
+        target = block[probe] + offset
+        valid = (target >= 0) & (target < len(block_bucket))
+        found, target = probe[valid], target[valid]
+        valid = ((block_group[target] == block_group[block[found]])
+                 & (block_bucket[target] == block_bucket[block[found]] + offset))
+        found, target = found[valid], target[valid]
+        rows.append(found)
+        low.append(np.searchsorted(key, target * span + np.maximum(day[found] - window_days, 0), 'left'))
+        high.append(np.searchsorted(key, target * span + np.minimum(day[found] + window_days, span - 1), 'right'))
+    rows, low = np.concatenate(rows), np.concatenate(low)
+    counts = np.concatenate(high) - low
+
+    batches = np.searchsorted(np.cumsum(counts), np.arange(PAIR_BATCH, counts.sum(), PAIR_BATCH))
+    for batch in np.split(np.arange(len(rows)), batches):
+        batch_counts = counts[batch]
+        offsets = np.cumsum(batch_counts) - batch_counts
+        a = order[np.repeat(rows[batch], batch_counts)]
+        b = order[np.arange(batch_counts.sum()) - np.repeat(offsets - low[batch], batch_counts)]
+
+        # Pairs of two new rows are found from both ends; keep one
+        keep = (a != b) & (~is_new[b] | (ids[a] < ids[b]))
+        keep &= np.abs(pence[a] - pence[b]) <= tolerance * np.maximum(np.abs(pence[a]), np.abs(pence[b]))
+        a, b = a[keep], b[keep]
+
+        later = (days[a] > days[b]) | ((days[a] == days[b]) & (ids[a] > ids[b]))
+        yield np.where(later, a, b), np.where(later, b, a)
+
+def score_pairs(frame, later, earlier, window_days, tolerance, min_score):
+    """duplicate_invoices rows for the pairs scoring at least min_score
+
+    The text part is 1 for the same source reference or description. Rows
+    whose descriptions carry different numbers ('invoice 831' vs 'invoice
+    832') are usually different invoices, so that part is capped at 0.5;
+    descriptions are only compared character by character for the pairs
+    that could still reach min_score.
+    """
+    pence = frame['pence'].to_numpy()
+    days = frame['days'].to_numpy()
+    descriptions = frame['description'].to_numpy()
+    description_code = frame['description_code'].to_numpy()
+    number_code = frame['number_code'].to_numpy()
+    reference_code = frame['reference_code'].to_numpy()
+
+    gap = np.abs(pence[later] - pence[earlier])
+    largest = np.maximum(np.abs(pence[later]), np.abs(pence[earlier]))
+    if tolerance > 0:
+        amount_score = 1 - gap / (tolerance * largest)
+    else:
+        amount_score = np.ones(len(gap))
+    days_apart = days[later] - days[earlier]
+    date_score = 1 - days_apart / max(window_days, 1)
+    partial = SCORE_WEIGHTS['amount'] * amount_score + SCORE_WEIGHTS['date'] * date_score
+
+    # Drop the pairs that can't reach min_score whatever their descriptions
+    possible = partial + SCORE_WEIGHTS['text'] >= min_score
+    later, earlier = later[possible], earlier[possible]
+    gap, days_apart, partial = gap[possible], days_apart[possible], partial[possible]
+
+    same_reference = (reference_code[later] >= 0) & (reference_code[later] == reference_code[earlier])
+    same_description = description_code[later] == description_code[earlier]
+    text_score = np.where(same_reference | same_description, 1.0, 0.0)
+    # Two blank descriptions say nothing either way
+    text_score[~same_reference & same_description & (descriptions[later] == '')] = 0.5
+
+    cap = np.where(number_code[later] == number_code[earlier], 1.0, 0.5)
+    undecided = np.flatnonzero(~same_reference & ~same_description
+                               & (partial + SCORE_WEIGHTS['text'] * cap >= min_score))
+    for i in undecided:
+        text_score[i] = cap[i] * difflib.SequenceMatcher(
+            None, descriptions[later[i]], descriptions[earlier[i]]).ratio()
+
+    score = partial + SCORE_WEIGHTS['text'] * text_score
+    hits = np.flatnonzero(score >= min_score)
+    exact = (gap == 0) & (days_apart == 0) & (text_score == 1)
+
+    ids = frame['transaction_id'].to_numpy()
+    dates = frame['transaction_date'].to_numpy()
+    suppliers = frame['supplier_id'].to_numpy()
+    return [
+        (int(ids[later[i]]), dates[later[i]], int(ids[earlier[i]]), dates[earlier[i]],
+         int(suppliers[later[i]]), int(pence[later[i]]), int(pence[earlier[i]]),
+         int(days_apart[i]), round(float(score[i]), 3), 'exact' if exact[i] else 'near')
+        for i in hits
+    ]
+
+def _supplier_chunks(cursor, chunk_rows):
+    """Lists of supplier ids whose changed rows add up to about chunk_rows, with their date range"""
+    cursor.execute("""
+        SELECT supplier_id, COUNT(*), MIN(transaction_date), MAX(transaction_date)
+        FROM duplicate_pending
+        WHERE supplier_id IS NOT NULL
+        GROUP BY supplier_id
+        ORDER BY supplier_id
+    """)
+    chunk, rows, first, last = [], 0, None, None
+    for supplier_id, count, start, end in cursor.fetchall():
+        chunk.append(supplier_id)
+        rows += count
+        first = start if first is None else min(first, start)
+        last = end if last is None else max(last, end)
+        if rows >= chunk_rows:
+            yield chunk, first, last
+            chunk, rows, first, last = [], 0, None, None
+    if chunk:
+        yield chunk, first, last
+
+def _load_candidates(cursor, supplier_ids, first, last, window_days):
+    """Rows of the given suppliers within window_days of [first, last], flagged if changed"""
+    cursor.execute("""
+        SELECT
+            t.transaction_id,
+            t.transaction_date,
+            t.supplier_id,
+            (t.amount_gbp * 100)::bigint as pence,
+            t.transaction_date - DATE '2000-01-01' as days,
+            t.description,
+            NULLIF(TRIM(t.source_transaction), '') as source_transaction,
+            p.transaction_id IS NOT NULL as is_new
+        FROM ap_transactions t
+        LEFT JOIN duplicate_pending p
+            ON p.transaction_id = t.transaction_id AND p.transaction_date = t.transaction_date
+        WHERE t.supplier_id = ANY(%s)
+          AND t.transaction_date BETWEEN %s AND %s
+          AND t.amount_gbp <> 0
+    """, (supplier_ids, first - timedelta(days=window_days), last + timedelta(days=window_days)))
+    columns = [desc[0] for desc in cursor.description]
+    frame = pd.DataFrame(cursor.fetchall(), columns=columns)
+    frame['description'] = [normalize_description(text) for text in frame['description']]
+
+    # Integer codes so pairs compare descriptions, their numbers and references as ints
+    frame['description_code'] = pd.factorize(frame['description'])[0]
+    frame['number_code'] = pd.factorize(frame['description'].str.findall(r'\d+').str.join(' '))[0]
+    frame['reference_code'] = pd.factorize(frame['source_transaction'])[0]
+    return frame
+
+def detect_duplicates(conn, full=False, window_days=DUPLICATE_WINDOW_DAYS,
+                      tolerance=DUPLICATE_AMOUNT_TOLERANCE, min_score=DUPLICATE_MIN_SCORE):
+    """Score the rows changed since the last scan (every row if `full`) and store the pairs
+
+    Findings involving a changed row are replaced. Returns the number of
+    pairs recorded, or None if database/upgrade.sql hasn't been applied.
+    """
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT scanned_through FROM duplicate_scan")
+        row = cursor.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        print("  Duplicate detection skipped: apply database/upgrade.sql first")
+        return None
+    since = None if full or row is None else row[0]
+
+    changed_at = "COALESCE(updated_at, created_at)"
+    cursor.execute(f"""
+        CREATE TEMP TABLE duplicate_pending ON COMMIT DROP AS
+        SELECT transaction_id, transaction_date, supplier_id, {changed_at} as changed_at
+        FROM ap_transactions
+        {'' if since is None else f'WHERE {changed_at} > %s'}
+    """, None if since is None else (since,))
+    cursor.execute("SELECT COUNT(*), MAX(changed_at) FROM duplicate_pending")
+    pending, scanned_through = cursor.fetchone()
+    if not pending:
+        if since is None:
+            cursor.execute("TRUNCATE duplicate_invoices")
+        conn.commit()
+        cursor.close()
+        print("  Duplicate detection: no new or changed rows")
+        return 0
+
+    cursor.execute("CREATE INDEX ON duplicate_pending (transaction_id)")
+    cursor.execute("ANALYZE duplicate_pending")
+    if since is None:
+        cursor.execute("TRUNCATE duplicate_invoices")
+    else:
+        for column in ('transaction_id', 'duplicate_of'):
+            cursor.execute(f"""
+                DELETE FROM duplicate_invoices d
+                USING duplicate_pending p
+                WHERE d.{column} = p.transaction_id
+            """)
+
+    found = []
+    for supplier_ids, first, last in list(_supplier_chunks(cursor, SCAN_CHUNK_ROWS)):
+        frame = _load_candidates(cursor, supplier_ids, first, last, window_days)
+        if frame.empty:
+            continue
+        for later, earlier in candidate_pairs(frame, window_days, tolerance):
+            found += score_pairs(frame, later, earlier, window_days, tolerance, min_score)
+
+    execute_values(cursor, """
+        INSERT INTO duplicate_invoices (
+            transaction_id, transaction_date, duplicate_of, duplicate_of_date, supplier_id,
+            amount_gbp, duplicate_of_amount, days_apart, score, match_type
+        )
+        VALUES %s
+        ON CONFLICT (transaction_id, duplicate_of) DO UPDATE SET
+            score = EXCLUDED.score,
+            match_type = EXCLUDED.match_type,
+            detected_at = CURRENT_TIMESTAMP
+    """, found, template="(%s, %s, %s, %s, %s, %s / 100.0, %s / 100.0, %s, %s, %s)", page_size=5000)
+
+    duration_ms = int((time.perf_counter() - started) * 1000)
+    cursor.execute("""
+        UPDATE duplicate_scan
+        SET scanned_through = GREATEST(scanned_through, %s),
+            scanned_at = CURRENT_TIMESTAMP,
+            rows_scanned = %s,
+            duration_ms = %s
+    """, (scanned_through, pending, duration_ms))
+    conn.commit()
+    cursor.close()
+
+    exact = sum(1 for row in found if row[-1] == 'exact')
+    print(f"  ✓ Duplicate detection: {pending:,} rows checked, {len(found):,} likely duplicates "
+          f"({exact:,} exact) in {duration_ms:,} ms")
+    return len(found)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find likely duplicate AP invoices")
+    parser.add_argument('--full', action='store_true',
+                        help="Forget earlier findings and rescan every row")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    detect_duplicates(conn, full=args.full)
+    conn.close()
@@ -0,0 +1,211 @@
+"""
+Streaming exports for ELFT Invoice Platform API
+Rows come from a server-side (named) cursor EXPORT_FETCH_ROWS at a time and
+are written straight into the HTTP response as CSV or XLSX, so a worker's
+memory stays flat however many rows an export has. XLSX files are zipped as
+they are written (zip data descriptors need no seeking back).
+"""
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from config import EXPORT_FETCH_ROWS
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Rows in an Excel sheet (header, data and a truncation note)
+XLSX_SHEET_ROWS = 1048576
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+def iter_batches(conn, query, params=None, fetch_rows=EXPORT_FETCH_ROWS):
+    """Yield the column names, then lists of at most fetch_rows rows, from a named cursor"""
+    with conn.cursor(name='export') as cursor:
+        cursor.itersize = fetch_rows
+        cursor.execute(query, params)
+        rows = cursor.fetchmany(fetch_rows)
+        # A named cursor only describes its columns after the first fetch
+        yield [desc[0] for desc in cursor.description]
+        while rows:
+            yield rows
+            rows = cursor.fetchmany(fetch_rows)
+
+def csv_chunks(batches):
+    """CSV bytes, one chunk per batch (with a BOM so Excel reads £ correctly)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(next(batches))
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only: nothing matched
+        yield buffer.getvalue().encode('utf-8')
+
+class _Spool:
+    """Write-only file that hands back what was written since the last drain()
+
+    Having no seek()/tell(), zipfile streams to it with data descriptors.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+# Characters XML 1.0 doesn't allow (Excel refuses the file)
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '<Relationship Id="rId2" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        '</Relationships>'
+    ),
+    # Cell styles: 0 general, 1 date, 2 date and time, 3 bold (header)
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="4">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+def _column_letters(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _xlsx_cell(ref, value, style=None):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        serial = (value.replace(tzinfo=None) - EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}" s="2"><v>{serial}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="1"><v>{(value - EXCEL_EPOCH.date()).days}</v></c>'
+    text = escape(_XML_ILLEGAL.sub('', str(value)))
+    style = f' s="{style}"' if style else ''
+    return f'<c r="{ref}" t="inlineStr"{style}><is><t xml:space="preserve">{text}</t></is></c>'
+
+def xlsx_chunks(batches, sheet_name='Export'):
+    """XLSX bytes, one chunk per batch; stops at Excel's row limit with a note in the last row"""
+    spool = _Spool()
+    archive = zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED)
+    for name, content in _XLSX_PARTS.items():
+        archive.writestr(name, content)
+    archive.writestr('xl/workbook.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ))
+    yield spool.drain()
+
+    batches = iter(batches)
+    columns = next(batches)
+    letters = [_column_letters(i) for i in range(len(columns))]
+
+    with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+        sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                    b'<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                    b'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews><sheetData>')
+        header = ''.join(_xlsx_cell(f'{letter}1', name, 3) for letter, name in zip(letters, columns))
+        sheet.write(f'<row r="1">{header}</row>'.encode('utf-8'))
+
+        row_number = 1
+        truncated = False
+        for batch in batches:
+            parts = []
+            for row in batch:
+                if row_number == XLSX_SHEET_ROWS - 1:
+                    # Keep the last row of the sheet for the note
+                    truncated = True
+                    break
+                row_number += 1
+                cells = ''.join(_xlsx_cell(f'{letter}{row_number}', value)
+                                for letter, value in zip(letters, row))
+                parts.append(f'<row r="{row_number}">{cells}</row>')
+            sheet.write(''.join(parts).encode('utf-8'))
+            yield spool.drain()
+            if truncated:
+                note = _xlsx_cell(f'A{XLSX_SHEET_ROWS}', f'Truncated at {row_number - 1:,} rows '
+                                  '(the Excel limit); export as CSV for every row')
+                sheet.write(f'<row r="{XLSX_SHEET_ROWS}">{note}</row>'.encode('utf-8'))
+                break
+
+        sheet.write(b'</sheetData></worksheet>')
+    archive.close()
+    yield spool.drain()
+
+def stream_export(conn, query, params, fmt, sheet_name='Export'):
+    """Response body chunks for `query` in `fmt` ('csv' or 'xlsx')"""
+    batches = iter_batches(conn, query, params)
+    if fmt == 'xlsx':
+        return xlsx_chunks(batches, sheet_name)
+    return csv_chunks(batches)
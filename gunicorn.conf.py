@@ -0,0 +1,56 @@
+"""
+Production server settings for ELFT Invoice Platform
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master and forked into WEB_WORKERS
+processes. With the default gevent worker class each request runs on a
+greenlet, and waits on the model API or Postgres yield to the other
+requests, so one worker streams up to WEB_WORKER_CONNECTIONS AI chats at
+once. Every worker warms its own connection pool and caches before it takes
+traffic. On SIGTERM workers stop accepting connections and get
+WEB_GRACEFUL_TIMEOUT seconds to finish in-flight requests, so AI chat
+streams survive a deploy.
+"""
+from config import (FLASK_HOST, FLASK_PORT, WEB_WORKERS, WEB_WORKER_CLASS, WEB_WORKER_CONNECTIONS,
+                    WEB_THREADS, WEB_GRACEFUL_TIMEOUT)
+
+if WEB_WORKER_CLASS == 'gevent':
+    # Patch before the app is preloaded, so its sockets, locks and pool threads
+    # (chart queries) are cooperative, and psycopg2 waits yield to other greenlets
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+bind = f"{FLASK_HOST}:{FLASK_PORT}"
+workers = WEB_WORKERS
+worker_class = WEB_WORKER_CLASS
+# gevent: concurrent requests per worker; gthread: threads per worker, and each
+# AI chat stream holds its thread until the answer is done
+worker_connections = WEB_WORKER_CONNECTIONS
+threads = WEB_THREADS
+preload_app = True
+
+# Workers heartbeat from their main loop, so long streams don't trip this
+timeout = 60
+graceful_timeout = WEB_GRACEFUL_TIMEOUT
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+def post_worker_init(worker):
+    """Warm up before the worker's accept loop starts"""
+    from app import warm_up
+
+    if warm_up():
+        worker.log.info("Worker %s warmed up", worker.pid)
+    else:
+        worker.log.warning("Worker %s started without a warm cache", worker.pid)
+
+def worker_exit(server, worker):
+    """Close this worker's pooled connections once its requests are done"""
+    from db import get_pool
+
+    get_pool().closeall()
@@ -1,11 +1,20 @@
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_batch
-from datetime import datetime
+from datetime import date, datetime
+import argparse
+import io
+import numbers
+import re
 import sys
 import os
-import numpy as np
-from config import DB_CONFIG
+import time
+from contextlib import contextmanager
+from openpyxl import load_workbook
+from config import DB_CONFIG, IMPORT_CHUNK_ROWS, EXCLUDED_MONTHS
+from suppliers import sync_suppliers
+from partitions import ensure_ap_partitions
+from catalog import store_catalog
+from duplicates import detect_duplicates
 
 def get_db_connection():
     return psycopg2.connect(**DB_CONFIG)
@@ -14,65 +23,355 @@ def clean_column_name(col):
     """Convert Excel column name to database column name"""
     return col.strip().lower().replace(' ', '_').replace('(', '').replace(')', '').replace('.', '_').replace('/', '_')
 
-def import_ap_transactions():
-    print("\n" + "="*60)
-    print("IMPORTING AP TRANSACTIONS")
-    print("="*60)
-    
-    # Updated path to match user's actual workspace
-    file_path = os.path.join(os.getcwd(), "mental_health_trust_data_categorized_FINAL.xlsx")
-    
-    if not os.path.exists(file_path):
-        print(f"File not found: {file_path}")
-        return
+# Materialized views fed by each source table (see database/materialized_views.sql)
+AP_DEPENDENT_VIEWS = [
+    'mv_monthly_dashboard',
+    'mv_category_spend',
+    'mv_contract_vs_invoiced',
+    'mv_suppliers_without_contracts',
+]
+CONTRACT_DEPENDENT_VIEWS = [
+    'mv_contract_vs_invoiced',
+    'mv_suppliers_without_contracts',
+]
 
-    # Read Excel
-    print(f"Reading file: {file_path}")
-    df = pd.read_excel(file_path)
-    print(f"✓ Loaded {len(df):,} rows")
-    
-    # Clean column names
+def refresh_materialized_views(conn, views):
+    """Concurrently refresh the given materialized views and log their freshness"""
+    cursor = conn.cursor()
+    print(f"\nRefreshing {len(views)} materialized views...")
+    for view in views:
+        started = time.perf_counter()
+        cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        cursor.execute("""
+            INSERT INTO analytics_refresh_log (view_name, refreshed_at, duration_ms)
+            VALUES (%s, CURRENT_TIMESTAMP, %s)
+            ON CONFLICT (view_name) DO UPDATE SET
+                refreshed_at = EXCLUDED.refreshed_at,
+                duration_ms = EXCLUDED.duration_ms
+        """, (view, duration_ms))
+        conn.commit()
+        print(f"  ✓ {view} ({duration_ms:,} ms)")
+    cursor.close()
+
+def bump_data_version(conn):
+    """Move the data_version stamp so API response caches are invalidated"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE data_version
+        SET version = version + 1, changed_at = CURRENT_TIMESTAMP
+        RETURNING version
+    """)
+    version = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    print(f"  ✓ Data version is now {version}")
+
+class CopyLoader:
+    """Stream DataFrame batches into `table` with COPY FROM STDIN
+
+    Each chunk of at most `chunk_rows` rows is rendered to CSV by pandas'
+    C writer and sent as a single COPY, so only one chunk is ever held as
+    text. NaN/NaT/None become empty unquoted fields, which COPY reads as NULL.
+    """
+
+    def __init__(self, cursor, table, columns, chunk_rows=IMPORT_CHUNK_ROWS):
+        self.cursor = cursor
+        self.table = table
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed else 0
+
+    def write(self, df):
+        for start in range(0, len(df), self.chunk_rows):
+            chunk = df.iloc[start:start + self.chunk_rows]
+            buffer = io.StringIO()
+            chunk.to_csv(
+                buffer,
+                columns=self.columns,
+                header=False,
+                index=False,
+                na_rep='',
+                date_format='%Y-%m-%d %H:%M:%S',
+            )
+            buffer.seek(0)
+            self.cursor.copy_expert(self.copy_sql, buffer)
+            self.rows += len(chunk)
+            print(f"  {self.rows:,} rows ({self.rate():,.0f} rows/sec)")
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"✓ Copied {self.rows:,} rows into {self.table} in {elapsed:.1f}s "
+              f"({self.rate():,.0f} rows/sec)")
+        return self.rows
+
+def copy_dataframe(cursor, table, df, columns, chunk_rows=IMPORT_CHUNK_ROWS):
+    """COPY a whole DataFrame into `table`; returns the number of rows loaded"""
+    loader = CopyLoader(cursor, table, columns, chunk_rows)
+    loader.write(df)
+    return loader.finish()
+
+def create_staging_table(cursor, table, columns):
+    """Create an empty session-local table shaped like `columns` of `table`"""
+    stage = f"stage_{table}"
+    cursor.execute(f"DROP TABLE IF EXISTS {stage}")
+    cursor.execute(f"CREATE TEMP TABLE {stage} AS SELECT {', '.join(columns)} FROM {table} WITH NO DATA")
+    return stage
+
+def _row_hash_sql(alias, columns):
+    """Fingerprint of every business column (ROW text keeps NULL distinct from '')"""
+    return f"md5(ROW({', '.join(f'{alias}.{col}' for col in columns)})::text)"
+
+def _row_key_sql(alias, key_columns, hash_column='row_hash'):
+    """Fingerprint of the business key plus its ordinal among identical keys
+
+    Legitimately repeated lines (same supplier, date, amount...) get keys
+    #1, #2, ... so they survive re-imports instead of collapsing into one.
+    """
+    key = ', '.join(f'{alias}.{col}' for col in key_columns)
+    return (f"md5(ROW({key}, ROW_NUMBER() OVER ("
+            f"PARTITION BY {key} ORDER BY {alias}.{hash_column}))::text)")
+
+def backfill_row_keys(cursor, table, id_column, columns, key_columns):
+    """Fingerprint rows loaded before incremental imports existed"""
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE row_key IS NULL)")
+    if not cursor.fetchone()[0]:
+        return 0
+
+    cursor.execute(f"""
+        WITH hashed AS (
+            SELECT t.*, {_row_hash_sql('t', columns)} as new_hash
+            FROM {table} t
+            WHERE t.row_key IS NULL
+        ),
+        keyed AS (
+            SELECT h.{id_column}, h.new_hash, {_row_key_sql('h', key_columns, 'new_hash')} as new_key
+            FROM hashed h
+        )
+        UPDATE {table} t
+        SET row_key = k.new_key, row_hash = k.new_hash
+        FROM keyed k
+        WHERE t.{id_column} = k.{id_column}
+    """)
+    print(f"  Fingerprinted {cursor.rowcount:,} existing {table} rows")
+    return cursor.rowcount
+
+def merge_staging(cursor, table, stage, columns, key_columns):
+    """Set-based merge of `stage` into `table` in a single statement
+
+    Rows whose key is new are inserted, rows whose key exists but whose
+    fingerprint differs are updated in place, everything else is left
+    alone. Changed rows lose their supplier_id so sync_suppliers re-resolves
+    them. Returns (staged, inserted, updated).
+    """
+    column_list = ', '.join(columns)
+    assignments = ', '.join(f"{col} = k.{col}" for col in columns)
+    cursor.execute(f"""
+        WITH hashed AS (
+            SELECT s.*, {_row_hash_sql('s', columns)} as row_hash
+            FROM {stage} s
+        ),
+        keyed AS (
+            SELECT h.*, {_row_key_sql('h', key_columns)} as row_key
+            FROM hashed h
+        ),
+        updated AS (
+            UPDATE {table} t
+            SET {assignments}, row_hash = k.row_hash, supplier_id = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            FROM keyed k
+            WHERE t.row_key = k.row_key
+              AND t.row_hash IS DISTINCT FROM k.row_hash
+            RETURNING 1
+        ),
+        inserted AS (
+            INSERT INTO {table} ({column_list}, row_key, row_hash)
+            SELECT {column_list}, k.row_key, k.row_hash
+            FROM keyed k
+            WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.row_key = k.row_key)
+            RETURNING 1
+        )
+        SELECT
+            (SELECT COUNT(*) FROM keyed),
+            (SELECT COUNT(*) FROM inserted),
+            (SELECT COUNT(*) FROM updated)
+    """)
+    staged, inserted, updated = cursor.fetchone()
+    print(f"✓ Merged into {table}: {inserted:,} new, {updated:,} changed, "
+          f"{staged - inserted - updated:,} unchanged")
+    return staged, inserted, updated
+
+IMPORT_MODES = ('incremental', 'reload')
+
+def apply_staged_rows(cursor, table, id_column, stage, columns, key_columns, mode='incremental'):
+    """Move staged rows into `table`; returns the number of rows inserted or changed
+
+    'incremental' merges against what is already loaded; 'reload' empties
+    the table first (the old truncate-and-reload refresh).
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode: {mode}")
+
+    if mode == 'reload':
+        print(f"  Truncating {table} for full reload")
+        cursor.execute(f"TRUNCATE {table}")
+    else:
+        backfill_row_keys(cursor, table, id_column, columns, key_columns)
+
+    _, inserted, updated = merge_staging(cursor, table, stage, columns, key_columns)
+    return inserted + updated
+
+def _header_names(values):
+    """Name header cells the way pandas.read_excel does ('Unnamed: n', 'x.1' for repeats)"""
+    names = []
+    seen = {}
+    for i, val in enumerate(values):
+        name = f"Unnamed: {i}" if val is None else str(val)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def iter_sheet_batches(file_path, sheet_name=None, is_header=None,
+                       header_search_rows=50, batch_rows=IMPORT_CHUNK_ROWS):
+    """Yield DataFrames of at most `batch_rows` rows from one worksheet
+
+    Rows are pulled lazily through openpyxl's read-only mode, so peak memory
+    depends on `batch_rows`, not on the size of the workbook. The header is
+    the first non-blank row, or the first row within `header_search_rows`
+    for which `is_header(values)` is true, detected in the same pass.
+    Fully blank rows are skipped.
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+
+        header = None
+        for index, values in enumerate(rows):
+            if index >= header_search_rows:
+                break
+            if all(val is None for val in values):
+                continue
+            if is_header is None or is_header(values):
+                header = _header_names(values)
+                print(f"  Found header at row {index}")
+                break
+
+        if header is None:
+            raise ValueError(f"Could not find header row in {sheet.title}")
+
+        width = len(header)
+        batch = []
+        for values in rows:
+            if all(val is None for val in values):
+                continue
+            batch.append(values[:width])
+            if len(batch) >= batch_rows:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+# Cleaned Excel column name -> ap_transactions column
+AP_COLUMN_MAPPING = {
+    'subjective_name': 'subjective_name',
+    'amount_£': 'amount_gbp',
+    'month': 'month',
+    'date': 'transaction_date',
+    'party': 'party',
+    'source_transaction': 'source_transaction',
+    'description': 'description',
+    'source': 'source',
+    'unit_price': 'unit_price',
+    'quantity': 'quantity',
+    'uom': 'uom',
+    'financial_year': 'financial_year',
+    'period': 'period',
+    'month_1': 'month_1',
+    'ward': 'ward',
+    'directorate': 'directorate',
+    'department': 'department',
+    'service': 'service',
+    'cost_centre_description': 'cost_centre_description',
+    'category_1': 'category_1',
+    'category_2': 'category_2',
+    'account_code_name_level_5': 'account_code_name_level_5',
+    'account_code_name_level_6': 'account_code_name_level_6',
+    'category': 'category',
+    'subjective_code_description': 'subjective_code_description',
+    'analysis_one_code_description': 'analysis_one_code_description',
+    'spend_category': 'spend_category',
+    'final_category': 'final_category',
+    'sub_category': 'sub_category',
+    'site_type': 'site_type',
+    'high': 'high',
+    'coding': 'coding',
+    'non_po_flag': 'non_po_flag'
+}
+
+# period_month is derived by prepare_ap_batch, not read from the extract
+AP_COLUMNS = list(AP_COLUMN_MAPPING.values()) + ['period_month']
+
+# Columns identifying a transaction; the rest (categorisation etc.) may change between extracts
+AP_KEY_COLUMNS = [
+    'source_transaction',
+    'party',
+    'transaction_date',
+    'month',
+    'amount_gbp',
+    'description',
+    'subjective_name',
+    'cost_centre_description',
+]
+
+# Month label formats seen in the extract ('2024-08', 'Aug-24', 'APR-24', 'August 2024')
+MONTH_FORMATS = ['%Y-%m', '%b-%y', '%B %Y', '%b %Y', '%B-%y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S']
+
+def parse_month_labels(labels):
+    """First-of-month timestamps for a Series of mixed-format month labels (NaT if unparseable)"""
+    text = labels.astype('string').str.strip()
+    parsed = pd.Series(pd.NaT, index=labels.index, dtype='datetime64[ns]')
+    for fmt in MONTH_FORMATS:
+        missing = parsed.isna() & text.notna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(text[missing], format=fmt, errors='coerce')
+    return parsed.dt.to_period('M').dt.to_timestamp()
+
+def flag_excluded_periods(cursor):
+    """Set ap_transactions.is_excluded from EXCLUDED_MONTHS; returns rows whose flag changed"""
+    labels = pd.Series([label.strip() for label in EXCLUDED_MONTHS if label.strip()], dtype='object')
+    periods = parse_month_labels(labels)
+    for label in labels[periods.isna()]:
+        print(f"  ⚠ Ignoring unrecognised EXCLUDED_MONTHS entry: {label}")
+    excluded = sorted(set(periods.dropna().dt.date))
+
+    cursor.execute("""
+        UPDATE ap_transactions
+        SET is_excluded = COALESCE(period_month = ANY(%(excluded)s::date[]), FALSE)
+        WHERE is_excluded <> COALESCE(period_month = ANY(%(excluded)s::date[]), FALSE)
+    """, {'excluded': excluded})
+    print(f"  Excluded periods: {', '.join(p.strftime('%b-%y') for p in excluded) or 'none'} "
+          f"({cursor.rowcount:,} rows re-flagged)")
+    return cursor.rowcount
+
+def prepare_ap_batch(df):
+    """Rename and type-convert one batch of AP extract rows"""
+    # Clean column names and map to database columns
     df.columns = [clean_column_name(col) for col in df.columns]
-    
-    # Map to database columns
-    column_mapping = {
-        'subjective_name': 'subjective_name',
-        'amount_£': 'amount_gbp',
-        'month': 'month',
-        'date': 'transaction_date',
-        'party': 'party',
-        'source_transaction': 'source_transaction',
-        'description': 'description',
-        'source': 'source',
-        'unit_price': 'unit_price',
-        'quantity': 'quantity',
-        'uom': 'uom',
-        'financial_year': 'financial_year',
-        'period': 'period',
-        'month_1': 'month_1',
-        'ward': 'ward',
-        'directorate': 'directorate',
-        'department': 'department',
-        'service': 'service',
-        'cost_centre_description': 'cost_centre_description',
-        'category_1': 'category_1',
-        'category_2': 'category_2',
-        'account_code_name_level_5': 'account_code_name_level_5',
-        'account_code_name_level_6': 'account_code_name_level_6',
-        'category': 'category',
-        'subjective_code_description': 'subjective_code_description',
-        'analysis_one_code_description': 'analysis_one_code_description',
-        'spend_category': 'spend_category',
-        'final_category': 'final_category',
-        'sub_category': 'sub_category',
-        'site_type': 'site_type',
-        'high': 'high',
-        'coding': 'coding',
-        'non_po_flag': 'non_po_flag'
-    }
-    
-    # Rename columns
-    df.rename(columns=column_mapping, inplace=True)
+    df = df.rename(columns=AP_COLUMN_MAPPING)
     
     # Convert dates
     if 'transaction_date' in df.columns:
@@ -80,34 +379,99 @@ def import_ap_transactions():
     if 'period' in df.columns:
         df['period'] = pd.to_datetime(df['period'], errors='coerce')
     
-    # Handle NaN
-    df = df.where(pd.notnull(df), None)
-    
-    # Get columns that exist in both dataframe and our mapping
-    columns = [col for col in df.columns if col in column_mapping.values()]
+    # Canonical first-of-month period, falling back to the transaction date
+    if 'month' in df.columns:
+        period_month = parse_month_labels(df['month'])
+    else:
+        period_month = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+    if 'transaction_date' in df.columns:
+        period_month = period_month.fillna(df['transaction_date'].dt.to_period('M').dt.to_timestamp())
+    df['period_month'] = period_month
     
-    # Prepare insert
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # transaction_date is the partition key: undated lines take the start of
+    # their month, lines with neither date nor month can't be placed
+    if 'transaction_date' in df.columns:
+        df['transaction_date'] = df['transaction_date'].fillna(period_month)
+    else:
+        df['transaction_date'] = period_month
+    undated = df['transaction_date'].isna()
+    if undated.any():
+        print(f"  ⚠ Skipping {undated.sum():,} rows with no date or month")
+        df = df[~undated]
     
-    insert_sql = f"""
-        INSERT INTO ap_transactions ({', '.join(columns)})
-        VALUES ({', '.join(['%s'] * len(columns))})
+    return df
+
+class StageTimer:
+    """Wall-clock seconds per named import stage; a stage can be entered many times"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - started
+
+    def timed(self, name, iterable):
+        """Iterate `iterable`, counting the time spent producing each item towards `name`"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def report(self):
+        total = sum(self.seconds.values())
+        print(f"\nStage timings ({total:.2f}s):")
+        for name, seconds in self.seconds.items():
+            print(f"  {name:<10} {seconds:>8.2f}s")
+
+def stage_ap_workbook(cursor, file_path, stage, timer=None):
+    """Stream one AP extract into `stage` batch by batch; returns the rows staged"""
+    timer = timer or StageTimer()
+    loader = None
+    for batch in timer.timed('read', iter_sheet_batches(file_path)):
+        with timer.stage('prepare'):
+            df = prepare_ap_batch(batch)
+        if loader is None:
+            # Columns that exist in both the extract and our mapping
+            columns = [col for col in df.columns if col in AP_COLUMNS]
+            loader = CopyLoader(cursor, stage, columns)
+        with timer.stage('copy'):
+            loader.write(df)
+    return loader.finish() if loader is not None else 0
+
+def merge_ap_stage(conn, stage, mode='incremental', timer=None):
+    """Merge staged AP rows into ap_transactions and refresh what depends on them
+
+    Returns the number of rows that changed.
     """
+    timer = timer or StageTimer()
+    cursor = conn.cursor()
+
+    # New financial years get their partition in a short transaction of their own
+    if ensure_ap_partitions(cursor, stage):
+        conn.commit()
     
-    # Prepare data
-    data = [tuple(row[col] for col in columns) for _, row in df.iterrows()]
-    
-    # Insert in batches
-    print(f"Inserting {len(data):,} transactions...")
-    execute_batch(cursor, insert_sql, data, page_size=1000)
-    conn.commit()
+    # One set-based merge into ap_transactions
+    with timer.stage('merge'):
+        changed = apply_staged_rows(cursor, 'ap_transactions', 'transaction_id', stage,
+                                    AP_COLUMNS, AP_KEY_COLUMNS, mode)
+        changed += flag_excluded_periods(cursor)
+    with timer.stage('suppliers'):
+        changed += sync_suppliers(cursor)
+        conn.commit()
     
     # Statistics
     cursor.execute("""
         SELECT 
             COUNT(*) as transactions,
-            COUNT(DISTINCT party) as suppliers,
+            COUNT(DISTINCT supplier_id) as suppliers,
             SUM(amount_gbp) as total_spend,
             SUM(CASE WHEN non_po_flag = 'Y' THEN amount_gbp ELSE 0 END) as non_po_spend
         FROM ap_transactions
@@ -124,9 +488,166 @@ def import_ap_transactions():
         print(f"  Non-PO Spend: £{stats[3]:,.2f}")
     
     cursor.close()
+    if changed:
+        # A reload gives every row a new id, so earlier findings are dropped
+        with timer.stage('duplicates'):
+            detect_duplicates(conn, full=(mode == 'reload'))
+        with timer.stage('refresh'):
+            refresh_materialized_views(conn, AP_DEPENDENT_VIEWS)
+        with timer.stage('catalog'):
+            store_catalog(conn)
+        bump_data_version(conn)
+    return changed
+
+def import_ap_transactions(mode='incremental'):
+    print("\n" + "="*60)
+    print("IMPORTING AP TRANSACTIONS")
+    print("="*60)
+    
+    # Updated path to match user's actual workspace
+    file_path = os.path.join(os.getcwd(), "mental_health_trust_data_categorized_FINAL.xlsx")
+    
+    if not os.path.exists(file_path):
+        print(f"File not found: {file_path}")
+        return
+
+    timer = StageTimer()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    stage = create_staging_table(cursor, 'ap_transactions', AP_COLUMNS)
+    
+    print(f"Reading file: {file_path}")
+    if not stage_ap_workbook(cursor, file_path, stage, timer):
+        print("✗ No rows found")
+        conn.close()
+        return
+    cursor.close()
+
+    merge_ap_stage(conn, stage, mode, timer)
     conn.close()
+    timer.report()
+
+# contracts columns populated from the register
+CONTRACT_COLUMNS = [
+    'supplier',
+    'start_date',
+    'end_date',
+    'budget_2425',
+    'budget_2526',
+    'service_rag',
+    'subcontract_reference',
+    'tier',
+    'contract_name',
+    'documents_rag',
+    'overdue',
+    'category',
+    'estimated_total_contract_value',
+    'elft_contract_lead',
+]
+
+CONTRACT_KEY_COLUMNS = ['subcontract_reference', 'supplier', 'contract_name']
+
+# contracts column <- pattern for its register header, matched against the
+# header lower-cased with punctuation turned into spaces ('24/25 Budget' ->
+# '24 25 budget'). The left-most matching header wins, so columns can move.
+CONTRACT_HEADER_RULES = {
+    'supplier': r'^(supplier|supplier name|provider)$',
+    'start_date': r'^(contract )?(start|commencement) date$',
+    'end_date': r'^(contract )?(end|expiry) date$',
+    'budget_2425': r'^((20)?24 (20)?25 budget|budget (20)?24 (20)?25)$',
+    'budget_2526': r'^((20)?25 (20)?26 budget|budget (20)?25 (20)?26)$',
+    'service_rag': r'^service rag$',
+    'subcontract_reference': r'^sub ?contract ref(erence)?$',
+    'tier': r'^tier$',
+    'contract_name': r'^contract (name|title)$',
+    'documents_rag': r'^documents? rag$',
+    'overdue': r'^overdue$',
+    'category': r'^category$',
+    'estimated_total_contract_value': r'^estimated total contract value\b',
+    'elft_contract_lead': r'^(elft )?contract lead$',
+}
+
+CONTRACT_DATE_COLUMNS = ['start_date', 'end_date']
+CONTRACT_CURRENCY_COLUMNS = ['estimated_total_contract_value', 'budget_2425', 'budget_2526']
+
+# Day-first text formats seen in the register (date cells and ISO text are read directly)
+REGISTER_DATE_FORMATS = ['%d/%m/%Y', '%d/%m/%y', '%d-%m-%Y', '%d.%m.%Y',
+                         '%d %b %Y', '%d %B %Y', '%d-%b-%Y', '%d-%b-%y']
+# Day 0 of Excel's serial date numbers, and the last valid serial (31/12/9999)
+EXCEL_EPOCH = '1899-12-30'
+EXCEL_MAX_SERIAL = 2958465
 
-def import_contracts():
+def _normalize_header(name):
+    return re.sub(r'[^a-z0-9]+', ' ', str(name).lower()).strip()
+
+def match_contract_headers(names):
+    """{register header: contracts column} for the headers matching CONTRACT_HEADER_RULES"""
+    normalized = [(name, _normalize_header(name)) for name in names if name is not None]
+    mapping = {}
+    for column, pattern in CONTRACT_HEADER_RULES.items():
+        for name, text in normalized:
+            if name not in mapping and re.search(pattern, text):
+                mapping[name] = column
+                break
+    return mapping
+
+def _is_contract_header(values):
+    columns = set(match_contract_headers(values).values())
+    return 'supplier' in columns and len(columns) > 1
+
+def parse_register_dates(values):
+    """Timestamps for a column of date cells, Excel serial numbers and day-first text (NaT if unparseable)"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        # Every cell in the batch was a date cell; pandas has typed the column already
+        return values
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+
+    is_date = values.map(lambda value: isinstance(value, (datetime, date)))
+    if is_date.any():
+        parsed[is_date] = pd.to_datetime(values[is_date])
+
+    is_number = values.map(lambda value: isinstance(value, numbers.Number) and not isinstance(value, bool))
+    serials = pd.to_numeric(values[is_number], errors='coerce')
+    serials = serials[serials.between(1, EXCEL_MAX_SERIAL)]
+    if len(serials):
+        parsed[serials.index] = pd.to_datetime(serials, unit='D', origin=EXCEL_EPOCH)
+
+    text = values[~is_date & ~is_number & values.notna()].astype('string').str.strip()
+    for fmt in ['ISO8601'] + REGISTER_DATE_FORMATS:
+        if text.empty:
+            break
+        found = pd.to_datetime(text, format=fmt, errors='coerce').dropna()
+        parsed[found.index] = found
+        text = text.drop(found.index)
+    return parsed
+
+def parse_currency(values):
+    """Numbers for a column of amounts: numeric cells as-is, text like '£1,200', '(500)' or '1 000.50'"""
+    amounts = pd.to_numeric(values, errors='coerce')
+    text = values[amounts.isna() & values.notna()].astype(str)
+    if len(text):
+        # One pass strips currency signs, separators and brackets; (x) is negative
+        cleaned = pd.to_numeric(text.str.replace(r'[£$€,\s()]', '', regex=True), errors='coerce')
+        amounts[text.index] = cleaned.where(~text.str.contains('(', regex=False), -cleaned)
+    return amounts
+
+def map_contract_batch(df, column_map):
+    """Pick the register columns named in column_map and parse them into contracts columns"""
+    df = df[list(column_map)].rename(columns=column_map)
+
+    for col in df.columns:
+        if col in CONTRACT_DATE_COLUMNS:
+            df[col] = parse_register_dates(df[col])
+        elif col in CONTRACT_CURRENCY_COLUMNS:
+            df[col] = parse_currency(df[col])
+        else:
+            text = df[col].astype('string').str.strip()
+            df[col] = text.mask(text == '')
+
+    # Filter valid rows
+    return df[df['supplier'].notna()]
+
+def import_contracts(mode='incremental'):
     print("\n" + "="*60)
     print("IMPORTING CONTRACTS")
     print("="*60)
@@ -138,132 +659,46 @@ def import_contracts():
         print(f"File not found: {file_path}")
         return
 
-    # Read Sheet1 directly without header first to find the correct header row
-    print(f"\nProcessing: Sheet1")
-
-    # Read first 50 rows to find header
-    df_header_search = pd.read_excel(file_path, sheet_name='Sheet1', header=None, nrows=50)
+    timer = StageTimer()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    stage = create_staging_table(cursor, 'contracts', CONTRACT_COLUMNS)
 
-    header_row = None
-    for i in range(len(df_header_search)):
-        row_values = [str(val).lower() for val in df_header_search.iloc[i]]
-        row_str = ' '.join(row_values)
-        if 'supplier' in row_str and ('contract' in row_str or 'budget' in row_str):
-            header_row = i
-            print(f"  Found header at row {header_row}")
-            break
+    # Single pass over Sheet1: find the header row, then stream the rows below it
+    print(f"\nProcessing: Sheet1")
+    batches = iter_sheet_batches(file_path, sheet_name='Sheet1', is_header=_is_contract_header)
 
-    if header_row is None:
-        print("✗ Could not find header row in Sheet1")
+    loader = None
+    try:
+        for batch in timer.timed('read', batches):
+            if loader is None:
+                column_map = match_contract_headers(batch.columns)
+                print(f"  Mapped columns: " + ', '.join(f"{name} -> {col}" for name, col in column_map.items()))
+                missing = [col for col in CONTRACT_COLUMNS if col not in column_map.values()]
+                if missing:
+                    print(f"  ⚠ No register column for: {', '.join(missing)}")
+                loader = CopyLoader(cursor, stage, list(column_map.values()))
+            with timer.stage('parse'):
+                df = map_contract_batch(batch, column_map)
+            with timer.stage('copy'):
+                loader.write(df)
+    except ValueError as e:
+        print(f"✗ {e}")
+        conn.close()
         return
 
-    # Now read the full sheet with the correct header
-    df = pd.read_excel(file_path, sheet_name='Sheet1', header=header_row)
-    print(f"  Loaded {len(df)} rows from Sheet1")
-    
-    # Print original column names for debugging
-    print(f"\n  Original columns (first 20): {list(df.columns)[:20]}")
-    print(f"  Total columns: {len(df.columns)}")
-
-    # Read specific columns by position (0-indexed)
-    # Column E (index 4) = Supplier
-    # Column G (index 6) = Start Date
-    # Column H (index 7) = End Date
-    # Column AR (index 43) = 24/25 Budget
-    # Column AS (index 44) = 25/26 Budget
-
-    # Create new dataframe with specific columns
-    df_mapped = pd.DataFrame()
-
-    if len(df.columns) > 4:
-        df_mapped['supplier'] = df.iloc[:, 4]  # Column E
-    if len(df.columns) > 6:
-        df_mapped['start_date'] = df.iloc[:, 6]  # Column G
-    if len(df.columns) > 7:
-        df_mapped['end_date'] = df.iloc[:, 7]  # Column H
-    if len(df.columns) > 43:
-        df_mapped['budget_2425'] = df.iloc[:, 43]  # Column AR
-    if len(df.columns) > 44:
-        df_mapped['budget_2526'] = df.iloc[:, 44]  # Column AS
-
-    # Try to find other useful columns by name
-    df.columns = [clean_column_name(col) for col in df.columns]
+    if loader is None:
+        print("✗ No contract rows found in Sheet1")
+        conn.close()
+        return
+    loader.finish()
 
-    # Map additional columns if they exist
-    additional_mapping = {
-        'service_rag': 'service_rag',
-        'subcontract_reference': 'subcontract_reference',
-        'tier': 'tier',
-        'contract_name': 'contract_name',
-        'documents_rag': 'documents_rag',
-        'overdue': 'overdue',
-        'category': 'category',
-        'estimated_total_contract_value_exc_vat': 'estimated_total_contract_value',
-        'estimated_total_contract_value': 'estimated_total_contract_value',
-        'elft_contract_lead': 'elft_contract_lead',
-        'contract_lead': 'elft_contract_lead'
-    }
-
-    for old_col, new_col in additional_mapping.items():
-        if old_col in df.columns and new_col not in df_mapped.columns:
-            df_mapped[new_col] = df[old_col]
-
-    df = df_mapped
-    print(f"  Mapped columns: {list(df.columns)}")
-    
-    # Convert dates and clean immediately
-    for col in ['start_date', 'end_date']:
-        if col in df.columns:
-            print(f"  Converting {col} to datetime...")
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-            df[col] = df[col].apply(lambda x: None if pd.isna(x) else x)
-            print(f"    Sample values: {df[col].head(3).tolist()}")
-
-    # Clean currency columns manually
-    currency_cols = ['estimated_total_contract_value', 'budget_2425', 'budget_2526']
-    for col in currency_cols:
-        if col in df.columns:
-            print(f"  Converting {col} to numeric...")
-            # Handle various formats
-            df[col] = df[col].astype(str).str.replace('£', '', regex=False).str.replace(',', '', regex=False).str.replace(' ', '', regex=False).str.strip()
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            print(f"    Sample values: {df[col].head(3).tolist()}")
-
-    # Handle remaining NaN/NaT
-    df = df.astype(object)
-    df = df.where(pd.notnull(df), None)
-    df.replace({np.nan: None, pd.NaT: None}, inplace=True)
-    
-    # Filter valid rows
-    df = df[df['supplier'].notna()]
-    
-    # Get columns
-    columns = [col for col in df.columns if col in column_mapping.values()]
-    
-    # Insert
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    insert_sql = f"""
-        INSERT INTO contracts ({', '.join(columns)})
-        VALUES ({', '.join(['%s'] * len(columns))})
-    """
-    
-    # Manual data preparation
-    data = []
-    for _, row in df.iterrows():
-        row_data = []
-        for col in columns:
-            val = row[col]
-            # Robust check for empty/NaN values
-            if pd.isna(val) or val == '' or str(val).lower() == 'nan' or str(val).lower() == 'nat':
-                val = None
-            row_data.append(val)
-        data.append(tuple(row_data))
-    
-    print(f"Inserting {len(data):,} contracts...")
-    execute_batch(cursor, insert_sql, data, page_size=100)
-    conn.commit()
+    with timer.stage('merge'):
+        changed = apply_staged_rows(cursor, 'contracts', 'contract_id', stage,
+                                    CONTRACT_COLUMNS, CONTRACT_KEY_COLUMNS, mode)
+    with timer.stage('suppliers'):
+        changed += sync_suppliers(cursor)
+        conn.commit()
     
     # Statistics
     cursor.execute("""
@@ -284,13 +719,29 @@ def import_contracts():
         print(f"  Total Value: £{stats[3]:,.2f}")
     
     cursor.close()
+    if changed:
+        with timer.stage('refresh'):
+            refresh_materialized_views(conn, CONTRACT_DEPENDENT_VIEWS)
+        with timer.stage('catalog'):
+            store_catalog(conn)
+        bump_data_version(conn)
     conn.close()
+    timer.report()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import AP transactions and the contracts register")
+    parser.add_argument('target', nargs='?', choices=['ap', 'contracts', 'all'], default='all',
+                        help="What to import (default: all)")
+    parser.add_argument('--mode', choices=IMPORT_MODES, default='incremental',
+                        help="incremental: insert new / update changed rows (default); "
+                             "reload: truncate and load everything")
+    args = parser.parse_args()
+
     try:
-        # AP Transactions already imported successfully
-        # import_ap_transactions()
-        import_contracts()
+        if args.target in ('ap', 'all'):
+            import_ap_transactions(args.mode)
+        if args.target in ('contracts', 'all'):
+            import_contracts(args.mode)
         print("\n" + "="*60)
         print("✓ ALL IMPORTS COMPLETE")
         print("="*60)
@@ -0,0 +1,242 @@
+"""
+Metrics for ELFT Invoice Platform API
+Counters and histograms rendered in the Prometheus text format on /metrics,
+plus a psycopg2 cursor that times every query the pool's connections run.
+Queries are labelled with a fingerprint of their normalized text, so the
+many statements behind one endpoint can be told apart. Each process keeps
+its own metrics.
+"""
+import hashlib
+import re
+import threading
+import time
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from psycopg2 import extensions
+
+from config import SLOW_QUERY_MS
+
+# Latency buckets in seconds (requests, queries and model calls)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Distinct query fingerprints tracked; AI-generated SQL beyond this is counted as 'other'
+MAX_QUERY_FINGERPRINTS = 500
+# Characters of normalized SQL kept in elft_db_query_info
+STATEMENT_LABEL_CHARS = 200
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+class Gauge(Counter):
+    """Value per label set that can go up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, counts in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key + (bound,), cumulative))
+                samples.append((f"{self.name}_sum", key, counts[-1]))
+                samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+class Registry:
+    """Metrics shown on /metrics, plus collectors called at scrape time"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def collector(self, func):
+        """Decorator: func() refreshes gauges just before each scrape"""
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector {collect.__name__} failed: {e}")
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            label_names = metric.labels + (('le',) if metric.kind == 'histogram' else ())
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_label_text(label_names[:len(key)], key)} {value}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    'elft_http_request_duration_seconds', 'Time to produce a response, per route',
+    ('method', 'route', 'status'))
+http_request_db_time = registry.histogram(
+    'elft_http_request_db_seconds', 'Database time spent by one request, per route',
+    ('route',))
+db_query_duration = registry.histogram(
+    'elft_db_query_duration_seconds', 'Query execution time by route and query fingerprint',
+    ('route', 'fingerprint'))
+db_query_rows = registry.counter(
+    'elft_db_query_rows_total', 'Rows returned or affected by route and query fingerprint',
+    ('route', 'fingerprint'))
+db_query_info = registry.gauge(
+    'elft_db_query_info', 'Normalized statement of each query fingerprint',
+    ('fingerprint', 'statement'))
+slow_queries = registry.counter(
+    'elft_db_slow_queries_total', f"Queries slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms)",
+    ('route', 'fingerprint'))
+model_call_duration = registry.histogram(
+    'elft_model_call_duration_seconds', 'Duration of streamed model calls, per chat stage',
+    ('stage',))
+model_first_token = registry.histogram(
+    'elft_model_time_to_first_token_seconds', 'Wait for the first streamed token, per chat stage',
+    ('stage',))
+model_tokens = registry.counter(
+    'elft_model_tokens_total', 'Model tokens used, per chat stage and direction',
+    ('stage', 'direction'))
+model_errors = registry.counter(
+    'elft_model_call_errors_total', 'Model calls that failed, per chat stage',
+    ('stage',))
+ai_sql_duration = registry.histogram(
+    'elft_ai_sql_duration_seconds', 'Time to run AI-generated SQL in the sandbox')
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+
+@lru_cache(maxsize=2048)
+def query_fingerprint(query):
+    """(fingerprint, normalized text): literals, IN lists and spacing don't matter"""
+    text = _COMMENTS.sub(' ', query)
+    text = _LITERALS.sub('?', text)
+    text = _IN_LISTS.sub('(?)', text)
+    text = ' '.join(text.split()).rstrip(';')
+    return hashlib.md5(text.encode()).hexdigest()[:12], text
+
+_fingerprints = set()
+_fingerprints_lock = threading.Lock()
+
+def current_route():
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return 'none'
+
+def record_query(query, seconds, rows):
+    """Account one executed query to its route and fingerprint; log it if slow"""
+    if not isinstance(query, str):
+        query = query.decode() if isinstance(query, bytes) else str(query)
+    fingerprint, text = query_fingerprint(query)
+
+    with _fingerprints_lock:
+        known = fingerprint in _fingerprints
+        if not known and len(_fingerprints) < MAX_QUERY_FINGERPRINTS:
+            _fingerprints.add(fingerprint)
+            known = True
+    if known:
+        db_query_info.set(1, fingerprint=fingerprint, statement=text[:STATEMENT_LABEL_CHARS])
+    else:
+        fingerprint = 'other'
+
+    route = current_route()
+    db_query_duration.observe(seconds, route=route, fingerprint=fingerprint)
+    if rows is not None and rows >= 0:
+        db_query_rows.inc(rows, route=route, fingerprint=fingerprint)
+
+    if has_request_context():
+        g.setdefault('queries', []).append((fingerprint, seconds, rows))
+
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc(route=route, fingerprint=fingerprint)
+        print(f"Slow query ({seconds * 1000:,.0f} ms, {rows} rows) on {route} "
+              f"[{fingerprint}]: {text[:500]}")
+
+class InstrumentedCursor(extensions.cursor):
+    """psycopg2 cursor that records every execute() (pass as cursor_factory)"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started, self.rowcount)
+
+def request_queries():
+    """(fingerprint, seconds, rows) of every query run by the current request"""
+    return g.get('queries', []) if has_request_context() else []
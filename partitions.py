@@ -0,0 +1,145 @@
+"""
+Financial-year partitions of ap_transactions for ELFT Invoice Platform
+ap_transactions is range-partitioned on transaction_date, one partition per
+NHS financial year (1 April - 31 March). The importer creates partitions as
+new years arrive; old years can be detached into an archive schema without
+blocking readers.
+
+Usage:
+    python partitions.py list
+    python partitions.py archive 2022     # FY 2022/23 -> archive schema
+    python partitions.py restore 2022     # re-attach an archived year
+"""
+import argparse
+import re
+from datetime import date
+
+import psycopg2
+
+from config import DB_CONFIG, AP_ARCHIVE_SCHEMA
+
+PARENT_TABLE = 'ap_transactions'
+
+def partition_name(fy):
+    """ap_transactions_fy2024 holds FY 2024/25"""
+    return f"{PARENT_TABLE}_fy{fy}"
+
+def financial_year_bounds(fy):
+    """[start, end) dates of financial year `fy`"""
+    return date(fy, 4, 1), date(fy + 1, 4, 1)
+
+def list_partitions(cursor, schema='public'):
+    """Attached partitions of ap_transactions with their bounds and approximate size"""
+    cursor.execute("""
+        SELECT
+            c.relname,
+            pg_get_expr(c.relpartbound, c.oid) as bounds,
+            c.reltuples::bigint as approx_rows,
+            pg_total_relation_size(c.oid) as total_bytes
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE p.relname = %s AND n.nspname = %s
+        ORDER BY c.relname
+    """, (PARENT_TABLE, schema))
+    partitions = []
+    for name, bounds, approx_rows, total_bytes in cursor.fetchall():
+        match = re.search(r'_fy(\d{4})$', name)
+        partitions.append({
+            'name': name,
+            'fy': int(match.group(1)) if match else None,
+            'bounds': bounds,
+            'approx_rows': max(approx_rows, 0),
+            'total_bytes': total_bytes,
+        })
+    return partitions
+
+def ensure_ap_partitions(cursor, source):
+    """Create a partition for every financial year present in `source`
+
+    Returns the financial years that were created. Creating a partition
+    locks ap_transactions briefly, so callers should commit straight after.
+    """
+    cursor.execute(f"""
+        SELECT DISTINCT EXTRACT(YEAR FROM transaction_date - INTERVAL '3 months')::int
+        FROM {source}
+        WHERE transaction_date IS NOT NULL
+    """)
+    needed = {row[0] for row in cursor.fetchall()}
+    existing = {p['fy'] for p in list_partitions(cursor)}
+
+    created = sorted(needed - existing)
+    for fy in created:
+        start, end = financial_year_bounds(fy)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(fy)}
+            PARTITION OF {PARENT_TABLE}
+            FOR VALUES FROM (%s) TO (%s)
+        """, (start, end))
+        print(f"  ✓ Created partition {partition_name(fy)} ({start} to {end})")
+    return created
+
+def archive_financial_year(conn, fy, schema=AP_ARCHIVE_SCHEMA):
+    """Detach FY `fy` from ap_transactions and move it into `schema`
+
+    DETACH ... CONCURRENTLY only needs a SHARE UPDATE EXCLUSIVE lock, so
+    dashboards keep reading while it runs. If it is interrupted, finish it
+    with ALTER TABLE ap_transactions DETACH PARTITION <name> FINALIZE.
+    """
+    # DETACH CONCURRENTLY cannot run inside a transaction block
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    name = partition_name(fy)
+    if name not in {p['name'] for p in list_partitions(cursor)}:
+        raise ValueError(f"{name} is not attached to {PARENT_TABLE}")
+
+    print(f"Detaching {name}...")
+    cursor.execute(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} CONCURRENTLY")
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+    cursor.execute(f"ALTER TABLE {name} SET SCHEMA {schema}")
+    cursor.close()
+    print(f"✓ Archived {name} as {schema}.{name}")
+
+def restore_financial_year(conn, fy, schema=AP_ARCHIVE_SCHEMA):
+    """Move an archived year back and attach it to ap_transactions again"""
+    name = partition_name(fy)
+    start, end = financial_year_bounds(fy)
+    cursor = conn.cursor()
+    cursor.execute(f"ALTER TABLE {schema}.{name} SET SCHEMA public")
+    # ATTACH takes SHARE UPDATE EXCLUSIVE; the bounds check scans the table
+    cursor.execute(f"""
+        ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name}
+        FOR VALUES FROM (%s) TO (%s)
+    """, (start, end))
+    conn.commit()
+    cursor.close()
+    print(f"✓ Restored {name}")
+
+if __name__ == "__main__":
+    # Imported here because import_data itself imports this module
+    from import_data import AP_DEPENDENT_VIEWS, refresh_materialized_views, bump_data_version
+    from catalog import store_catalog
+
+    parser = argparse.ArgumentParser(description="Manage financial-year partitions of ap_transactions")
+    parser.add_argument('action', choices=['list', 'archive', 'restore'])
+    parser.add_argument('fy', nargs='?', type=int,
+                        help="Financial year start, e.g. 2022 for FY 2022/23")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    if args.action == 'list':
+        for p in list_partitions(conn.cursor()):
+            print(f"{p['name']:<28} {p['approx_rows']:>12,} rows {p['total_bytes'] / 1024 / 1024:>10,.1f} MB  {p['bounds']}")
+    else:
+        if args.fy is None:
+            parser.error(f"{args.action} needs a financial year")
+        if args.action == 'archive':
+            archive_financial_year(conn, args.fy)
+        else:
+            restore_financial_year(conn, args.fy)
+        refresh_materialized_views(conn, AP_DEPENDENT_VIEWS)
+        store_catalog(conn)
+        bump_data_version(conn)
+    conn.close()
@@ -0,0 +1,91 @@
+"""
+Sandboxed execution of AI-generated SQL for ELFT Invoice Platform
+Generated queries run as a single read-only SELECT with a statement timeout,
+are refused up front when the planner's cost estimate is over budget, and are
+read through a server-side cursor that stops at a row and byte limit, so a
+careless `SELECT * FROM ap_transactions` never leaves the database in full.
+"""
+import json
+
+import psycopg2
+import psycopg2.errors
+
+from config import AI_SQL_TIMEOUT_MS, AI_SQL_MAX_COST, AI_SQL_MAX_ROWS, AI_SQL_MAX_RESULT_BYTES
+from db import get_db_connection
+
+FETCH_BATCH_ROWS = 100
+
+class QueryRejected(Exception):
+    """The query was not run (or was stopped) because it broke a sandbox rule"""
+
+def clean_query(sql):
+    """Single SELECT/WITH statement without its trailing semicolon"""
+    query = sql.strip().rstrip(';').strip()
+    if ';' in query:
+        raise QueryRejected("Only a single SQL statement is allowed")
+    first_word = query.split(None, 1)[0].upper() if query else ''
+    if first_word not in ('SELECT', 'WITH'):
+        raise QueryRejected("Only SELECT queries are allowed")
+    return query
+
+def estimated_cost(cursor, query):
+    """Planner's total cost estimate for `query` (EXPLAIN only, nothing is executed)"""
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Total Cost']
+
+def run_readonly_query(sql, max_rows=AI_SQL_MAX_ROWS, max_bytes=AI_SQL_MAX_RESULT_BYTES,
+                       max_cost=AI_SQL_MAX_COST, timeout_ms=AI_SQL_TIMEOUT_MS):
+    """Run generated SQL inside the sandbox; returns (columns, rows, truncated)
+
+    `truncated` is True when the query had more rows than max_rows or its
+    rows went over max_bytes (measured as text). Raises QueryRejected for
+    anything over budget.
+    """
+    query = clean_query(sql)
+
+    with get_db_connection() as conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SET TRANSACTION READ ONLY")
+            cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+
+            cost = estimated_cost(cursor, query)
+            if cost > max_cost:
+                raise QueryRejected(
+                    f"Query is too expensive to run (estimated cost {cost:,.0f}, "
+                    f"limit {max_cost:,.0f}); add filters or aggregate"
+                )
+            cursor.close()
+
+            # Named (server-side) cursor: rows stay in Postgres until fetched
+            cursor = conn.cursor(name='ai_sandbox')
+            cursor.itersize = FETCH_BATCH_ROWS
+            cursor.execute(query)
+
+            rows = []
+            size = 0
+            truncated = False
+            while not truncated:
+                batch = cursor.fetchmany(FETCH_BATCH_ROWS)
+                if not batch:
+                    break
+                for row in batch:
+                    size += sum(len(str(val)) for val in row)
+                    if len(rows) >= max_rows or size > max_bytes:
+                        truncated = True
+                        break
+                    rows.append(row)
+
+            columns = [desc[0] for desc in cursor.description]
+            cursor.close()
+        except psycopg2.errors.QueryCanceled:
+            conn.rollback()
+            raise QueryRejected(f"Query took longer than the {timeout_ms / 1000:g}s limit")
+        finally:
+            if not conn.closed:
+                conn.rollback()
+
+    return columns, rows, truncated
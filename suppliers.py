@@ -0,0 +1,187 @@
+"""
+Supplier master maintenance for ELFT Invoice Platform
+Resolves the raw supplier spellings in ap_transactions.party and contracts.supplier
+to one suppliers row each, so the analytics views can join on integer supplier_id
+"""
+import difflib
+import re
+import unicodedata
+
+from psycopg2.extras import execute_values
+
+from config import SUPPLIER_MATCH_THRESHOLD
+
+# Legal-form words that don't distinguish one supplier from another
+LEGAL_SUFFIXES = {
+    'ltd', 'limited', 'plc', 'llp', 'lp', 'inc', 'incorporated',
+    'co', 'company', 'corp', 'corporation', 'cic',
+}
+
+def normalize_supplier_name(name):
+    """Canonical matching key for a supplier name
+
+    'The Acme Co. Ltd', 'ACME LIMITED' and 'Acme & Co' style variants
+    collapse to the same key: lower-case, accents stripped, '&' -> 'and',
+    punctuation dropped and trailing legal-form words removed.
+    """
+    if name is None:
+        return ''
+    key = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode()
+    key = key.lower().replace('&', ' and ')
+    key = re.sub(r"[.'’]", '', key)
+    key = re.sub(r'[^a-z0-9]+', ' ', key)
+    words = key.split()
+
+    if words and words[0] == 'the' and len(words) > 1:
+        words = words[1:]
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    if len(words) > 1 and words[-1] == 'and':
+        words.pop()
+    return ' '.join(words)
+
+class SupplierResolver:
+    """Maps normalized keys to supplier ids, with fuzzy fallback
+
+    Fuzzy candidates are blocked on the first three characters of the key
+    so each lookup compares against a handful of names, not the whole master.
+    Names whose numbers differ ('Ward 10' vs 'Ward 1') never fuzzy-match.
+    """
+
+    def __init__(self, existing, threshold=SUPPLIER_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.by_key = {}
+        self.blocks = {}
+        for supplier_id, key in existing:
+            self.add(supplier_id, key)
+
+    def add(self, supplier_id, key):
+        self.by_key[key] = supplier_id
+        self.blocks.setdefault(key[:3], []).append(key)
+
+    def resolve(self, key):
+        """Return (supplier_id, match_type, similarity) or None if unknown"""
+        if key in self.by_key:
+            return self.by_key[key], 'exact', 1.0
+        if self.threshold >= 1:
+            return None
+        digits = re.findall(r'\d+', key)
+        candidates = [c for c in self.blocks.get(key[:3], []) if re.findall(r'\d+', c) == digits]
+        matches = difflib.get_close_matches(key, candidates, n=1, cutoff=self.threshold)
+        if matches:
+            similarity = difflib.SequenceMatcher(None, key, matches[0]).ratio()
+            return self.by_key[matches[0]], 'fuzzy', round(similarity, 3)
+        return None
+
+def sync_suppliers(cursor):
+    """Register unseen supplier spellings and stamp supplier_id on both fact tables
+
+    Returns the number of fact rows that were linked to a supplier.
+    """
+    cursor.execute("""
+        SELECT DISTINCT name FROM (
+            SELECT TRIM(party) as name FROM ap_transactions
+            WHERE supplier_id IS NULL AND party IS NOT NULL
+            UNION
+            SELECT TRIM(supplier) FROM contracts
+            WHERE supplier_id IS NULL AND supplier IS NOT NULL
+        ) n
+        WHERE name <> ''
+          AND NOT EXISTS (SELECT 1 FROM supplier_aliases a WHERE a.alias = n.name)
+        ORDER BY name
+    """)
+    new_names = [row[0] for row in cursor.fetchall()]
+
+    if new_names:
+        cursor.execute("SELECT supplier_id, normalized_key FROM suppliers")
+        resolver = SupplierResolver(cursor.fetchall())
+
+        # Unknown keys get provisional negative ids so later spellings in
+        # this batch can still match them; real ids come from one bulk insert
+        aliases = []
+        pending = {}
+        fuzzy = 0
+        for name in new_names:
+            key = normalize_supplier_name(name) or name.lower()
+            match = resolver.resolve(key)
+            if match is None:
+                provisional_id = -(len(pending) + 1)
+                pending[provisional_id] = (name, key)
+                resolver.add(provisional_id, key)
+                match = (provisional_id, 'new', 1.0)
+            elif match[1] == 'fuzzy':
+                fuzzy += 1
+            aliases.append((name,) + match)
+
+        real_ids = {}
+        if pending:
+            inserted = execute_values(cursor, """
+                INSERT INTO suppliers (supplier_name, normalized_key)
+                VALUES %s
+                RETURNING normalized_key, supplier_id
+            """, list(pending.values()), fetch=True)
+            id_by_key = dict(inserted)
+            real_ids = {pid: id_by_key[key] for pid, (name, key) in pending.items()}
+        aliases = [
+            (name, real_ids.get(supplier_id, supplier_id), match_type, similarity)
+            for name, supplier_id, match_type, similarity in aliases
+        ]
+
+        execute_values(cursor, """
+            INSERT INTO supplier_aliases (alias, supplier_id, match_type, similarity)
+            VALUES %s
+            ON CONFLICT (alias) DO NOTHING
+        """, aliases)
+        print(f"  Suppliers: {len(new_names):,} new spellings, {len(pending):,} new suppliers, "
+              f"{fuzzy:,} fuzzy matches")
+
+    cursor.execute("""
+        UPDATE ap_transactions t
+        SET supplier_id = a.supplier_id
+        FROM supplier_aliases a
+        WHERE t.supplier_id IS NULL
+          AND t.party IS NOT NULL
+          AND a.alias = TRIM(t.party)
+    """)
+    linked = cursor.rowcount
+    cursor.execute("""
+        UPDATE contracts c
+        SET supplier_id = a.supplier_id
+        FROM supplier_aliases a
+        WHERE c.supplier_id IS NULL
+          AND c.supplier IS NOT NULL
+          AND a.alias = TRIM(c.supplier)
+    """)
+    linked += cursor.rowcount
+
+    if linked or new_names:
+        refresh_supplier_stats(cursor)
+    return linked
+
+def refresh_supplier_stats(cursor):
+    """Recompute the spend roll-ups stored on the supplier master"""
+    cursor.execute("""
+        UPDATE suppliers s
+        SET
+            total_spend = COALESCE(x.total_spend, 0),
+            transaction_count = COALESCE(x.transaction_count, 0),
+            non_po_percentage = x.non_po_percentage,
+            has_contract = EXISTS (SELECT 1 FROM contracts c WHERE c.supplier_id = s.supplier_id)
+        FROM suppliers s2
+        LEFT JOIN (
+            SELECT
+                supplier_id,
+                SUM(amount_gbp) as total_spend,
+                COUNT(*) as transaction_count,
+                -- Refunds can push the ratio outside DECIMAL(5,2)
+                LEAST(GREATEST(ROUND(
+                    SUM(CASE WHEN source = 'No PO' THEN amount_gbp ELSE 0 END) /
+                    NULLIF(SUM(amount_gbp), 0) * 100,
+                    2
+                ), -999.99), 999.99) as non_po_percentage
+            FROM ap_transactions
+            WHERE supplier_id IS NOT NULL
+            GROUP BY supplier_id
+        ) x ON x.supplier_id = s2.supplier_id
+        WHERE s.supplier_id = s2.supplier_id
+    """)
@@ -0,0 +1,329 @@
+"""
+Deterministic synthetic data for ELFT Invoice Platform
+Fills ap_transactions and contracts (or writes the two source workbooks) with
+production-shaped data at any scale: a long tail of suppliers with a few
+dominating spend, skewed categories and directorates, a PO / No PO split that
+varies by category, the mixed month label formats of the real extract and
+occasional alternative supplier spellings. The same --rows/--seed (and
+--as-of, which contract dates are relative to) always produce the same data,
+so benchmark runs are comparable.
+
+Usage:
+    python synthetic_data.py load --rows 1000000        # replace the data in the database
+    python synthetic_data.py xlsx --rows 100000 --out bench_data
+                                                        # workbooks for import_data.py
+"""
+import argparse
+import os
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from openpyxl import Workbook
+
+from config import DB_CONFIG, IMPORT_CHUNK_ROWS
+from import_data import (AP_COLUMN_MAPPING, AP_DEPENDENT_VIEWS, AP_KEY_COLUMNS, CONTRACT_COLUMNS,
+                         CONTRACT_KEY_COLUMNS, CopyLoader, apply_staged_rows, bump_data_version,
+                         create_staging_table, flag_excluded_periods, refresh_materialized_views)
+from partitions import ensure_ap_partitions
+from suppliers import sync_suppliers
+from catalog import store_catalog
+from duplicates import detect_duplicates
+
+AP_FILE = "mental_health_trust_data_categorized_FINAL.xlsx"
+CONTRACTS_FILE = "Contracts register ELFT - Steering Group KPIs.xlsx"
+# Rows per worksheet Excel can hold (minus the header)
+XLSX_MAX_ROWS = 1_048_575
+
+# (final_category, weight, share of spend without a PO)
+CATEGORIES = [
+    ('Agency', 30, 0.85),
+    ('Drugs', 18, 0.20),
+    ('Clinical Supplies', 12, 0.30),
+    ('Estates', 10, 0.55),
+    ('IT', 8, 0.40),
+    ('Consultancy', 6, 0.75),
+    ('Data', 4, 0.60),
+    ('Facilities', 4, 0.50),
+    ('Transport', 3, 0.70),
+    ('Training', 2, 0.80),
+    ('Utilities', 2, 0.90),
+    ('Legal', 1, 0.95),
+]
+
+DIRECTORATES = [
+    'CORPORATE', 'BEDFORDSHIRE CHS', 'Bedford Directorate', 'TOWER HAMLETS', 'ESTATES & FACILITIES',
+    'PRIMARY CARE', 'SPECIALIST SERVICES', 'CITY & HACKNEY', 'NEWHAM', 'Luton Directorate',
+    'FORENSICS', 'CAMHS', 'PHARMACY', 'ICT', 'FINANCE',
+]
+
+SUBJECTIVES = ['Agency Nursing', 'Drugs', 'Medical Equipment', 'Premises', 'Consultancy',
+               'Computer Software', 'Travel', 'Training', 'Utilities', 'Legal Fees']
+
+# Month label formats seen in the real extract, with how often each appears
+MONTH_LABEL_FORMATS = [('%Y-%m', 0.5), ('%b-%y', 0.25), ('%b-%y upper', 0.15), ('%B %Y', 0.10)]
+
+SUPPLIER_WORDS = ['Acme', 'Northern', 'Thames', 'Bridge', 'Oak', 'Crown', 'Riverside', 'Beacon',
+                  'Summit', 'Meridian', 'Harbour', 'Lime', 'Apex', 'Sterling', 'Albion', 'Phoenix',
+                  'Unity', 'Vantage', 'Kingfisher', 'Orchard']
+SUPPLIER_TRADES = ['Healthcare', 'Staffing', 'Medical', 'Facilities', 'Pharma', 'Care', 'Solutions',
+                   'Services', 'Supplies', 'Consulting', 'Digital', 'Recruitment']
+SUPPLIER_FORMS = ['Ltd', 'Limited', 'LLP', 'plc', '& Co', 'Group']
+
+def zipf_weights(n, exponent=1.07):
+    """Probabilities for ranks 1..n with a long tail (a few values dominate)"""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def supplier_pool(rows, seed):
+    """Supplier names (most important first) and an alternative spelling of each"""
+    count = min(20_000, max(200, rows // 500))
+    rng = np.random.default_rng([seed, 0])
+    names = []
+    for i in range(count):
+        word = SUPPLIER_WORDS[i % len(SUPPLIER_WORDS)]
+        trade = SUPPLIER_TRADES[(i // len(SUPPLIER_WORDS)) % len(SUPPLIER_TRADES)]
+        form = SUPPLIER_FORMS[rng.integers(len(SUPPLIER_FORMS))]
+        # Beyond the word combinations, a branch number keeps names distinct
+        series = i // (len(SUPPLIER_WORDS) * len(SUPPLIER_TRADES))
+        names.append(f"{word} {trade}{f' {series}' if series else ''} {form}")
+    variants = [name.upper() if i % 2 else name.replace(' Ltd', ' Limited').replace(' plc', ' PLC')
+                for i, name in enumerate(names)]
+    return np.array(names, dtype=object), np.array(variants, dtype=object)
+
+def month_starts(first_fy, years):
+    return pd.date_range(date(first_fy, 4, 1), periods=12 * years, freq='MS')
+
+def month_labels(months):
+    """Label of every month in every format: array[month, format]"""
+    labels = []
+    for fmt, _ in MONTH_LABEL_FORMATS:
+        if fmt.endswith(' upper'):
+            labels.append(months.strftime(fmt.split()[0]).str.upper())
+        else:
+            labels.append(months.strftime(fmt))
+    return np.array(labels, dtype=object).T
+
+def generate_ap_batches(rows, seed=42, first_fy=2023, years=2, batch_rows=IMPORT_CHUNK_ROWS):
+    """Yield DataFrames of ap_transactions rows (database column names)"""
+    names, variants = supplier_pool(rows, seed)
+    supplier_p = zipf_weights(len(names))
+    category_names = np.array([c[0] for c in CATEGORIES], dtype=object)
+    category_p = np.array([c[1] for c in CATEGORIES], dtype=float)
+    category_p /= category_p.sum()
+    no_po_rate = np.array([c[2] for c in CATEGORIES])
+    directorates = np.array(DIRECTORATES, dtype=object)
+    directorate_p = zipf_weights(len(DIRECTORATES), 0.8)
+    subjectives = np.array(SUBJECTIVES, dtype=object)
+
+    months = month_starts(first_fy, years)
+    labels = month_labels(months)
+    label_p = np.array([p for _, p in MONTH_LABEL_FORMATS])
+    # Spend grows a little over the period
+    month_p = np.linspace(0.8, 1.2, len(months))
+    month_p /= month_p.sum()
+    month_days = months.days_in_month.to_numpy()
+    month_values = months.to_numpy().astype('datetime64[D]')
+    financial_years = np.array([f"{m.year - (m.month < 4)}/{(m.year - (m.month < 4) + 1) % 100:02d}"
+                                for m in months], dtype=object)
+
+    for batch_no, start in enumerate(range(0, rows, batch_rows)):
+        n = min(batch_rows, rows - start)
+        rng = np.random.default_rng([seed, 1, batch_no])
+
+        supplier = rng.choice(len(names), size=n, p=supplier_p)
+        party = np.where(rng.random(n) < 0.05, variants[supplier], names[supplier])
+        category = rng.choice(len(category_names), size=n, p=category_p)
+        no_po = rng.random(n) < no_po_rate[category]
+        month = rng.choice(len(months), size=n, p=month_p)
+        label = labels[month, rng.choice(len(label_p), size=n, p=label_p)]
+
+        days = (rng.random(n) * month_days[month]).astype(int)
+        transaction_date = pd.Series(month_values[month] + days).astype('datetime64[ns]')
+        transaction_date[rng.random(n) < 0.01] = pd.NaT
+
+        amount = np.round(rng.lognormal(6.0, 1.6, n), 2).clip(0.01, 5_000_000)
+        amount = np.where(rng.random(n) < 0.02, -amount, amount)
+
+        directorate = directorates[rng.choice(len(directorates), size=n, p=directorate_p)]
+        directorate = np.where(rng.random(n) < 0.02, None, directorate)
+        ids = np.arange(start, start + n)
+
+        df = pd.DataFrame({
+            'subjective_name': subjectives[category % len(subjectives)],
+            'amount_gbp': amount,
+            'month': label,
+            'transaction_date': transaction_date,
+            'party': party,
+            'source_transaction': pd.Series(ids).map('AP{:09d}'.format),
+            'description': category_names[category] + ' invoice ' + pd.Series(ids % 9973).astype(str),
+            'source': np.where(no_po, 'No PO', 'PO'),
+            'financial_year': financial_years[month],
+            'period': months[month],
+            'month_1': labels[month, 1],
+            'directorate': directorate,
+            'cost_centre_description': pd.Series(directorate) + ' CC' + pd.Series(supplier % 40).astype(str),
+            'category': category_names[category],
+            'spend_category': category_names[category],
+            'final_category': category_names[category],
+            'non_po_flag': np.where(no_po, 'Y', 'N'),
+        })
+        df['period_month'] = df['period']
+        df['transaction_date'] = df['transaction_date'].fillna(df['period_month'])
+        yield df
+
+def generate_contracts(rows, seed=42, as_of=None):
+    """DataFrame of contracts rows (database column names), sized to the AP volume"""
+    names, variants = supplier_pool(rows, seed)
+    count = min(20_000, max(50, rows // 2000))
+    rng = np.random.default_rng([seed, 2])
+    today = np.datetime64(as_of or date.today(), 'D')
+
+    supplier = rng.choice(len(names), size=count, p=zipf_weights(len(names)))
+    category = np.array([c[0] for c in CATEGORIES], dtype=object)[rng.integers(len(CATEGORIES), size=count)]
+    # Contracts started up to five years ago and run one to five years,
+    # so the register holds expired, expiring and long-running contracts
+    start = today - rng.integers(30, 5 * 365, size=count)
+    end = start + rng.integers(365, 5 * 365, size=count)
+    budget = np.round(rng.lognormal(11.5, 1.2, count), 2)
+    ids = np.arange(1, count + 1)
+
+    return pd.DataFrame({
+        'supplier': np.where(rng.random(count) < 0.1, variants[supplier], names[supplier]),
+        'start_date': pd.Series(start).astype('datetime64[ns]'),
+        'end_date': pd.Series(end).astype('datetime64[ns]'),
+        'budget_2425': budget,
+        'budget_2526': np.round(budget * rng.uniform(0.9, 1.15, count), 2),
+        'service_rag': np.array(['Green', 'Amber', 'Red'], dtype=object)[rng.choice(3, size=count, p=[0.6, 0.3, 0.1])],
+        'subcontract_reference': pd.Series(ids).map('ELFT-C{:05d}'.format),
+        'tier': np.array(['Tier 1', 'Tier 2', 'Tier 3'], dtype=object)[rng.integers(3, size=count)],
+        'contract_name': category + ' services - ' + names[supplier],
+        'documents_rag': np.array(['Green', 'Amber', 'Red'], dtype=object)[rng.integers(3, size=count)],
+        'overdue': np.where(end < today, 'Yes', 'No'),
+        'category': category,
+        'estimated_total_contract_value': np.round(budget * rng.uniform(1, 5, count), 2),
+        'elft_contract_lead': pd.Series(ids % 25).map('Lead {}'.format),
+    })
+
+def load_database(rows, seed, first_fy, years, as_of=None):
+    """Replace ap_transactions, contracts and the supplier master with synthetic data"""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    started = time.perf_counter()
+
+    print(f"Replacing data in {DB_CONFIG['database']} with {rows:,} synthetic AP rows")
+    cursor.execute("TRUNCATE ap_transactions, contracts, duplicate_invoices, supplier_aliases, suppliers "
+                   "RESTART IDENTITY")
+
+    ap_columns = list(AP_COLUMN_MAPPING.values()) + ['period_month']
+    stage = create_staging_table(cursor, 'ap_transactions', ap_columns)
+    loader = None
+    for df in generate_ap_batches(rows, seed, first_fy, years):
+        if loader is None:
+            loader = CopyLoader(cursor, stage, [col for col in ap_columns if col in df.columns])
+        loader.write(df)
+    loader.finish()
+    ensure_ap_partitions(cursor, stage)
+    apply_staged_rows(cursor, 'ap_transactions', 'transaction_id', stage, ap_columns, AP_KEY_COLUMNS)
+
+    contracts = generate_contracts(rows, seed, as_of)
+    stage = create_staging_table(cursor, 'contracts', CONTRACT_COLUMNS)
+    loader = CopyLoader(cursor, stage, CONTRACT_COLUMNS)
+    loader.write(contracts)
+    loader.finish()
+    apply_staged_rows(cursor, 'contracts', 'contract_id', stage, CONTRACT_COLUMNS, CONTRACT_KEY_COLUMNS)
+
+    flag_excluded_periods(cursor)
+    sync_suppliers(cursor)
+    conn.commit()
+    cursor.close()
+
+    detect_duplicates(conn, full=True)
+    refresh_materialized_views(conn, AP_DEPENDENT_VIEWS)
+    store_catalog(conn)
+    bump_data_version(conn)
+    conn.close()
+    print(f"✓ Loaded in {time.perf_counter() - started:.1f}s")
+
+def _excel_header(column):
+    return 'Amount £' if column == 'amount_£' else column.replace('_', ' ').title()
+
+def _append_rows(sheet, df):
+    values = df.astype(object).where(df.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        sheet.append(row)
+
+def write_workbooks(rows, seed, first_fy, years, out_dir, as_of=None):
+    """Write the AP extract and contracts register in the layout import_data.py reads"""
+    if rows > XLSX_MAX_ROWS:
+        raise SystemExit(f"A worksheet holds at most {XLSX_MAX_ROWS:,} rows; use `load` for larger volumes")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # AP extract: header on the first row, Excel column names
+    excel_names = {db: excel for excel, db in AP_COLUMN_MAPPING.items()}
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    columns = None
+    for df in generate_ap_batches(rows, seed, first_fy, years):
+        df = df.drop(columns=['period_month'])
+        if columns is None:
+            columns = list(df.columns)
+            sheet.append([_excel_header(excel_names[col]) for col in columns])
+        _append_rows(sheet, df)
+    ap_path = os.path.join(out_dir, AP_FILE)
+    workbook.save(ap_path)
+    print(f"✓ Wrote {rows:,} AP rows to {ap_path}")
+
+    # Contracts register: title rows above the header, key columns where the
+    # real register has them (E, G, H, AR, AS); the importer matches headers by name
+    contracts = generate_contracts(rows, seed, as_of)
+    contracts['budget_2425'] = contracts['budget_2425'].map('£{:,.2f}'.format)
+    header = [f"Column {i + 1}" for i in range(45)]
+    positions = {4: 'supplier', 6: 'start_date', 7: 'end_date', 43: 'budget_2425', 44: 'budget_2526',
+                 0: 'service_rag', 1: 'subcontract_reference', 2: 'tier', 3: 'contract_name',
+                 5: 'documents_rag', 8: 'overdue', 9: 'category',
+                 10: 'estimated_total_contract_value', 11: 'elft_contract_lead'}
+    titles = {'budget_2425': '24/25 Budget', 'budget_2526': '25/26 Budget', 'service_rag': 'Service RAG',
+              'documents_rag': 'Documents RAG', 'elft_contract_lead': 'ELFT Contract Lead',
+              'estimated_total_contract_value': 'Estimated Total Contract Value (exc VAT)'}
+    for position, column in positions.items():
+        header[position] = titles.get(column, column.replace('_', ' ').title())
+
+    table = pd.DataFrame(index=contracts.index, columns=range(45), dtype=object)
+    for position, column in positions.items():
+        table[position] = contracts[column]
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(['ELFT Contracts Register'])
+    sheet.append(['Steering Group KPIs (synthetic)'])
+    sheet.append(header)
+    _append_rows(sheet, table)
+    contracts_path = os.path.join(out_dir, CONTRACTS_FILE)
+    workbook.save(contracts_path)
+    print(f"✓ Wrote {len(contracts):,} contracts to {contracts_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic AP and contracts data")
+    parser.add_argument('target', choices=['load', 'xlsx'],
+                        help="load: replace the data in the database; xlsx: write source workbooks")
+    parser.add_argument('--rows', type=int, default=100_000, help="AP transaction rows (default: 100,000)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--first-fy', type=int, default=2023, help="First financial year (default: 2023)")
+    parser.add_argument('--years', type=int, default=2, help="Financial years of data (default: 2)")
+    parser.add_argument('--as-of', type=date.fromisoformat,
+                        help="Date contract start/end dates are relative to (default: today)")
+    parser.add_argument('--out', default='bench_data', help="Directory for the xlsx target")
+    parser.add_argument('--allow-remote', action='store_true',
+                        help="Allow `load` against a database that is not on localhost")
+    args = parser.parse_args()
+
+    if args.target == 'load':
+        if not args.allow_remote and DB_CONFIG['host'] not in ('localhost', '127.0.0.1', '::1'):
+            raise SystemExit(f"Refusing to replace the data on {DB_CONFIG['host']}; "
+                             "pass --allow-remote to do it anyway")
+        load_database(args.rows, args.seed, args.first_fy, args.years, args.as_of)
+    else:
+        write_workbooks(args.rows, args.seed, args.first_fy, args.years, args.out, args.as_of)
@@ -0,0 +1,28 @@
+import os
+import sys
+
+# The app is a set of top-level modules; make them importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+import pytest
+
+from db import get_db_connection
+
+def database_available():
+    try:
+        with get_db_connection():
+            return True
+    except psycopg2.OperationalError:
+        return False
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'database: reads or writes the configured database')
+
+def pytest_collection_modifyitems(config, items):
+    """Skip tests marked `database` when the configured database can't be reached"""
+    database_items = [item for item in items if item.get_closest_marker('database')]
+    if database_items and not database_available():
+        skip = pytest.mark.skip(reason="database not available")
+        for item in database_items:
+            item.add_marker(skip)
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ai_assistant
+from ai_assistant import StubClient, chat_events
+
+@pytest.fixture
+def data_version(monkeypatch):
+    """A data version the test can move, as an import would"""
+    version = SimpleNamespace(value=1)
+    monkeypatch.setattr(ai_assistant, 'data_version', SimpleNamespace(current=lambda: (version.value, None)))
+    monkeypatch.setattr(ai_assistant, 'system_prompt', lambda: 'schema')
+    ai_assistant.question_cache.clear()
+    ai_assistant.result_cache.clear()
+    return version
+
+def ask(client, question):
+    execute_sql = lambda sql: (['final_category', 'total_spend'], [('Agency', 100)], False)
+    return list(chat_events(client, question, execute_sql))
+
+def test_question_cache_is_dropped_after_an_import(data_version):
+    client = StubClient()
+    ask(client, 'Top categories?')
+    events = ask(client, 'top categories')
+    assert events[0][1].get('cached')
+    assert len(client.calls) == 3
+
+    data_version.value += 1
+    events = ask(client, 'Top categories?')
+    assert not events[0][1].get('cached')
+    assert len(client.calls) == 5
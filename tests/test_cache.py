@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+import pytest
+from flask import Flask, jsonify
+
+import cache
+from db import get_db_connection
+
+pytestmark = pytest.mark.database
+
+@pytest.fixture
+def stamped_outside_gmt():
+    """Bump data_version.changed_at from a session in a non-UTC time zone; restored afterwards"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT changed_at FROM data_version")
+        original = cursor.fetchone()[0]
+        cursor.execute("SET LOCAL TimeZone TO 'Asia/Kolkata'")
+        cursor.execute("UPDATE data_version SET changed_at = CURRENT_TIMESTAMP")
+        cursor.execute("SELECT EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)")
+        changed_at = datetime.fromtimestamp(int(cursor.fetchone()[0]), timezone.utc)
+        conn.commit()
+    yield changed_at
+    with get_db_connection() as conn:
+        conn.cursor().execute("UPDATE data_version SET changed_at = %s", (original,))
+        conn.commit()
+
+def test_last_modified_is_gmt(stamped_outside_gmt, monkeypatch):
+    monkeypatch.setattr(cache, 'data_version', cache.DataVersion(check_interval=0))
+    app = Flask(__name__)
+
+    @app.route('/view')
+    @cache.cached_response
+    def view():
+        return jsonify({'ok': True})
+
+    response = app.test_client().get('/view')
+
+    assert response.last_modified == stamped_outside_gmt
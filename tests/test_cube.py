@@ -0,0 +1,40 @@
+import pytest
+
+from cube import load_cube
+from db import get_db_connection
+
+MONTHLY_TREND_QUERY = """
+    SELECT month, total_spend, non_po_spend, po_spend, non_po_percentage
+    FROM mv_monthly_dashboard
+    WHERE NOT is_excluded
+    ORDER BY period_month
+"""
+
+pytestmark = pytest.mark.database
+
+@pytest.fixture
+def cursor():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        yield cursor
+        conn.rollback()
+
+def test_monthly_trend_matches_materialized_view(cursor):
+    # Rows whose source disagrees with non_po_flag, or is NULL, must land
+    # where vw_monthly_dashboard puts them. Rolled back with the fixture.
+    cursor.execute("SELECT COUNT(*) FROM ap_transactions WHERE NOT is_excluded")
+    if cursor.fetchone()[0] < 40:
+        pytest.skip("no AP transactions loaded")
+    cursor.execute("""
+        UPDATE ap_transactions SET source = CASE transaction_id % 4
+            WHEN 0 THEN NULL WHEN 1 THEN 'Interface Invoice' WHEN 2 THEN 'PO' ELSE 'No PO' END
+        WHERE transaction_id % 10 = 0
+    """)
+    cursor.execute("REFRESH MATERIALIZED VIEW mv_monthly_dashboard")
+    cursor.execute(MONTHLY_TREND_QUERY)
+    columns = [desc[0] for desc in cursor.description]
+    expected = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    cube, _ = load_cube(cursor, version=None)
+
+    assert cube.monthly_trend() == expected
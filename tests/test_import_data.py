@@ -0,0 +1,49 @@
+from datetime import date, datetime
+
+import pandas as pd
+from openpyxl import Workbook
+
+from import_data import iter_sheet_batches, map_contract_batch, match_contract_headers
+
+HEADER = ['Supplier', 'Contract Name', 'Start Date', 'End Date']
+
+def write_register(path, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'Sheet1'
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+def read_register(path):
+    batches = list(iter_sheet_batches(path, sheet_name='Sheet1'))
+    column_map = match_contract_headers(batches[0].columns)
+    return pd.concat(map_contract_batch(batch, column_map) for batch in batches)
+
+def test_date_cells_are_kept(tmp_path):
+    path = write_register(tmp_path / 'register.xlsx', [
+        ['Acme Ltd', 'Cleaning', datetime(2024, 4, 1), datetime(2027, 3, 31)],
+        ['Beta plc', 'Catering', datetime(2023, 10, 15), datetime(2025, 10, 14)],
+    ])
+    contracts = read_register(path)
+
+    assert list(contracts['start_date']) == [pd.Timestamp(2024, 4, 1), pd.Timestamp(2023, 10, 15)]
+    assert list(contracts['end_date']) == [pd.Timestamp(2027, 3, 31), pd.Timestamp(2025, 10, 14)]
+
+def test_mixed_date_cells_serials_and_text(tmp_path):
+    path = write_register(tmp_path / 'register.xlsx', [
+        ['Acme Ltd', 'Cleaning', datetime(2024, 4, 1), '31/03/2027'],
+        ['Beta plc', 'Catering', 45383, '2025-10-14'],
+        ['Gamma LLP', 'Security', date(2023, 10, 15), 'n/a'],
+        ['Delta Ltd', 'Laundry', None, '1 Apr 2026'],
+    ])
+    contracts = read_register(path)
+
+    assert list(contracts['start_date'][:3]) == [
+        pd.Timestamp(2024, 4, 1), pd.Timestamp(2024, 4, 1), pd.Timestamp(2023, 10, 15)]
+    assert pd.isna(contracts['start_date'].iloc[3])
+    assert list(contracts['end_date'].iloc[[0, 1, 3]]) == [
+        pd.Timestamp(2027, 3, 31), pd.Timestamp(2025, 10, 14), pd.Timestamp(2026, 4, 1)]
+    assert pd.isna(contracts['end_date'].iloc[2])
@@ -5,7 +5,10 @@
 DROP VIEW IF EXISTS vw_monthly_dashboard CASCADE;
 CREATE VIEW vw_monthly_dashboard AS
 SELECT
-    month,
+    period_month,
+    TO_CHAR(period_month, 'Mon-YY') as month,
+    -- Every row of a period shares its flag (see import_data.flag_excluded_periods)
+    BOOL_AND(is_excluded) as is_excluded,
     COUNT(*) as total_transactions,
     COUNT(DISTINCT party) as unique_suppliers,
     SUM(amount_gbp) as total_spend,
@@ -18,8 +21,8 @@ SELECT
         2
     ) as non_po_percentage
 FROM ap_transactions
-GROUP BY month
-ORDER BY month;
+GROUP BY period_month
+ORDER BY period_month;
 
 -- Drop and recreate vw_non_po_analysis
 DROP VIEW IF EXISTS vw_non_po_analysis CASCADE;
@@ -60,8 +63,9 @@ SELECT
         2
     ) as non_po_percentage
 FROM ap_transactions ap
-LEFT JOIN contracts c ON LOWER(TRIM(ap.party)) = LOWER(TRIM(c.supplier))
-WHERE c.contract_id IS NULL
+WHERE NOT EXISTS (
+    SELECT 1 FROM contracts c WHERE c.supplier_id = ap.supplier_id
+)
 GROUP BY ap.party, ap.final_category, ap.directorate
 HAVING SUM(ap.amount_gbp) > 5000
 ORDER BY total_spend DESC;
@@ -86,6 +90,9 @@ GROUP BY final_category
 HAVING SUM(amount_gbp) > 0
 ORDER BY total_spend DESC;
 
+-- Recreate the materialized views dropped by the CASCADEs above
+\ir database/materialized_views.sql
+
 -- Grant permissions
 GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA public TO contract_admin;
 